@@ -0,0 +1,239 @@
+"""End-to-end turn-latency benchmark for the DreamForge roleplay and chat modes.
+
+Drives the real app through scripted sessions with Streamlit's AppTest against the
+offline stub backend (LLM_BACKEND = "stub"), so no network or API key is needed.
+Each roleplay turn goes through handle_send, generate_choices and the story
+renderer (clean_story_response / format_story_block); each chat turn goes through
+the chat Send path. Per session it reports p50/p95 wall time, Python CPU time,
+prompt bytes per turn and LLM calls per turn, and writes everything to JSON so
+runs from different versions can be compared.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --turns 10 50 200 --latency 0.05 --output benchmark_results.json
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from streamlit.testing.v1 import AppTest
+
+# AppTest drives the script outside a browser session; its "missing ScriptRunContext" warnings are noise here
+logging.disable(logging.WARNING)
+
+# Importing the app runs its script once in bare mode, where every Streamlit call is a no-op
+from sekai_creation_agent_app import percentile
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sekai_creation_agent_app.py")
+MODES = ["explore", "goal", "chat"]
+
+WORLD_JSON = {
+    "title": "The Lantern Isles",
+    "setting": "A chain of floating islands lit by living lanterns.",
+    "genre": "Fantasy",
+    "keywords": "lanterns, sky, mystery",
+    "characters": [
+        {"name": "Alex", "role": "Player", "description": "Curious and brave"},
+        {"name": "Mira", "role": "Guide", "description": "Wise and patient", "voice_style": "Soft", "relationship": "Old friend"},
+        {"name": "Tobin", "role": "Smuggler", "description": "Charming and evasive", "voice_style": "Quick", "relationship": "Rival"},
+    ],
+    "openingScene": "The player wakes on a drifting island.",
+    "storyTone": "Balanced",
+    "pacing": "Balanced",
+    "pointOfView": "Third person",
+    "narrationStyle": "Balanced",
+}
+GAMEPLAY_MODES = {
+    "explore": ("🌍 Explore the World", {"exploration_locations": "the Clocktower, the Old Harbor", "exploration_chapters": "The Arrival, The Hidden Door"}),
+    "goal": ("🎯 Achieve a Goal", {"main_goal": "Find the lost lantern key", "success_condition": "The key is returned"}),
+}
+PLAYER_ACTIONS = [
+    "*search the room for hidden doors*",
+    "Mira, what do you know about the Clocktower?",
+    "*follow the footsteps into the dark*",
+    "Tobin, why are you really here?",
+]
+CHAT_MESSAGES = [
+    "(waves) Hi! How was your day?",
+    "Tell me about the place you grew up.",
+    "(laughs) I can't believe you said that.",
+    "I found an old map today. Want to look at it with me?",
+]
+
+
+def read_new_calls(call_log, offset):
+    """Call records appended to the stub call log since offset, and the new offset"""
+    if not os.path.exists(call_log):
+        return [], offset
+    with open(call_log, encoding="utf-8") as log_file:
+        log_file.seek(offset)
+        lines = log_file.readlines()
+        offset = log_file.tell()
+    return [json.loads(line) for line in lines if line.strip()], offset
+
+
+def click(at, label_prefix):
+    """Click the first button whose label starts with label_prefix and rerun"""
+    button = next(b for b in at.button if b.label.startswith(label_prefix))
+    button.click().run()
+
+
+def start_session(mode):
+    """AppTest positioned at the first player turn of a roleplay game or a character chat"""
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.secrets["GEMINI_API_KEY"] = "offline-benchmark"
+    if mode == "chat":
+        at.session_state["app_mode"] = "character"
+        at.session_state["char_name_input"] = "Luna"
+        at.session_state["char_role_input"] = "Stargazer"
+        at.session_state["char_traits_input"] = "Dreamy, kind and a little mischievous"
+        at.run()
+        click(at, "🔮 Start Chat")
+    else:
+        gameplay_mode, mode_details = GAMEPLAY_MODES[mode]
+        at.session_state["app_mode"] = "roleplay"
+        at.session_state["world_json"] = dict(WORLD_JSON, gameplayMode=gameplay_mode, modeDetails=mode_details)
+        at.session_state["user_name"] = "Alex"
+        at.session_state["gameplay_mode"] = gameplay_mode
+        if mode == "goal":
+            at.session_state["goal_main"] = mode_details["main_goal"]
+            at.session_state["goal_success"] = mode_details["success_condition"]
+        at.run()
+        click(at, "🎮 Start Game")
+    if at.exception:
+        raise RuntimeError(f"{mode}: session failed to start: {at.exception[0].value}")
+    return at
+
+
+def play_turn(at, mode, turn):
+    """One scripted player turn: alternate typed input with clicking the first suggested choice"""
+    if mode == "chat":
+        at.text_input(key="char_chat_input").input(CHAT_MESSAGES[turn % len(CHAT_MESSAGES)])
+        click(at, "📩 Send")
+    elif turn % 2 and any(b.label.startswith("Choice 1") for b in at.button):
+        click(at, "Choice 1")
+    else:
+        at.text_input(key="reply_input").input(PLAYER_ACTIONS[turn % len(PLAYER_ACTIONS)])
+        click(at, "Send")
+
+
+def run_session(mode, turns, call_log):
+    """Play one scripted session and summarize its per-turn measurements"""
+    at = start_session(mode)
+    _, offset = read_new_calls(call_log, 0)
+    samples = []
+    for turn in range(turns):
+        cpu_started = time.process_time()
+        wall_started = time.perf_counter()
+        play_turn(at, mode, turn)
+        wall = time.perf_counter() - wall_started
+        cpu = time.process_time() - cpu_started
+        if at.exception:
+            raise RuntimeError(f"{mode}: turn {turn} raised: {at.exception[0].value}")
+        calls, offset = read_new_calls(call_log, offset)
+        samples.append({
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            "llm_calls": len(calls),
+            "prompt_bytes": sum(call["prompt_bytes"] for call in calls),
+            "max_prompt_bytes": max((call["prompt_bytes"] for call in calls), default=0),
+        })
+    return summarize(mode, turns, samples)
+
+
+def summarize(mode, turns, samples):
+    def stats(field):
+        values = [sample[field] for sample in samples]
+        return {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "mean": sum(values) / len(values),
+            "max": max(values),
+        }
+
+    return {
+        "mode": mode,
+        "turns": turns,
+        "wall_seconds": stats("wall_seconds"),
+        "cpu_seconds": stats("cpu_seconds"),
+        "llm_calls_per_turn": stats("llm_calls"),
+        "prompt_bytes_per_turn": stats("prompt_bytes"),
+        "max_prompt_bytes": stats("max_prompt_bytes"),
+        "last_turn": samples[-1],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(APP_PATH), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 50, 200], help="session lengths to run")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per LLM call")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of LLM calls that fail (0-1)")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="client-side rate limit (0 = off)")
+    parser.add_argument("--combined-turns", action="store_true", help="ask for each roleplay turn and its bookkeeping in one JSON call")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--label", default="", help="free-form label stored with the results, e.g. a branch name")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    call_log = os.path.join(tempfile.mkdtemp(prefix="dreamforge-bench-"), "calls.jsonl")
+    os.environ.update({
+        "DREAMFORGE_LLM_BACKEND": "stub",
+        "DREAMFORGE_STUB_LATENCY_SECONDS": str(args.latency),
+        "DREAMFORGE_STUB_FAILURE_RATE": str(args.failure_rate),
+        "DREAMFORGE_STUB_CALL_LOG": call_log,
+        "DREAMFORGE_LLM_REQUESTS_PER_MINUTE": str(args.requests_per_minute),
+        "DREAMFORGE_COMBINED_TURNS": str(args.combined_turns),
+    })
+    # Creation-step generations share an on-disk cache; keep benchmark runs out of the real one
+    os.chdir(os.path.dirname(call_log))
+
+    results = []
+    for mode in args.modes:
+        for turns in args.turns:
+            started = time.perf_counter()
+            result = run_session(mode, turns, call_log)
+            results.append(result)
+            print(
+                f"{mode:>8} {turns:>4} turns: wall p50 {result['wall_seconds']['p50']:.3f}s p95 {result['wall_seconds']['p95']:.3f}s | "
+                f"cpu p50 {result['cpu_seconds']['p50']:.3f}s | calls/turn {result['llm_calls_per_turn']['mean']:.2f} | "
+                f"prompt bytes/turn p50 {result['prompt_bytes_per_turn']['p50']:.0f} "
+                f"({time.perf_counter() - started:.1f}s)",
+                file=sys.stderr,
+            )
+
+    report = {
+        "label": args.label,
+        "revision": git_revision(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "settings": {
+            "latency_seconds": args.latency,
+            "failure_rate": args.failure_rate,
+            "requests_per_minute": args.requests_per_minute,
+            "combined_turns": args.combined_turns,
+        },
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
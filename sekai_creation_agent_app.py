@@ -1,8 +1,22 @@
 import streamlit as st
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import bisect
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import os
 import random
 import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from streamlit.errors import StreamlitAPIException
+import numpy as np
 
 # Add custom CSS for animated feedback
 st.markdown("""
@@ -101,6 +115,1421 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# --- Gemini Model Registry ---
+# The single place where the Gemini model is selected. Handles are cached with
+# st.cache_resource so every session in the process shares them and no request
+# path pays for re-configuring the SDK or re-constructing a model.
+GEMINI_MODEL_NAME = "gemini-2.5-flash-lite-preview-06-17"
+
+@st.cache_resource(show_spinner=False)
+def _configure_gemini(api_key):
+    genai.configure(api_key=api_key)
+    return True
+
+@st.cache_resource(show_spinner=False)
+def _load_gemini_model(model_name, generation_config_key):
+    generation_config = json.loads(generation_config_key) if generation_config_key else None
+    return genai.GenerativeModel(model_name, generation_config=generation_config)
+
+def get_setting(name, default):
+    """Deployment setting from the environment (DREAMFORGE_<NAME>) or st.secrets, else default"""
+    value = os.environ.get(f"DREAMFORGE_{name}")
+    if value is None:
+        try:
+            value = st.secrets.get(name)
+        except Exception:
+            # No secrets.toml at all
+            value = None
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, (int, float)):
+        return type(default)(value)
+    return value
+
+# --- Offline Stub Backend ---
+# A deterministic stand-in for Gemini so the whole app can be benchmarked and load-tested
+# without network or quota. Select it with LLM_BACKEND = "stub" in secrets.toml or
+# DREAMFORGE_LLM_BACKEND=stub in the environment. Responses follow the formats the
+# parsers expect and are seeded by the prompt, so the same prompt gives the same answer.
+STUB_LATENCY_SECONDS = get_setting("STUB_LATENCY_SECONDS", 0.0)   # simulated time per call
+STUB_FAILURE_RATE = get_setting("STUB_FAILURE_RATE", 0.0)         # share of calls that raise (0-1)
+STUB_CALL_LOG = get_setting("STUB_CALL_LOG", "")                 # JSON-lines file recording each call (benchmarks)
+STUB_STREAM_CHUNK_WORDS = 8
+
+STUB_NAMES = ["Mira", "Tobin", "Selene", "Oren", "Lyra", "Caspian", "Wren", "Dorian"]
+STUB_ROLES = ["Healer", "Blacksmith", "Librarian", "Sky Pirate", "Oracle", "Ranger"]
+STUB_PLACES = ["the Whispering Library", "the Sunken Market", "the Clocktower", "the Glass Forest", "the Old Harbor"]
+STUB_EXPRESSIONS = ["curious", "worried", "smiling", "serious", "surprised"]
+STUB_SENTENCES = [
+    "A cold wind carries the smell of rain through the narrow streets.",
+    "Lanterns flicker as footsteps echo somewhere behind the walls.",
+    "Something hidden beneath the floorboards hums with a faint light.",
+    "The crowd parts to let a hooded stranger pass.",
+    "An old map on the table has one location circled in red ink.",
+]
+
+class StubBackendError(ConnectionError):
+    """Injected transient failure from the offline stub backend"""
+
+class StubResponse:
+    """Minimal stand-in for a Gemini response or stream chunk"""
+
+    def __init__(self, text):
+        self.text = text
+
+class StubModel:
+    """Offline model with the generate_content interface used by the app"""
+
+    def __init__(self, model_name, generation_config=None):
+        self.model_name = model_name
+        self._generation_config = generation_config or {}
+        self._failure_rng = random.Random()
+        self._log_lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and STUB_LATENCY_SECONDS > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("Stub call exceeded its deadline")
+        failed = self._failure_rng.random() < STUB_FAILURE_RATE
+        text = "" if failed else self.respond(prompt)
+        if STUB_CALL_LOG:
+            self._log_call(prompt, text, stream, failed)
+        if failed:
+            time.sleep(STUB_LATENCY_SECONDS / 2)
+            raise StubBackendError("Injected stub backend failure")
+        if stream:
+            return self._stream(text)
+        time.sleep(STUB_LATENCY_SECONDS)
+        return StubResponse(text)
+
+    def _log_call(self, prompt, text, stream, failed):
+        record = {
+            "time": time.time(),
+            "prompt_chars": len(prompt),
+            "prompt_bytes": len(prompt.encode("utf-8")),
+            "response_chars": len(text),
+            "stream": stream,
+            "failed": failed,
+        }
+        with self._log_lock, open(STUB_CALL_LOG, "a", encoding="utf-8") as log_file:
+            log_file.write(json.dumps(record) + "\n")
+
+    def _stream(self, text):
+        words = text.split(" ")
+        chunks = [" ".join(words[i:i + STUB_STREAM_CHUNK_WORDS]) for i in range(0, len(words), STUB_STREAM_CHUNK_WORDS)]
+        # Roughly a third of the latency before the first token, the rest spread over the chunks
+        time.sleep(STUB_LATENCY_SECONDS * 0.3)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(STUB_LATENCY_SECONDS * 0.7 / len(chunks))
+            yield StubResponse(chunk if index == len(chunks) - 1 else chunk + " ")
+
+    def respond(self, prompt):
+        """Canned response in the format the prompt asks for"""
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        # Like a real model asked for someone new, avoid names the prompt already mentions
+        unused_names = [n for n in STUB_NAMES if n not in prompt]
+        name, other = rng.sample(unused_names if len(unused_names) >= 2 else STUB_NAMES, 2)
+        place = rng.choice(STUB_PLACES)
+        if "NO_MEMORY" in prompt:
+            return rng.choice(["NO_MEMORY", f"🎁 You and {name} shared a quiet moment at {place}"])
+        if "single integer percentage" in prompt:
+            return str(rng.randint(5, 95))
+        if "Generate only the 3 choices" in prompt:
+            return f"1. Ask {name} about {place}\n2. Search the room for clues\n3. Head toward {rng.choice(STUB_PLACES)}"
+        if "Respond with raw JSON only" in prompt:
+            return self._story_json(prompt, rng)
+        if "Title: <world title>" in prompt:
+            return f"Title: The Realm of {name}\nSetting: {rng.choice(STUB_SENTENCES)} {rng.choice(STUB_SENTENCES)}\nKeywords: mystery, lanterns, {place.split()[-1].lower()}"
+        if "Locations: <" in prompt:
+            return f"Locations: {', '.join(rng.sample(STUB_PLACES, 3))}\nChapters: The Arrival, The Hidden Door, The Last Lantern"
+        if "Goal: <" in prompt:
+            return f"Goal: Find the lost key of {place}\nSuccess: The key is returned to {name}"
+        if "Voice Style: <" in prompt:
+            return (
+                f"Name: {name} {rng.choice(['Vale', 'Ash', 'Reed', 'Stone'])}\nRole: {rng.choice(STUB_ROLES)}\n"
+                f"Traits: Quiet, clever and fiercely loyal\nVoice Style: Soft and deliberate\nRelationship: An old friend of the player"
+            )
+        if "- Name (a human name)" in prompt:
+            return f"Name: {name}\nTraits: Curious and brave, with a knack for finding hidden things"
+        if "visual novel script format" in prompt:
+            turn = (
+                f"{rng.choice(STUB_SENTENCES)}\n"
+                f'{name} ({rng.choice(STUB_EXPRESSIONS)}) "Did you hear that? It came from {place}."\n'
+                f"{rng.choice(STUB_SENTENCES)}\n"
+                f'{other} ({rng.choice(STUB_EXPRESSIONS)}) "We should be careful."'
+            )
+            if f'"{COMBINED_TURN_FIELD}": the next story turn' not in prompt:
+                return turn
+            # Sorted like Gemini's JSON mode, which emits properties in alphabetical order
+            return json.dumps({
+                COMBINED_TURN_FIELD: turn,
+                "choices": [f"Ask {name} about {place}", "Search the room for clues", f"Head toward {rng.choice(STUB_PLACES)}"],
+                "action_summary": f"You followed {name} toward {place}.",
+                "discovery": f"You found a hidden passage near {place}, and {other} grew more cautious.",
+                "goal_progress": rng.randint(5, 95),
+            }, sort_keys=True)
+        return " ".join(rng.sample(STUB_SENTENCES, 2))
+
+    @staticmethod
+    def _story_json(prompt, rng):
+        """Story template JSON echoing the title, setting and characters listed in the prompt"""
+        def field(label):
+            match = re.search(rf"^{label}: (.*)$", prompt, re.MULTILINE)
+            return match.group(1).strip() if match else ""
+        characters = []
+        for match in re.finditer(r"^- ([^(\n]+) \(([^)]*)\): (.*)$", prompt, re.MULTILINE):
+            characters.append({
+                "name": match.group(1).strip(),
+                "role": match.group(2).strip(),
+                "description": match.group(3).split(" | ")[0].strip(),
+                "voice_style": "Natural",
+                "relationship": "Companion",
+            })
+        return json.dumps({
+            "title": field("Title") or "Untitled World",
+            "setting": field("Setting") or rng.choice(STUB_SENTENCES),
+            "genre": field("Genre") or "Fantasy",
+            "keywords": field("Keywords"),
+            "characters": characters,
+            "openingScene": rng.choice(STUB_SENTENCES),
+            "storyTone": field("storyTone"),
+            "pacing": field("pacing"),
+            "pointOfView": field("pointOfView"),
+            "narrationStyle": field("narrationStyle"),
+        })
+
+@st.cache_resource(show_spinner=False)
+def _load_stub_model(model_name, generation_config_key):
+    generation_config = json.loads(generation_config_key) if generation_config_key else None
+    return StubModel(model_name, generation_config)
+
+# --- LLM Backend ---
+# Every call site gets its model from get_model(), so the backend is chosen in one place.
+LLM_BACKENDS = {
+    "gemini": _load_gemini_model,
+    "stub": _load_stub_model,
+}
+LLM_BACKEND = get_setting("LLM_BACKEND", "gemini")
+
+# --- LLM Call Policy ---
+# Every call gets a per-call-site deadline, retries with exponential backoff and jitter for
+# transient provider errors, and goes through a process-wide circuit breaker. Once too many
+# recent calls have failed, the breaker fails calls immediately so callers drop straight to
+# their fallback (e.g. "The story continues...", default choices) instead of waiting.
+# Rate-limiter priority classes: lower values are served first
+PRIORITY_INTERACTIVE = 0   # the player is watching a turn or reply being written
+PRIORITY_NORMAL = 1        # creation helpers and choices
+PRIORITY_BACKGROUND = 2    # summaries, progress estimates and memory extraction
+
+CallPolicy = namedtuple("CallPolicy", ["deadline_seconds", "retries", "priority"])
+DEFAULT_CALL_POLICY = CallPolicy(deadline_seconds=20, retries=2, priority=PRIORITY_NORMAL)
+CALL_POLICIES = {
+    # Player-facing turns: generous deadline, one retry
+    "handle_send": CallPolicy(45, 1, PRIORITY_INTERACTIVE),
+    "combined_turn": CallPolicy(45, 1, PRIORITY_INTERACTIVE),
+    "opening_turn": CallPolicy(45, 1, PRIORITY_INTERACTIVE),
+    "chat_reply": CallPolicy(30, 1, PRIORITY_INTERACTIVE),
+    "generate_template": CallPolicy(60, 2, PRIORITY_NORMAL),
+    # Post-turn bookkeeping has cheap fallbacks, so keep it short
+    "generate_choices": CallPolicy(10, 1, PRIORITY_NORMAL),
+    "summarize_discovery": CallPolicy(10, 1, PRIORITY_BACKGROUND),
+    "generate_action_summary": CallPolicy(10, 1, PRIORITY_BACKGROUND),
+    "estimate_goal_progress": CallPolicy(8, 1, PRIORITY_BACKGROUND),
+    "summarize_story_so_far": CallPolicy(15, 1, PRIORITY_BACKGROUND),
+    "memory_extractor": CallPolicy(15, 1, PRIORITY_BACKGROUND),
+}
+LLM_BACKOFF_BASE_SECONDS = 0.5
+LLM_BACKOFF_MAX_SECONDS = 8
+LLM_MIN_ATTEMPT_SECONDS = 1          # don't start a retry with less time than this left
+LLM_BREAKER_WINDOW = 20              # recent calls considered by the circuit breaker
+LLM_BREAKER_MIN_CALLS = 10           # calls needed in the window before the breaker can open
+LLM_BREAKER_FAILURE_RATE = 0.5       # failure share that opens the breaker
+LLM_BREAKER_COOLDOWN_SECONDS = 30    # how long the breaker stays open before a trial call
+
+RETRYABLE_LLM_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    # Builtins rather than app classes: script reruns redefine classes, but cached
+    # backends keep raising the ones from the run that created them (StubBackendError is a ConnectionError)
+    TimeoutError,
+    ConnectionError,
+)
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the LLM while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Opens when the failure rate over recent calls crosses a threshold; half-opens after a cooldown"""
+
+    def __init__(self, window, min_calls, failure_rate, cooldown_seconds):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go out now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_flight or time.monotonic() - self._opened_at < self.cooldown_seconds:
+                return False
+            # Half-open: let a single trial call through
+            self._trial_in_flight = True
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if self._trial_in_flight:
+                self._trial_in_flight = False
+                if success:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                else:
+                    self._opened_at = time.monotonic()
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._opened_at = time.monotonic()
+
+@st.cache_resource(show_spinner=False)
+def get_circuit_breaker(backend):
+    return CircuitBreaker(LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_FAILURE_RATE, LLM_BREAKER_COOLDOWN_SECONDS)
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff before retry number attempt (1-based)"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+# --- Rate Limiting and Request Coalescing ---
+# All sessions in the process share one API key, so outgoing calls pass through one
+# token-bucket limiter (requests and tokens per minute), served in priority order.
+# Identical concurrent non-streaming requests share a single upstream call.
+# Off by default: background calls waiting on the limiter hold shared worker threads, so
+# only turn it on when the key's quota is actually the bottleneck.
+LLM_REQUESTS_PER_MINUTE = get_setting("LLM_REQUESTS_PER_MINUTE", 0)     # 0 disables the request limit
+LLM_TOKENS_PER_MINUTE = get_setting("LLM_TOKENS_PER_MINUTE", 0)         # 0 disables the token limit
+
+class RateLimiter:
+    """Process-wide token buckets for requests and prompt tokens per minute, served by priority"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens):
+        """Seconds until both buckets can cover one request of this many tokens"""
+        waits = [0.0]
+        if self.requests_per_minute and self._requests < 1:
+            waits.append((1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            waits.append((tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return max(waits)
+
+    def acquire(self, tokens, priority, timeout):
+        """Wait for a slot, behind any higher-priority or earlier callers. False if timeout runs out first."""
+        if self.tokens_per_minute:
+            # A prompt larger than the whole budget still goes out once the bucket is full
+            tokens = min(tokens, self.tokens_per_minute)
+        deadline = time.monotonic() + timeout
+        ticket = (priority, next(self._tickets))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    self._refill()
+                    wait = self._wait_time(tokens)
+                    if self._waiting[0] == ticket and wait == 0:
+                        if self.requests_per_minute:
+                            self._requests -= 1
+                        if self.tokens_per_minute:
+                            self._tokens -= tokens
+                        return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    # The head of the queue sleeps until its refill; everyone else until the head moves
+                    self._condition.wait(min(remaining, wait) if self._waiting[0] == ticket else remaining)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter(requests_per_minute, tokens_per_minute):
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    return RateLimiter(requests_per_minute, tokens_per_minute)
+
+class RequestCoalescer:
+    """Lets identical concurrent requests share one upstream call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def run(self, key, call, timeout):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            return future.result(timeout=timeout)
+        try:
+            result = call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+@st.cache_resource(show_spinner=False)
+def get_request_coalescer():
+    return RequestCoalescer()
+
+# --- LLM Call Instrumentation ---
+# Every model handed out by get_model() records each call: call site, prompt size,
+# token counts, latency and outcome. Aggregates are shown in the sidebar debug panel
+# and every call can be appended to a JSON-lines log for the metrics pipeline. Both are opt-in.
+LLM_METRICS_LOG = get_setting("LLM_METRICS_LOG", "")   # path of the JSON-lines call log ("" disables it)
+SHOW_LLM_METRICS = get_setting("SHOW_LLM_METRICS", False)
+LLM_METRICS_LATENCY_WINDOW = 500   # most recent latencies kept per call site for percentiles
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+class LLMMetrics:
+    """Process-wide per-call-site aggregates of LLM calls, plus the JSON-lines call log"""
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._sites = {}
+        # One writer thread appends log lines in order, so callers never wait on disk I/O
+        self._log_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-metrics-log") if log_path else None
+
+    def record(self, call):
+        with self._lock:
+            site = self._sites.setdefault(call["call_site"], {
+                "calls": 0, "errors": 0, "prompt_tokens": 0, "response_tokens": 0,
+                "latency_total": 0.0, "latencies": deque(maxlen=LLM_METRICS_LATENCY_WINDOW),
+            })
+            site["calls"] += 1
+            site["errors"] += call["outcome"] != "ok"
+            site["prompt_tokens"] += call["prompt_tokens"]
+            site["response_tokens"] += call["response_tokens"]
+            site["latency_total"] += call["latency_ms"] / 1000
+            site["latencies"].append(call["latency_ms"])
+        if self._log_writer:
+            self._log_writer.submit(self._append_to_log, json.dumps(call) + "\n")
+
+    def _append_to_log(self, line):
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(line)
+        except OSError:
+            # Metrics must never break a request
+            pass
+
+    def summary(self):
+        """One row per call site, most total latency first"""
+        rows = []
+        with self._lock:
+            for call_site, site in self._sites.items():
+                rows.append({
+                    "call site": call_site,
+                    "calls": site["calls"],
+                    "errors": site["errors"],
+                    "p50 ms": round(percentile(site["latencies"], 50)),
+                    "p95 ms": round(percentile(site["latencies"], 95)),
+                    "total s": round(site["latency_total"], 1),
+                    "avg prompt tokens": site["prompt_tokens"] // site["calls"],
+                    "avg response tokens": site["response_tokens"] // site["calls"],
+                })
+        return sorted(rows, key=lambda row: row["total s"], reverse=True)
+
+@st.cache_resource(show_spinner=False)
+def get_llm_metrics(log_path):
+    return LLMMetrics(log_path)
+
+def _token_counts(prompt, response, text):
+    """Prompt and response tokens from the response's usage metadata, else estimated from text"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt)
+    response_tokens = getattr(usage, "candidates_token_count", 0) or (estimate_tokens(text) if text else 0)
+    return prompt_tokens, response_tokens
+
+class InstrumentedModel:
+    """Model handle that records every generate_content call under a call-site tag"""
+
+    def __init__(self, model, call_site):
+        self._model = model
+        self.call_site = call_site
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        policy = CALL_POLICIES.get(self.call_site, DEFAULT_CALL_POLICY)
+        if stream or kwargs:
+            return self._generate(prompt, stream, kwargs, policy)
+        # Identical concurrent requests (same model, config and prompt) share one upstream call
+        return get_request_coalescer().run(
+            ResponseCache.key_for(self._model, prompt),
+            lambda: self._generate(prompt, False, kwargs, policy),
+            policy.deadline_seconds,
+        )
+
+    def _generate(self, prompt, stream, kwargs, policy):
+        """Rate limit, circuit breaker, retries and metrics around the backend call"""
+        started = time.perf_counter()
+        limiter = get_rate_limiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+        breaker = get_circuit_breaker(LLM_BACKEND)
+        deadline = started + policy.deadline_seconds
+        attempt = 0
+        while True:
+            if limiter and not limiter.acquire(estimate_tokens(prompt), policy.priority, deadline - time.perf_counter()):
+                error = TimeoutError(f"Waited too long for the LLM rate limit ({self.call_site})")
+                self._record(prompt, started, stream, None, "", error, attempt)
+                raise error
+            # Retries are part of the same call, so only the first attempt asks the breaker
+            if attempt == 0 and not breaker.allow():
+                error = CircuitOpenError(f"LLM calls are paused after repeated failures ({self.call_site})")
+                self._record(prompt, started, stream, None, "", error, attempt)
+                raise error
+            attempt += 1
+            try:
+                response = self._start(prompt, stream, deadline - time.perf_counter(), kwargs)
+                break
+            except Exception as e:
+                delay = backoff_delay(attempt)
+                transient = isinstance(e, RETRYABLE_LLM_ERRORS)
+                if not transient or attempt > policy.retries or deadline - time.perf_counter() < delay + LLM_MIN_ATTEMPT_SECONDS:
+                    # One breaker outcome per call; bad requests and safety blocks say nothing about provider health
+                    breaker.record(not transient)
+                    self._record(prompt, started, stream, None, "", e, attempt)
+                    raise
+                time.sleep(delay)
+        if stream:
+            return self._stream(prompt, started, response, breaker, attempt)
+        breaker.record(True)
+        try:
+            text = response.text
+        except ValueError:
+            # Blocked or empty candidate; the caller sees the same error when it reads .text
+            text = ""
+        self._record(prompt, started, False, response, text, None, attempt)
+        return response
+
+    def _start(self, prompt, stream, timeout, kwargs):
+        """One attempt with the remaining deadline; streams are started up to their first chunk"""
+        request_options = dict(kwargs.get("request_options") or {}, timeout=max(LLM_MIN_ATTEMPT_SECONDS, timeout))
+        response = self._model.generate_content(prompt, stream=stream, **dict(kwargs, request_options=request_options))
+        if not stream:
+            return response
+        # Failures before the first chunk can still be retried; after that the caller is already rendering
+        chunks = iter(response)
+        first_chunk = next(chunks, None)
+        return iter(()) if first_chunk is None else itertools.chain([first_chunk], chunks)
+
+    def _stream(self, prompt, started, response, breaker, attempts):
+        parts = []
+        last_chunk = None
+        first_token_ms = None
+        error = None
+        try:
+            for chunk in response:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                last_chunk = chunk
+                try:
+                    parts.append(chunk.text)
+                except ValueError:
+                    pass
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            breaker.record(not isinstance(error, RETRYABLE_LLM_ERRORS))
+            self._record(prompt, started, True, last_chunk, "".join(parts), error, attempts, first_token_ms)
+
+    def _record(self, prompt, started, stream, response, text, error, attempts=1, first_token_ms=None):
+        prompt_tokens, response_tokens = _token_counts(prompt, response, text)
+        call = {
+            "time": time.time(),
+            "call_site": self.call_site,
+            "model": getattr(self._model, "model_name", ""),
+            "backend": LLM_BACKEND,
+            "stream": stream,
+            "prompt_chars": len(prompt),
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+            "attempts": attempts,
+            "outcome": "ok" if error is None else "error",
+            "error": f"{type(error).__name__}: {error}" if error is not None else None,
+        }
+        get_llm_metrics(LLM_METRICS_LOG).record(call)
+
+def render_llm_metrics_panel():
+    """Collapsible sidebar panel with per-call-site LLM latency, token and error aggregates"""
+    if not SHOW_LLM_METRICS:
+        return
+    rows = get_llm_metrics(LLM_METRICS_LOG).summary()
+    with st.sidebar.expander("🛠️ LLM call metrics (debug)", expanded=False):
+        if not rows:
+            st.caption("No LLM calls yet in this server process.")
+            return
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        st.caption(f"All sessions in this server process. Per-call log: {LLM_METRICS_LOG or 'disabled'}")
+
+def get_model(model_name=None, generation_config=None, call_site="unspecified"):
+    """Return a shared, configured model handle keyed by model name and generation config.
+
+    The handle records each call under call_site (usually the calling function's name).
+    """
+    if LLM_BACKEND == "gemini":
+        _configure_gemini(st.secrets["GEMINI_API_KEY"])
+    # Serialize the config so equal configs map to the same cached handle
+    generation_config_key = json.dumps(generation_config, sort_keys=True) if generation_config else ""
+    model = LLM_BACKENDS[LLM_BACKEND](model_name or GEMINI_MODEL_NAME, generation_config_key)
+    return InstrumentedModel(model, call_site)
+
+# --- Concurrent LLM Calls ---
+# Independent LLM calls (post-turn bookkeeping, choice prefetch) run on one
+# bounded pool shared by every session so turn latency is the slowest call,
+# not the sum of all of them.
+LLM_MAX_WORKERS = 8
+LLM_TASK_TIMEOUT_SECONDS = 20
+
+@st.cache_resource(show_spinner=False)
+def get_llm_executor():
+    return ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm-task")
+
+def run_llm_tasks(tasks):
+    """Run independent LLM calls concurrently and return their results by name.
+
+    tasks maps a name to (function, args, fallback) or (function, args, fallback, timeout).
+    Worker threads must not touch st.session_state, so functions receive everything
+    they need through args. A call that raises or misses its deadline yields its fallback.
+    """
+    executor = get_llm_executor()
+    started = time.monotonic()
+    futures = {name: executor.submit(task[0], *task[1]) for name, task in tasks.items()}
+    results = {}
+    for name, future in futures.items():
+        task = tasks[name]
+        timeout = task[3] if len(task) > 3 else LLM_TASK_TIMEOUT_SECONDS
+        try:
+            results[name] = future.result(timeout=max(0, started + timeout - time.monotonic()))
+        except Exception:
+            future.cancel()
+            results[name] = task[2]
+    return results
+
+# --- Response Cache ---
+# Creation-step helpers ("AI: Generate ..." buttons) often resend the exact same prompt.
+# Their responses are stored on disk, keyed by a hash of model, generation config and prompt,
+# so a repeat click with unchanged inputs returns instantly without an API call.
+RESPONSE_CACHE_PATH = ".response_cache.sqlite3"
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+
+class ResponseCache:
+    """Content-addressed SQLite store of model responses with TTL and LRU eviction"""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key_for(model, prompt):
+        """Hash of model name, generation config and prompt"""
+        generation_config = getattr(model, "_generation_config", None) or {}
+        payload = json.dumps(
+            [getattr(model, "model_name", ""), generation_config, prompt],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Cached response for key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, response):
+        """Store a response, then evict expired and least recently used entries"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES)
+
+def cached_generate(model, prompt, bypass=None, validate=None):
+    """Response text for prompt, served from the response cache when possible.
+
+    With bypass (default: the session's "skip cache" toggle) a fresh response is generated
+    and replaces the cached one. Empty responses, errors and responses that validate
+    rejects are never cached.
+    """
+    if bypass is None:
+        bypass = st.session_state.get("bypass_response_cache", False)
+    cache = get_response_cache()
+    key = cache.key_for(model, prompt)
+    if not bypass:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    text = model.generate_content(prompt).text
+    if text.strip() and (validate is None or validate(text)):
+        cache.put(key, text)
+    return text
+
+def response_cache_toggle():
+    """Checkbox that makes the AI generate buttons skip the response cache"""
+    st.checkbox(
+        "🔄 Always generate fresh suggestions (skip cache)",
+        key="bypass_response_cache",
+        help="Repeated AI generations with unchanged inputs are served from a local cache. Tick this to get a new one.",
+    )
+
+# --- Streaming ---
+# Narrator turns and chat replies stream token by token so the first words show
+# up as soon as Gemini produces them instead of after the whole completion.
+STREAM_RESPONSES = True
+
+def stream_generate(model, prompt, on_text):
+    """Generate with stream=True, calling on_text with the text so far after each chunk. Returns the full text."""
+    parts = []
+    for chunk in model.generate_content(prompt, stream=True):
+        try:
+            chunk_text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. a trailing finish-reason chunk) have nothing to show
+            continue
+        parts.append(chunk_text)
+        on_text("".join(parts))
+    return "".join(parts)
+
+# --- Combined Turns ---
+# Optional single-call roleplay turns: the narrator returns the story turn, the next three
+# choices and the turn's bookkeeping as one JSON object, so a turn costs one LLM call
+# instead of up to four. Any field that comes back missing or malformed is filled in by
+# the usual per-call helper, and a turn that can't be parsed at all is regenerated the classic way.
+COMBINED_TURNS = get_setting("COMBINED_TURNS", False)
+# Gemini's JSON mode emits properties in alphabetical order (the SDK can't set an order),
+# so the story turn gets a name that sorts first and streams before the bookkeeping fields
+COMBINED_TURN_FIELD = "a_turn"
+COMBINED_TURN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        COMBINED_TURN_FIELD: {"type": "string"},
+        "choices": {"type": "array", "items": {"type": "string"}},
+        "action_summary": {"type": "string"},
+        "discovery": {"type": "string"},
+        "goal_progress": {"type": "integer"},
+    },
+    "required": [COMBINED_TURN_FIELD, "choices"],
+}
+COMBINED_TURN_CONFIG = {"response_mime_type": "application/json", "response_schema": COMBINED_TURN_SCHEMA}
+# The story turn string of a response that may still be streaming in (only complete escapes)
+PARTIAL_TURN_PATTERN = re.compile(rf'"{COMBINED_TURN_FIELD}"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+def partial_turn_text(response_text):
+    """The story turn decoded from a possibly incomplete combined-turn response, or None"""
+    match = PARTIAL_TURN_PATTERN.search(response_text)
+    if not match:
+        return None
+    try:
+        return json.loads(f'"{match.group(1)}"', strict=False)
+    except ValueError:
+        # Cut off inside a \uXXXX escape; the next chunk completes it
+        return None
+
+def parse_combined_turn(response_text):
+    """The combined-turn JSON object, or None when it has no usable story turn"""
+    try:
+        result = json.loads(response_text, strict=False)
+    except ValueError:
+        return None
+    if not isinstance(result, dict) or not isinstance(result.get(COMBINED_TURN_FIELD), str) or not result[COMBINED_TURN_FIELD].strip():
+        return None
+    return result
+
+def combined_text(result, field):
+    """A non-empty string field of a combined turn, else None"""
+    value = result.get(field)
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+def combined_choices(result):
+    """Exactly three non-empty choices from a combined turn, else None"""
+    choices = result.get("choices")
+    if not isinstance(choices, list):
+        return None
+    choices = [c.strip() for c in choices if isinstance(c, str) and c.strip()]
+    return choices[:3] if len(choices) >= 3 else None
+
+def combined_goal_progress(result):
+    """The goal progress of a combined turn clamped to 0-100, else None"""
+    value = result.get("goal_progress")
+    if isinstance(value, bool):
+        return None
+    try:
+        return max(0, min(100, int(value)))
+    except (TypeError, ValueError):
+        return None
+
+# --- Story Template JSON ---
+# "Generate Template" asks for JSON mode with a schema of the world_json fields the game
+# reads, and anything still not quite valid (code fences, surrounding prose, curly quotes,
+# trailing commas, output cut off mid-object) is repaired locally instead of re-requested.
+STORY_TEMPLATE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "setting": {"type": "string"},
+        "genre": {"type": "string"},
+        "keywords": {"type": "string"},
+        "characters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "role": {"type": "string"},
+                    "description": {"type": "string"},
+                    "voice_style": {"type": "string"},
+                    "relationship": {"type": "string"},
+                },
+                "required": ["name", "role", "description"],
+            },
+        },
+        "openingScene": {"type": "string"},
+        "storyTone": {"type": "string"},
+        "pacing": {"type": "string"},
+        "pointOfView": {"type": "string"},
+        "narrationStyle": {"type": "string"},
+        "modeDetails": {
+            "type": "object",
+            "properties": {
+                "exploration_locations": {"type": "string"},
+                "exploration_chapters": {"type": "string"},
+                "main_goal": {"type": "string"},
+                "success_condition": {"type": "string"},
+            },
+        },
+    },
+    "required": ["title", "setting", "characters", "storyTone", "pacing", "pointOfView", "narrationStyle"],
+}
+STORY_TEMPLATE_CONFIG = {"response_mime_type": "application/json", "response_schema": STORY_TEMPLATE_SCHEMA}
+JSON_FENCE_PATTERN = re.compile(r"```(?:json)?", re.IGNORECASE)
+# Curly quotes used as JSON delimiters (next to braces, brackets, commas or colons)
+CURLY_QUOTE_OPEN_PATTERN = re.compile(r'([{\[,:]\s*)[“”]')
+CURLY_QUOTE_CLOSE_PATTERN = re.compile(r'[“”](\s*[:,}\]])')
+
+def drop_trailing_comma(chars):
+    """Remove trailing whitespace and one dangling comma from a list of characters"""
+    while chars and chars[-1].isspace():
+        chars.pop()
+    if chars and chars[-1] == ",":
+        chars.pop()
+
+def repair_json(text):
+    """Best-effort fix of near-valid JSON object text; the result may still not parse"""
+    text = JSON_FENCE_PATTERN.sub("", text)
+    start = text.find("{")
+    if start != -1:
+        text = text[start:]
+    text = CURLY_QUOTE_OPEN_PATTERN.sub(r'\1"', text)
+    text = CURLY_QUOTE_CLOSE_PATTERN.sub(r'"\1', text)
+    chars, closers = [], []
+    in_string = escaped = False
+    # Last non-space character outside strings, and where the object member still waiting for its value starts
+    previous = ""
+    member_start = None
+    for char in text:
+        if in_string:
+            chars.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                previous = char
+            continue
+        if char.isspace():
+            chars.append(char)
+            continue
+        if char in '"{[' and previous and (previous in '"}]' or previous.isalnum()):
+            # A new member or element right after a complete value: the comma is missing
+            chars.append(",")
+            previous = ","
+        if previous == ":":
+            member_start = None
+        starts_member = previous in "{," and bool(closers) and closers[-1] == "}"
+        previous = char
+        if char in "}]":
+            drop_trailing_comma(chars)
+            chars.append(char)
+            member_start = None
+            if closers:
+                closers.pop()
+            if not closers:
+                # End of the top-level object; ignore anything after it
+                break
+            continue
+        if char == '"':
+            if starts_member:
+                member_start = len(chars)
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        chars.append(char)
+    # Output cut off mid-object: close the open string, drop a member that never got its value, close the brackets
+    if in_string:
+        if escaped:
+            chars.pop()
+        chars.append('"')
+    if closers:
+        if member_start is not None:
+            del chars[member_start:]
+        drop_trailing_comma(chars)
+        chars.extend(reversed(closers))
+    return "".join(chars)
+
+def load_json_object(text):
+    """Parse a JSON object from model output, repairing near-valid JSON locally. Raises ValueError if it can't."""
+    for candidate in (text, repair_json(text)):
+        try:
+            value = json.loads(candidate, strict=False)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    raise ValueError("Response is not a JSON object")
+
+def is_json_object(text):
+    """Whether load_json_object can parse text"""
+    try:
+        load_json_object(text)
+    except ValueError:
+        return False
+    return True
+
+# --- Fragment Reruns ---
+# The character chat area and the roleplay play area are st.fragment regions: interacting
+# with them reruns only that region instead of this whole script.
+def rerun_fragment():
+    """Rerun only the running fragment, or the whole app when it runs as part of a full rerun"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# --- Exploration Detection ---
+# Explore mode logs a discovery when the narrator's turn or the player's action sounds like
+# exploring. Each keyword list is compiled once into a single alternation regex, so a turn is
+# scanned in one pass instead of once per keyword per line.
+EXPLORATION_KEYWORDS = [
+    'discovery', 'found', 'discovered', 'uncovered', 'revealed', 'spotted', 'noticed', 'saw',
+    'entered', 'approached', 'reached', 'arrived at', 'came across', 'stumbled upon',
+    'explored', 'investigated', 'examined', 'looked at', 'studied', 'observed',
+    'opened', 'unlocked', 'accessed', 'gained entry to', 'stepped into',
+    'found a', 'discovered a', 'came to', 'walked into', 'moved toward',
+    'new area', 'new location', 'new place', 'new room', 'new chamber',
+    'hidden', 'secret', 'mysterious', 'ancient', 'forgotten', 'abandoned'
+]
+USER_EXPLORATION_KEYWORDS = [
+    'explore', 'look', 'examine', 'investigate', 'search', 'find', 'discover',
+    'go to', 'walk to', 'move to', 'approach', 'enter', 'open', 'check',
+    'what is', 'what\'s', 'where', 'how', 'why', 'tell me about'
+]
+
+def compile_keyword_pattern(keywords):
+    """One case-insensitive alternation for all keywords; longer phrases are tried first"""
+    alternation = "|".join(re.escape(keyword) for keyword in sorted(set(keywords), key=len, reverse=True))
+    # Anchor at a word start so "how" no longer fires inside "show"
+    return re.compile(rf"\b(?:{alternation})", re.IGNORECASE)
+
+EXPLORATION_PATTERN = compile_keyword_pattern(EXPLORATION_KEYWORDS)
+USER_EXPLORATION_PATTERN = compile_keyword_pattern(USER_EXPLORATION_KEYWORDS)
+
+def find_exploration_line(text, min_length=10):
+    """Scan text once for exploration keywords.
+
+    Returns (has_hits, best_line): best_line is the line with the most distinct keywords
+    (earliest wins ties) that is longer than min_length once the "What do you do?" prompt
+    is removed, or None if no line qualifies.
+    """
+    line_ends = [match.start() for match in re.finditer("\n", text)]
+    hits_by_line = {}
+    for match in EXPLORATION_PATTERN.finditer(text):
+        line_index = bisect.bisect_left(line_ends, match.start())
+        hits_by_line.setdefault(line_index, set()).add(match.group(0).lower())
+    if not hits_by_line:
+        return False, None
+    lines = text.split("\n")
+    best_line, best_score = None, 0
+    for line_index in sorted(hits_by_line):
+        line = lines[line_index].replace('**What do you do?**', '').strip()
+        score = len(hits_by_line[line_index])
+        if len(line) > min_length and score > best_score:
+            best_line, best_score = line, score
+    return True, best_line
+
+# --- Story Script Parser ---
+# Story turns are visual-novel scripts: narration lines, `Name (expression) "dialogue"` lines
+# and the closing **What do you do?** prompt. A block is parsed once into typed StoryLine
+# records and rendered from them; both results are kept in a process-wide LRU so the story
+# history is not re-parsed on every rerun.
+STORY_PROMPT = "What do you do?"
+STORY_BLOCK_CACHE_SIZE = get_setting("STORY_BLOCK_CACHE_SIZE", 1024)
+NARRATION_SPEAKERS = {"narrator", "story", "scene"}
+
+SPEAKER_EXPRESSION_LINE = re.compile(r'^([^(]+)\(([^)]*)\)\s*"([^"]+)"')
+SPEAKER_LINE = re.compile(r'^([^"]+)\s*"([^"]+)"')
+# Shapes clean_story_response recognises in raw model output
+SCRIPT_LINE_WITH_EXPRESSION = re.compile(r'^[a-zA-Z\s]+\([^)]*\)\s*["\']')
+SCRIPT_LINE = re.compile(r'^[a-zA-Z\s]+["\']')
+COLON_DIALOGUE_LINE = re.compile(r'^([^:]+):\s*["\'](.+)["\']')
+
+# kind is "prompt", "narration", "dialogue" or "bold"; speaker/expression are None when absent
+StoryLine = namedtuple("StoryLine", ["kind", "speaker", "expression", "text"])
+StoryBlock = namedtuple("StoryBlock", ["lines", "html"])
+
+def parse_story_line(line):
+    """Typed StoryLine for one stripped, non-empty script line"""
+    if STORY_PROMPT in line:
+        return StoryLine("prompt", None, None, f"**{STORY_PROMPT}**")
+    if line.startswith('narrator '):
+        return StoryLine("narration", None, None, line[9:])
+    if '"' in line:
+        match = SPEAKER_EXPRESSION_LINE.match(line)
+        if match:
+            return StoryLine("dialogue", match.group(1).strip(), match.group(2), match.group(3))
+        match = SPEAKER_LINE.match(line)
+        if match:
+            speaker = match.group(1).strip()
+            if speaker.lower() in NARRATION_SPEAKERS:
+                # Quoted narration keeps its label but is not shown as a character
+                return StoryLine("narration", speaker, None, match.group(2))
+            return StoryLine("dialogue", speaker, None, match.group(2))
+    if line.startswith('**') and line.endswith('**'):
+        return StoryLine("bold", None, None, line[2:-2])
+    return StoryLine("narration", None, None, line)
+
+def parse_story_block(block_text):
+    """All lines of a story block as a tuple of StoryLine, in one pass"""
+    return tuple(parse_story_line(line) for line in map(str.strip, block_text.split('\n')) if line)
+
+def render_story_line(story_line):
+    """HTML paragraph for one StoryLine"""
+    kind, speaker, expression, text = story_line
+    if kind == "prompt":
+        return f'<p style="margin:8px 0; font-weight:bold; color:#2c3e50;">{text}</p>'
+    if kind == "bold":
+        return f'<p style="margin:4px 0; font-weight:bold; color:#2c3e50;">{text}</p>'
+    if kind == "dialogue":
+        label = f"{speaker} ({expression})" if expression is not None else speaker
+        return f'<p style="margin:4px 0;"><b style="color:#2c3e50;">{label}:</b> "{text}"</p>'
+    if speaker:
+        return f'<p style="margin:4px 0; color:#555;">{speaker}: "{text}"</p>'
+    return f'<p style="margin:4px 0; color:#555;">{text}</p>'
+
+def render_story_lines(lines):
+    return ''.join(render_story_line(story_line) for story_line in lines)
+
+class StoryBlockCache:
+    """LRU of parsed and rendered story blocks, keyed by block text"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, block_text):
+        """StoryBlock for block_text, parsing and rendering it only on a miss"""
+        with self._lock:
+            block = self._entries.get(block_text)
+            if block is not None:
+                self._entries.move_to_end(block_text)
+                return block
+        lines = parse_story_block(block_text)
+        block = StoryBlock(lines, render_story_lines(lines))
+        with self._lock:
+            self._entries[block_text] = block
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return block
+
+@st.cache_resource(show_spinner=False)
+def get_story_block_cache(max_entries=STORY_BLOCK_CACHE_SIZE):
+    return StoryBlockCache(max_entries)
+
+# The game view only renders the latest turns; "Load earlier turns" reveals one more page
+STORY_HISTORY_PAGE_SIZE = get_setting("STORY_HISTORY_PAGE_SIZE", 20)
+
+# --- Roleplay Prompt Builder ---
+# Long sessions keep only the most recent turns verbatim; older turns are folded
+# into a rolling summary so prompt size stays flat no matter how long the story runs.
+HISTORY_WINDOW_TURNS = 8       # turns always kept verbatim
+HISTORY_FOLD_BATCH = 4         # aged-out turns collected before one summary call
+HISTORY_TOKEN_BUDGET = 2500    # max estimated tokens of verbatim history per prompt
+
+def estimate_tokens(text):
+    """Rough token estimate (about 4 characters per token) used for prompt budgeting"""
+    return len(text) // 4 + 1
+
+class PromptBuilder:
+    """Incrementally builds roleplay prompts for one world template.
+
+    The template prefix (title, setting, style, characters, mode details) is formatted
+    once per world_json. Story turns are formatted once as they are appended to the
+    history buffer, and prompts are assembled with a single join. Turns that age out
+    of the verbatim window are folded into a rolling summary (see fold_request).
+    """
+
+    def __init__(self, world_json, window_turns=HISTORY_WINDOW_TURNS, token_budget=HISTORY_TOKEN_BUDGET, fold_batch=HISTORY_FOLD_BATCH):
+        self.world_json = world_json
+        self.world_key = self.key_for(world_json)
+        self.template_prefix = self._format_template_prefix(world_json)
+        self.mode_context = self._format_mode_context(world_json)
+        self.world_brief = f"{world_json.get('title', 'Unknown')}: {world_json.get('setting', 'Unknown')}"
+        self.window_turns = window_turns
+        self.token_budget = token_budget
+        self.fold_batch = fold_batch
+        self.history = []
+        self.history_tokens = []
+        self.first_turn = None
+        self.summary = ""
+        self.summarized_upto = 0
+
+    @staticmethod
+    def key_for(world_json):
+        return json.dumps(world_json, sort_keys=True)
+
+    def matches(self, world_json):
+        return world_json is self.world_json or self.key_for(world_json) == self.world_key
+
+    @staticmethod
+    def _format_template_prefix(world_json):
+        story_tone = world_json.get('storyTone', 'Balanced')
+        pacing = world_json.get('pacing', 'Balanced')
+        point_of_view = world_json.get('pointOfView', 'Third person')
+        narration_style = world_json.get('narrationStyle', 'Balanced')
+        parts = [f"""
+STORY TEMPLATE:
+Title: {world_json.get('title', 'Unknown')}
+Setting: {world_json.get('setting', 'Unknown')}
+Genre: {world_json.get('genre', 'Fantasy')}
+Keywords: {world_json.get('keywords', '')}
+
+Story Style:
+- Tone: {story_tone}
+- Pacing: {pacing}
+- Point of View: {point_of_view}
+- Narration Style: {narration_style}
+
+Characters:
+"""]
+        # Add all characters from template with detailed descriptions
+        for char in world_json.get('characters', []):
+            parts.append(f"- {char.get('name', 'Unknown')} ({char.get('role', '')}): {char.get('description', '')}")
+            if char.get('voice_style', ''):
+                parts.append(f" | Voice: {char.get('voice_style')}")
+            if char.get('relationship', ''):
+                parts.append(f" | Relationship: {char.get('relationship')}")
+            parts.append("\n")
+        return "".join(parts)
+
+    @staticmethod
+    def _format_mode_context(world_json):
+        parts = []
+        # Add opening scene if available
+        if world_json.get('openingScene'):
+            parts.append(f"\nOpening Scene: {world_json.get('openingScene')}\n")
+        # Add gameplay mode context
+        gameplay_mode = world_json.get('gameplayMode', '')
+        mode_details = world_json.get('modeDetails', {})
+        if gameplay_mode:
+            parts.append(f"\nGameplay Mode: {gameplay_mode}\n")
+            if gameplay_mode == "🌍 Explore the World":
+                if mode_details.get('exploration_locations', ''):
+                    parts.append(f"Exploration Targets: {mode_details['exploration_locations']}\n")
+                if mode_details.get('exploration_chapters', ''):
+                    parts.append(f"Exploration Chapters: {mode_details['exploration_chapters']}\n")
+            elif gameplay_mode == "🎯 Achieve a Goal":
+                if mode_details.get('main_goal', ''):
+                    parts.append(f"Main Goal: {mode_details['main_goal']}\n")
+                if mode_details.get('success_condition', ''):
+                    parts.append(f"Success Condition: {mode_details['success_condition']}\n")
+        return "".join(parts)
+
+    @staticmethod
+    def format_turn(turn, user_input):
+        if user_input.strip():
+            return f"Player: {user_input}\nStory: {turn}\n\n"
+        return f"Story: {turn}\n\n"
+
+    def sync(self, game_state, user_inputs):
+        """Append turns added since the last sync; start over if a new game replaced the history"""
+        if len(game_state) < len(self.history) or (game_state and game_state[0] != self.first_turn):
+            self.history = []
+            self.history_tokens = []
+            self.first_turn = game_state[0] if game_state else None
+            self.summary = ""
+            self.summarized_upto = 0
+        for turn, user_input in zip(game_state[len(self.history):], user_inputs[len(self.history):]):
+            formatted_turn = self.format_turn(turn, user_input)
+            self.history.append(formatted_turn)
+            self.history_tokens.append(estimate_tokens(formatted_turn))
+
+    def _verbatim_start(self):
+        """Index of the oldest unfolded turn that still fits the token budget (the newest turn always stays)"""
+        start = len(self.history)
+        used = 0
+        while start > self.summarized_upto:
+            cost = self.history_tokens[start - 1]
+            if used + cost > self.token_budget and start < len(self.history):
+                break
+            used += cost
+            start -= 1
+        return start
+
+    def fold_request(self):
+        """Return (previous_summary, aged_out_turns_text, upto) when turns should be folded into the summary, else None.
+
+        Folding happens in batches once fold_batch turns have aged out of the window,
+        or right away when the unfolded turns no longer fit the token budget.
+        """
+        end = len(self.history)
+        upto = end - self.window_turns
+        over_budget = sum(self.history_tokens[self.summarized_upto:end]) > self.token_budget
+        if over_budget:
+            upto = max(upto, self._verbatim_start())
+        if upto <= self.summarized_upto or (upto - self.summarized_upto < self.fold_batch and not over_budget):
+            return None
+        return (self.summary, "".join(self.history[self.summarized_upto:upto]), upto)
+
+    def apply_fold(self, summary, upto):
+        """Replace the rolling summary once the turns up to `upto` have been summarized"""
+        if summary and self.summarized_upto < upto <= len(self.history):
+            self.summary = summary
+            self.summarized_upto = upto
+
+    def narrator_context(self, exploration_log=None, goal_progress=None):
+        """Template context for the narrator: frozen prefix and mode details plus live progress"""
+        parts = [self.template_prefix, self.mode_context]
+        gameplay_mode = self.world_json.get('gameplayMode', '')
+        if gameplay_mode == "🌍 Explore the World" and exploration_log:
+            parts.append("\nExploration Log:\n")
+            for i, discovery in enumerate(exploration_log[-5:], 1):  # Last 5 discoveries
+                parts.append(f"{i}. {discovery}\n")
+        elif gameplay_mode == "🎯 Achieve a Goal" and goal_progress is not None:
+            parts.append(f"Goal Progress: {goal_progress}%\n")
+        return "".join(parts)
+
+    def choice_context(self):
+        """Template context for choice generation"""
+        return self.template_prefix
+
+    def conversation_history(self):
+        """Rolling summary of older turns followed by the recent turns verbatim"""
+        parts = []
+        if self.summary:
+            parts.append(f"STORY SO FAR (summary of earlier turns):\n{self.summary}\n\n")
+        parts.extend(self.history[self._verbatim_start():])
+        return "".join(parts)
+
+# --- Character Chat Context Window ---
+# Chat prompts keep only the most recent exchanges verbatim; anything older is
+# represented by the extracted memories, so request size no longer grows with chat length.
+CHAT_WINDOW_TURNS = 12         # max recent exchanges kept verbatim (None keeps them all)
+CHAT_TOKEN_BUDGET = 2000       # max estimated tokens of verbatim chat history per prompt
+
+# --- Memory Store ---
+# Shared memories are embedded once and only the ones relevant to the current message are
+# put into the chat prompt, so prompt size no longer grows with the number of memories.
+MEMORY_TOP_K = 5                   # memories retrieved per chat prompt
+MEMORY_DUPLICATE_THRESHOLD = 0.9   # cosine similarity at which a new memory counts as a duplicate
+MEMORY_EMBEDDING_DIM = 512         # width of the local hashing-vectorizer embedding
+MEMORY_EMBEDDER = "hashing"        # "hashing" (offline) or "gemini"
+MEMORY_EXTRACTION_BATCH = 1        # chat exchanges per background extraction call (K)
+MEMORY_POLL_SECONDS = 2            # how often the memories column checks running extractions
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+MEMORY_STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have i in is it its me my of on or our so "
+    "that the their they this to was we were with you your".split()
+)
+
+def _normalize_rows(vectors):
+    """Scale each row to unit length so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def hashing_embedder(texts):
+    """Embed texts offline with a signed hashing vectorizer over word unigrams and bigrams"""
+    vectors = np.zeros((len(texts), MEMORY_EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = [w for w in re.findall(r"[a-z0-9']+", text.lower()) if w not in MEMORY_STOPWORDS]
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % MEMORY_EMBEDDING_DIM
+            vectors[row, index] += 1.0 if digest[4] & 1 else -1.0
+    return _normalize_rows(vectors)
+
+def gemini_embedder(texts):
+    """Embed texts with the Gemini embedding model"""
+    _configure_gemini(st.secrets["GEMINI_API_KEY"])
+    result = genai.embed_content(model=GEMINI_EMBEDDING_MODEL, content=list(texts))
+    return _normalize_rows(np.asarray(result["embedding"], dtype=np.float32))
+
+EMBEDDERS = {
+    "hashing": hashing_embedder,
+    "gemini": gemini_embedder,
+}
+
+class MemoryStore:
+    """Pure NumPy vector index over the shared memories of one chat.
+
+    The session's "memories" list stays the source of truth for display and deletion;
+    the store only caches one embedding per memory text and answers similarity queries.
+    """
+
+    def __init__(self, embedder=hashing_embedder):
+        self.embedder = embedder
+        self._vectors = {}
+        self._matrix_key = None
+        self._matrix = None
+
+    def _ensure(self, texts):
+        """Embed any texts that are not cached yet, in a single batch"""
+        missing = [text for text in dict.fromkeys(texts) if text not in self._vectors]
+        if not missing:
+            return
+        try:
+            vectors = self.embedder(missing)
+        except Exception:
+            if self.embedder is hashing_embedder:
+                raise
+            # Switch the whole store to the offline embedder so all vectors share one space
+            self.embedder = hashing_embedder
+            self._vectors = {}
+            self._matrix_key = None
+            missing = list(dict.fromkeys(texts))
+            vectors = hashing_embedder(missing)
+        self._vectors.update(zip(missing, vectors))
+
+    def _similarities(self, text, memories):
+        """Cosine similarity of text against every memory, in list order"""
+        self._ensure(list(memories) + [text])
+        # Read the query's vector before pruning, which may drop it from the cache
+        query_vector = self._vectors[text]
+        key = tuple(memories)
+        if key != self._matrix_key:
+            self._matrix = np.stack([self._vectors[memory] for memory in memories])
+            self._matrix_key = key
+            # Drop embeddings of deleted memories and old queries
+            if len(self._vectors) > 2 * len(memories) + 32:
+                self._vectors = {memory: self._vectors[memory] for memory in memories}
+        return self._matrix @ query_vector
+
+    def is_duplicate(self, memory, memories):
+        """True if memory is (nearly) the same as one already stored"""
+        if not memories:
+            return False
+        if memory in memories:
+            return True
+        return float(self._similarities(memory, memories).max()) >= MEMORY_DUPLICATE_THRESHOLD
+
+    def add(self, memory, memories):
+        """Append memory to the list unless it is a near-duplicate; returns True if added"""
+        if not memory or self.is_duplicate(memory, memories):
+            return False
+        memories.append(memory)
+        return True
+
+    def search(self, query, memories, k=MEMORY_TOP_K):
+        """Up to k memories most relevant to the query, kept in their original order"""
+        if len(memories) <= k:
+            return list(memories)
+        similarities = self._similarities(query, memories)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        return [memories[i] for i in sorted(top)]
+
+def get_memory_store():
+    """Per-session memory store using the configured embedder"""
+    if "memory_store" not in st.session_state:
+        st.session_state["memory_store"] = MemoryStore(EMBEDDERS.get(MEMORY_EMBEDDER, hashing_embedder))
+    return st.session_state["memory_store"]
+
 # --- Mode Selection ---
 if "app_mode" not in st.session_state:
     st.session_state["app_mode"] = None
@@ -152,6 +1581,7 @@ if st.session_state["app_mode"] is None:
 if st.session_state["app_mode"] == "character":
     st.set_page_config(page_title="Create Your Character", layout="wide")
     st.title("🎭 Create Your Character")
+    render_llm_metrics_panel()
     st.markdown("""
 Design a unique character, then chat with them as if they were real! The AI will fully embody their personality, quirks, and charm.
 """)
@@ -167,19 +1597,19 @@ Design a unique character, then chat with them as if they were real! The AI will
             "char_creation_step", "char_feedback", "char_name_input", "char_role_input",
             "char_traits_input", "voice_style_input", "emotional_style_input", "lore_snippets_input",
             "opening_line_input", "char_image_upload", "chat_started", "chat_history",
-            "character_prompt", "random_name_clicked", "random_role_clicked", "random_traits_clicked",
-            "random_voice_clicked", "random_emotional_clicked", "random_lore_clicked", "random_opening_clicked",
+            "character_prompt",
             # New user fields
             "user_name_input", "user_role_input", "user_traits_input", "user_details_input",
-            "random_user_name_clicked", "random_user_role_clicked", "random_user_traits_clicked", "random_user_details_clicked",
             # Memories
-            "memories"
+            "memories", "memory_store", "memory_jobs", "pending_memory_exchanges"
         ]
         for key in keys_to_clear:
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
 
+    response_cache_toggle()
+
     # --- Step Overview ---
     st.markdown("---")
     st.markdown("### 📋 Creation Steps Overview")
@@ -227,6 +1657,10 @@ Design a unique character, then chat with them as if they were real! The AI will
     st.markdown("---")
 
     # Helper function for random examples
+    def fill_random_example(key, field_type):
+        """🎲 Random callback: fill the field in session state before the rerun draws it"""
+        st.session_state[key] = get_random_example(field_type)
+
     def get_random_example(field_type):
         examples = {
             "name": ["Eliora", "Jack the Brave", "Neko-chan", "Luna", "Kai", "Aria", "Artemis", "Rei"],
@@ -329,21 +1763,31 @@ Design a unique character, then chat with them as if they were real! The AI will
         # The AI should already be formatting them correctly, but we can add some basic formatting if needed
         return response_text.strip()
 
-    def memory_extractor(user_input, response_text, char_name):
-        """Extract meaningful memories from user-character interactions"""
-        if not response_text.strip() or not user_input.strip():
-            return None
+    def memory_extractor(exchanges, char_name):
+        """Extract meaningful memories from one or more (user input, character response) exchanges.
+
+        Runs on a worker thread, so it must not touch st.session_state. Returns a list of memories.
+        """
+        exchanges = [(u, r) for u, r in exchanges if u.strip() and r.strip()]
+        if not exchanges:
+            return []
         
-        # Configure Gemini API for memory extraction
-        genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-        model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+        # Shared Gemini model for memory extraction
+        model = get_model(call_site="memory_extractor")
+        
+        interaction_text = "\n\n".join(
+            f"User Input: {user_input}\nCharacter Response: {response_text}" for user_input, response_text in exchanges
+        )
+        if len(exchanges) == 1:
+            answer_rule = "If you find meaningful shared content (positive OR negative), create a short memory (1-2 lines max) with an appropriate emoji that captures the shared experience."
+        else:
+            answer_rule = "For each distinct meaningful shared moment (positive OR negative), create a short memory (1-2 lines max) with an appropriate emoji that captures the shared experience. Put each memory on its own line and never repeat the same moment."
         
         memory_prompt = f"""
 Analyze this user-character interaction and determine if it contains meaningful relationship-building content that should be remembered.
 
 Character: {char_name}
-User Input: {user_input}
-Character Response: {response_text}
+{interaction_text}
 
 Look for shared experiences and interactions such as:
 - Emotional moments or revelations shared between user and character
@@ -364,7 +1808,7 @@ Look for shared experiences and interactions such as:
 - Significant disagreements that revealed important differences
 - Emotional outbursts or intense reactions from either party
 
-If you find meaningful shared content (positive OR negative), create a short memory (1-2 lines max) with an appropriate emoji that captures the shared experience.
+{answer_rule}
 If no meaningful shared content is found, respond with "NO_MEMORY".
 
 Examples of good shared memories (both positive and negative):
@@ -386,108 +1830,155 @@ Respond with either the memory or "NO_MEMORY".
         
         try:
             response = model.generate_content(memory_prompt)
-            memory = response.text.strip()
-            
-            # Clean up the response
-            if memory.startswith('"') and memory.endswith('"'):
-                memory = memory[1:-1]
+            lines = [response.text.strip()] if len(exchanges) == 1 else response.text.strip().splitlines()
             
-            # Check if it's a valid memory (not NO_MEMORY)
-            if memory and memory != "NO_MEMORY" and len(memory) > 5:
-                return memory
-            else:
-                return None
+            memories = []
+            for memory in lines:
+                # Clean up the response
+                memory = memory.strip().lstrip("-").strip()
+                if memory.startswith('"') and memory.endswith('"'):
+                    memory = memory[1:-1]
+                
+                # Check if it's a valid memory (not NO_MEMORY)
+                if memory and memory != "NO_MEMORY" and len(memory) > 5:
+                    memories.append(memory)
+            return memories
         except Exception as e:
-            # If memory extraction fails, return None
-            return None
+            # If memory extraction fails, keep the memories as they are
+            return []
+
+    def queue_memory_extraction(user_input, reply, char_name):
+        """Record an exchange and hand a batch to a background worker every MEMORY_EXTRACTION_BATCH exchanges"""
+        pending = st.session_state.setdefault("pending_memory_exchanges", [])
+        pending.append((user_input, reply))
+        if len(pending) < MEMORY_EXTRACTION_BATCH:
+            return
+        st.session_state["pending_memory_exchanges"] = []
+        future = get_llm_executor().submit(memory_extractor, pending, char_name)
+        st.session_state.setdefault("memory_jobs", []).append(future)
+
+    def flush_memory_extraction(char_name):
+        """When the chat ends: extract the partial batch too and merge every running extraction"""
+        pending = st.session_state.get("pending_memory_exchanges")
+        if pending:
+            st.session_state["pending_memory_exchanges"] = []
+            future = get_llm_executor().submit(memory_extractor, pending, char_name)
+            st.session_state.setdefault("memory_jobs", []).append(future)
+        jobs = st.session_state.get("memory_jobs")
+        if jobs:
+            wait(jobs, timeout=LLM_TASK_TIMEOUT_SECONDS)
+            harvest_memory_jobs()
+
+    def harvest_memory_jobs():
+        """Merge the results of finished background extractions into the memories list"""
+        jobs = st.session_state.get("memory_jobs")
+        if not jobs:
+            return
+        store = get_memory_store()
+        for future in [job for job in jobs if job.done()]:
+            jobs.remove(future)
+            try:
+                new_memories = future.result()
+            except Exception:
+                continue
+            for new_memory in new_memories:
+                store.add(new_memory, st.session_state["memories"])
+
+    def build_chat_prompt(character_prompt, memories_list, chat_history, user_input, char_name):
+        """Build the chat prompt from the character prompt, shared memories and a bounded window of recent exchanges"""
+        memories_text = ""
+        if memories_list:
+            memories_text = "\n\nHere are shared memories between user and character that are relevant right now:\n" + "\n".join([f"- {memory}" for memory in memories_list])
+        
+        # Walk back from the newest exchange until the turn or token budget is used up
+        recent_lines = []
+        used_tokens = 0
+        for entry in reversed(chat_history):
+            if entry['user']:
+                line = f"You: {entry['user']}\n{char_name}: {entry['bot']}\n"
+            else:
+                line = f"{char_name}: {entry['bot']}\n"
+            line_tokens = estimate_tokens(line)
+            if CHAT_WINDOW_TURNS is not None and len(recent_lines) >= CHAT_WINDOW_TURNS:
+                break
+            if recent_lines and used_tokens + line_tokens > CHAT_TOKEN_BUDGET:
+                break
+            recent_lines.append(line)
+            used_tokens += line_tokens
+        recent_lines.reverse()
+        
+        prompt_parts = [character_prompt, memories_text, "\n\n"]
+        if len(recent_lines) < len(chat_history):
+            prompt_parts.append("(Earlier parts of this conversation are summarized by the shared memories above.)\n")
+        prompt_parts.extend(recent_lines)
+        prompt_parts.append(f"You: {user_input}\n{char_name}:")
+        return "".join(prompt_parts)
 
     # ===== STEP 1: CORE DETAILS =====
     st.markdown("---")
     st.markdown("## 🌟 Step 1: Core Details")
     st.info("Let's start with who they are.")
 
-    # Character Name
-    st.markdown("### 👤 Character Name")
-    st.markdown("💡 **Pick something cool, elegant, or fun. Be as creative as you like!**")
-    st.markdown("*Examples: Eliora, Jack the Brave, Neko-chan, Artemis, Rei*")
-    
-    # Get random name if button was clicked
-    if "random_name_clicked" not in st.session_state:
-        st.session_state["random_name_clicked"] = False
+    # Every creation step (here and in roleplay creation) keeps its fields in an st.form, so they
+    # are committed together on submit instead of rerunning the script on every edit. Buttons inside a
+    # form must be submit buttons; the 🎲 ones fill in their field from an on_click callback.
+    with st.form("char_core_details_form", border=False):
+        # Character Name
+        st.markdown("### 👤 Character Name")
+        st.markdown("💡 **Pick something cool, elegant, or fun. Be as creative as you like!**")
+        st.markdown("*Examples: Eliora, Jack the Brave, Neko-chan, Artemis, Rei*")
     
-    # Set default value based on random click or existing session state
-    default_name = st.session_state.get("char_name_input", "")
-    if st.session_state["random_name_clicked"]:
-        default_name = get_random_example("name")
-        st.session_state["char_name_input"] = default_name
-        st.session_state["random_name_clicked"] = False
-    
-    char_name = st.text_input(
-        "What's their name?",
-        value=default_name,
-        placeholder="Eliora / Jack the Brave / Neko-chan",
-        key="char_name_input"
-    )
+        char_name = st.text_input(
+            "What's their name?",
+            placeholder="Eliora / Jack the Brave / Neko-chan",
+            key="char_name_input"
+        )
     
-    # Random button below input
-    if st.button("🎲 Random", key="random_name"):
-        st.session_state["random_name_clicked"] = True
-        st.rerun()
+        # Random button below input
+        st.form_submit_button("🎲 Random", key="random_name", on_click=fill_random_example, args=("char_name_input", "name"))
     
-    if char_name.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Love that name!</span> It already paints a picture in my mind.</div>', unsafe_allow_html=True)
+        if char_name.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Love that name!</span> It already paints a picture in my mind.</div>', unsafe_allow_html=True)
 
-    # Role/Occupation
-    st.markdown("### 🎭 Role / Occupation")
-    st.markdown("💡 **What's their role in your world or story? Be descriptive or playful!**")
-    st.markdown("*Examples: Your loyal knight, Time-traveling librarian, Witch who sells cursed flowers, Guardian spirit of your dreams*")
-    
-    # Get random role if button was clicked
-    if "random_role_clicked" not in st.session_state:
-        st.session_state["random_role_clicked"] = False
-    
-    # Set default value based on random click or existing session state
-    default_role = st.session_state.get("char_role_input", "")
-    if st.session_state["random_role_clicked"]:
-        default_role = get_random_example("role")
-        st.session_state["char_role_input"] = default_role
-        st.session_state["random_role_clicked"] = False
+        # Role/Occupation
+        st.markdown("### 🎭 Role / Occupation")
+        st.markdown("💡 **What's their role in your world or story? Be descriptive or playful!**")
+        st.markdown("*Examples: Your loyal knight, Time-traveling librarian, Witch who sells cursed flowers, Guardian spirit of your dreams*")
     
-    char_role = st.text_input(
-        "What do they do? What's their role?",
-        value=default_role,
-        placeholder="Your loyal knight / Time-traveling librarian / Guardian spirit",
-        key="char_role_input"
-    )
+        char_role = st.text_input(
+            "What do they do? What's their role?",
+            placeholder="Your loyal knight / Time-traveling librarian / Guardian spirit",
+            key="char_role_input"
+        )
     
-    # Random button below input
-    if st.button("🎲 Random", key="random_role"):
-        st.session_state["random_role_clicked"] = True
-        st.rerun()
+        # Random button below input
+        st.form_submit_button("🎲 Random", key="random_role", on_click=fill_random_example, args=("char_role_input", "role"))
     
-    if char_role.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That role is so vivid</span> — I want to meet them already!</div>', unsafe_allow_html=True)
+        if char_role.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That role is so vivid</span> — I want to meet them already!</div>', unsafe_allow_html=True)
+
+        st.form_submit_button("✅ Save Core Details")
 
     # ===== STEP 2: PERSONALITY & BACKGROUND =====
     st.markdown("---")
     st.markdown("## 🧠 Step 2: Personality & Background")
     st.info("Now give them depth — what makes them special?")
 
-    # Personality Traits
-    st.markdown("### 💫 Personality Traits & Backstory")
-    st.markdown("💡 **Describe their nature, how they behave, and a glimpse of their story.**")
-    st.markdown("*Examples:*")
-    st.markdown("- *\"Soft-spoken but bold when protecting loved ones. Speaks like an ancient priestess.\"*")
-    st.markdown("- *\"Chaotic and charming. A street magician who trusts no one but you.\"*")
+    with st.form("char_personality_form", border=False):
+        # Personality Traits
+        st.markdown("### 💫 Personality Traits & Backstory")
+        st.markdown("💡 **Describe their nature, how they behave, and a glimpse of their story.**")
+        st.markdown("*Examples:*")
+        st.markdown("- *\"Soft-spoken but bold when protecting loved ones. Speaks like an ancient priestess.\"*")
+        st.markdown("- *\"Chaotic and charming. A street magician who trusts no one but you.\"*")
     
-    # Handle AI generation before creating the widget
-    if st.button("🤖 AI Generate", key="ai_generate_traits"):
-        if char_name.strip() and char_role.strip():
-            # Configure Gemini API for generating traits
-            genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+        # Handle AI generation before creating the widget
+        if st.form_submit_button("🤖 AI Generate", key="ai_generate_traits"):
+            if char_name.strip() and char_role.strip():
+                # Shared Gemini model for generating traits
+                model = get_model(call_site="generate_traits")
             
-            traits_prompt = f"""
+                traits_prompt = f"""
 Generate personality traits and backstory for a character based on their name and role.
 
 Character Name: {char_name}
@@ -503,50 +1994,51 @@ Create a compelling personality description that:
 
 Generate only the personality description, nothing else.
 """
-            try:
-                response = model.generate_content(traits_prompt)
-                generated_traits = response.text.strip()
-                if generated_traits.startswith('"') and generated_traits.endswith('"'):
-                    generated_traits = generated_traits[1:-1]
-                st.session_state["char_traits_input"] = generated_traits
-                st.rerun()
-            except Exception as e:
-                st.error(f"Failed to generate traits: {e}")
-        else:
-            st.warning("Please complete Step 1 (Name and Role) before generating personality traits.")
+                try:
+                    generated_traits = cached_generate(model, traits_prompt).strip()
+                    if generated_traits.startswith('"') and generated_traits.endswith('"'):
+                        generated_traits = generated_traits[1:-1]
+                    st.session_state["char_traits_input"] = generated_traits
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to generate traits: {e}")
+            else:
+                st.warning("Please complete Step 1 (Name and Role) before generating personality traits.")
     
-    char_traits = st.text_area(
-        "Tell us about their personality, background, and how they behave:",
-        value=st.session_state.get("char_traits_input", ""),
-        placeholder="Soft-spoken but bold when protecting loved ones. Speaks like an ancient priestess.",
-        height=120,
-        key="char_traits_input"
-    )
+        char_traits = st.text_area(
+            "Tell us about their personality, background, and how they behave:",
+            value=st.session_state.get("char_traits_input", ""),
+            placeholder="Soft-spoken but bold when protecting loved ones. Speaks like an ancient priestess.",
+            height=120,
+            key="char_traits_input"
+        )
 
-    if char_traits.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That\'s so rich</span> — they already feel alive!</div>', unsafe_allow_html=True)
+        if char_traits.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That\'s so rich</span> — they already feel alive!</div>', unsafe_allow_html=True)
+
+        st.form_submit_button("✅ Save Personality")
 
     # ===== STEP 3: EXPRESSION & RELATIONSHIPS =====
     st.markdown("---")
     st.markdown("## 💫 Step 3: Expression & Relationships")
     st.info("Let's add how they speak and how they feel about you.")
 
-    # Voice Style
-    st.markdown("### 🗣️ Voice Style / Speech Quirks")
-    st.markdown("💡 **Do they speak like a noble? A weirdo? A modern teen?**")
-    st.markdown("*Examples:*")
-    st.markdown("- *\"Always says 'nya~' like a catgirl\"*")
-    st.markdown("- *\"Talks in old poetic phrases\"*")
-    st.markdown("- *\"Speaks bluntly and calls you 'human'\"*")
+    with st.form("char_expression_form", border=False):
+        # Voice Style
+        st.markdown("### 🗣️ Voice Style / Speech Quirks")
+        st.markdown("💡 **Do they speak like a noble? A weirdo? A modern teen?**")
+        st.markdown("*Examples:*")
+        st.markdown("- *\"Always says 'nya~' like a catgirl\"*")
+        st.markdown("- *\"Talks in old poetic phrases\"*")
+        st.markdown("- *\"Speaks bluntly and calls you 'human'\"*")
     
-    # Handle AI generation before creating the widget
-    if st.button("🤖 AI Generate", key="ai_generate_voice"):
-        if char_name.strip() and char_role.strip() and char_traits.strip():
-            # Configure Gemini API for generating voice style
-            genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+        # Handle AI generation before creating the widget
+        if st.form_submit_button("🤖 AI Generate", key="ai_generate_voice"):
+            if char_name.strip() and char_role.strip() and char_traits.strip():
+                # Shared Gemini model for generating voice style
+                model = get_model(call_site="generate_voice_style")
             
-            voice_prompt = f"""
+                voice_prompt = f"""
 Generate a unique voice style for a character based on their details.
 
 Character Name: {char_name}
@@ -562,44 +2054,42 @@ Create a distinctive speech pattern that:
 
 Generate only the voice style description, nothing else.
 """
-            try:
-                response = model.generate_content(voice_prompt)
-                generated_voice = response.text.strip()
-                if generated_voice.startswith('"') and generated_voice.endswith('"'):
-                    generated_voice = generated_voice[1:-1]
-                st.session_state["voice_style_input"] = generated_voice
-                st.rerun()
-            except Exception as e:
-                st.error(f"Failed to generate voice style: {e}")
-        else:
-            st.warning("Please complete Steps 1 and 2 before generating voice style.")
+                try:
+                    generated_voice = cached_generate(model, voice_prompt).strip()
+                    if generated_voice.startswith('"') and generated_voice.endswith('"'):
+                        generated_voice = generated_voice[1:-1]
+                    st.session_state["voice_style_input"] = generated_voice
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to generate voice style: {e}")
+            else:
+                st.warning("Please complete Steps 1 and 2 before generating voice style.")
     
-    voice_style = st.text_input(
-        "How do they speak? Any unique speech patterns?",
-        value=st.session_state.get("voice_style_input", ""),
-        placeholder="Always says 'nya~' like a catgirl / Talks in old poetic phrases",
-        key="voice_style_input"
-    )
+        voice_style = st.text_input(
+            "How do they speak? Any unique speech patterns?",
+            value=st.session_state.get("voice_style_input", ""),
+            placeholder="Always says 'nya~' like a catgirl / Talks in old poetic phrases",
+            key="voice_style_input"
+        )
     
-    if voice_style.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Nice!</span> I can already imagine hearing them talk.</div>', unsafe_allow_html=True)
-
-    # Emotional Style
-    st.markdown("### 💕 Emotional / Relationship Style")
-    st.markdown("💡 **How do they emotionally connect with the user?**")
-    st.markdown("*Examples:*")
-    st.markdown("- *Protective big brother energy*")
-    st.markdown("- *Tsundere (hot and cold flirty)*")
-    st.markdown("- *Warm and clingy childhood friend*")
+        if voice_style.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Nice!</span> I can already imagine hearing them talk.</div>', unsafe_allow_html=True)
+
+        # Emotional Style
+        st.markdown("### 💕 Emotional / Relationship Style")
+        st.markdown("💡 **How do they emotionally connect with the user?**")
+        st.markdown("*Examples:*")
+        st.markdown("- *Protective big brother energy*")
+        st.markdown("- *Tsundere (hot and cold flirty)*")
+        st.markdown("- *Warm and clingy childhood friend*")
     
-    # Handle AI generation before creating the widget
-    if st.button("🤖 AI Generate", key="ai_generate_emotional"):
-        if char_name.strip() and char_role.strip() and char_traits.strip():
-            # Configure Gemini API for generating emotional style
-            genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+        # Handle AI generation before creating the widget
+        if st.form_submit_button("🤖 AI Generate", key="ai_generate_emotional"):
+            if char_name.strip() and char_role.strip() and char_traits.strip():
+                # Shared Gemini model for generating emotional style
+                model = get_model(call_site="generate_emotional_style")
             
-            emotional_prompt = f"""
+                emotional_prompt = f"""
 Generate an emotional/relationship style for a character based on their details.
 
 Character Name: {char_name}
@@ -616,43 +2106,41 @@ Create an emotional connection style that:
 
 Generate only the emotional style description, nothing else.
 """
-            try:
-                response = model.generate_content(emotional_prompt)
-                generated_emotional = response.text.strip()
-                if generated_emotional.startswith('"') and generated_emotional.endswith('"'):
-                    generated_emotional = generated_emotional[1:-1]
-                st.session_state["emotional_style_input"] = generated_emotional
-                st.rerun()
-            except Exception as e:
-                st.error(f"Failed to generate emotional style: {e}")
-        else:
-            st.warning("Please complete Steps 1 and 2 before generating emotional style.")
+                try:
+                    generated_emotional = cached_generate(model, emotional_prompt).strip()
+                    if generated_emotional.startswith('"') and generated_emotional.endswith('"'):
+                        generated_emotional = generated_emotional[1:-1]
+                    st.session_state["emotional_style_input"] = generated_emotional
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to generate emotional style: {e}")
+            else:
+                st.warning("Please complete Steps 1 and 2 before generating emotional style.")
     
-    emotional_style = st.text_input(
-        "How do they treat the user emotionally?",
-        value=st.session_state.get("emotional_style_input", ""),
-        placeholder="Protective big brother energy / Tsundere (hot and cold flirty)",
-        key="emotional_style_input"
-    )
+        emotional_style = st.text_input(
+            "How do they treat the user emotionally?",
+            value=st.session_state.get("emotional_style_input", ""),
+            placeholder="Protective big brother energy / Tsundere (hot and cold flirty)",
+            key="emotional_style_input"
+        )
     
-    if emotional_style.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Adorable!</span> Their emotional vibe is going to make this chat really fun.</div>', unsafe_allow_html=True)
-
-    # Lore Snippets
-    st.markdown("### 📖 Memory or Lore Snippets")
-    st.markdown("💡 **Add personal history or a shared memory with the user.**")
-    st.markdown("*Examples:*")
-    st.markdown("- *\"They still carry the ring you gave them long ago.\"*")
-    st.markdown("- *\"You used to sneak into the temple garden together as kids.\"*")
+        if emotional_style.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Adorable!</span> Their emotional vibe is going to make this chat really fun.</div>', unsafe_allow_html=True)
+
+        # Lore Snippets
+        st.markdown("### 📖 Memory or Lore Snippets")
+        st.markdown("💡 **Add personal history or a shared memory with the user.**")
+        st.markdown("*Examples:*")
+        st.markdown("- *\"They still carry the ring you gave them long ago.\"*")
+        st.markdown("- *\"You used to sneak into the temple garden together as kids.\"*")
     
-    # Handle AI generation before creating the widget
-    if st.button("🤖 AI Generate", key="ai_generate_lore"):
-        if char_name.strip() and char_role.strip() and char_traits.strip():
-            # Configure Gemini API for generating lore
-            genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+        # Handle AI generation before creating the widget
+        if st.form_submit_button("🤖 AI Generate", key="ai_generate_lore"):
+            if char_name.strip() and char_role.strip() and char_traits.strip():
+                # Shared Gemini model for generating lore
+                model = get_model(call_site="generate_lore")
             
-            lore_prompt = f"""
+                lore_prompt = f"""
 Generate a personal memory or lore snippet for a character based on their details.
 
 Character Name: {char_name}
@@ -670,182 +2158,130 @@ Create a shared memory or personal history that:
 
 Generate only the lore snippet, nothing else.
 """
-            try:
-                response = model.generate_content(lore_prompt)
-                generated_lore = response.text.strip()
-                if generated_lore.startswith('"') and generated_lore.endswith('"'):
-                    generated_lore = generated_lore[1:-1]
-                st.session_state["lore_snippets_input"] = generated_lore
-                st.rerun()
-            except Exception as e:
-                st.error(f"Failed to generate lore: {e}")
-        else:
-            st.warning("Please complete Steps 1 and 2 before generating lore.")
+                try:
+                    generated_lore = cached_generate(model, lore_prompt).strip()
+                    if generated_lore.startswith('"') and generated_lore.endswith('"'):
+                        generated_lore = generated_lore[1:-1]
+                    st.session_state["lore_snippets_input"] = generated_lore
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to generate lore: {e}")
+            else:
+                st.warning("Please complete Steps 1 and 2 before generating lore.")
     
-    lore_snippets = st.text_area(
-        "Any personal backstory or shared memories?",
-        value=st.session_state.get("lore_snippets_input", ""),
-        placeholder="They still carry the ring you gave them long ago. / You used to sneak into the temple garden together as kids.",
-        height=80,
-        key="lore_snippets_input"
-    )
+        lore_snippets = st.text_area(
+            "Any personal backstory or shared memories?",
+            value=st.session_state.get("lore_snippets_input", ""),
+            placeholder="They still carry the ring you gave them long ago. / You used to sneak into the temple garden together as kids.",
+            height=80,
+            key="lore_snippets_input"
+        )
     
-    if lore_snippets.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That detail adds so much depth</span> — what a story!</div>', unsafe_allow_html=True)
+        if lore_snippets.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That detail adds so much depth</span> — what a story!</div>', unsafe_allow_html=True)
+
+        st.form_submit_button("✅ Save Expression & Relationships")
 
     # ===== STEP 4: YOUR INFORMATION =====
     st.markdown("---")
     st.markdown("## 🌟 Step 4: Your Information")
     st.info("Now let's define who YOU are in this chat. This helps the character understand and interact with you better!")
 
-    # User Name
-    st.markdown("### 👤 Your Name")
-    st.markdown("💡 **What's your name in this story?**")
-    st.markdown("*Examples: Alex, Mei, Hiro, Luna, Kai, Aria*")
-    
-    # Get random user name if button was clicked
-    if "random_user_name_clicked" not in st.session_state:
-        st.session_state["random_user_name_clicked"] = False
+    with st.form("char_user_info_form", border=False):
+        # User Name
+        st.markdown("### 👤 Your Name")
+        st.markdown("💡 **What's your name in this story?**")
+        st.markdown("*Examples: Alex, Mei, Hiro, Luna, Kai, Aria*")
     
-    # Set default value based on random click or existing session state
-    default_user_name = st.session_state.get("user_name_input", "")
-    if st.session_state["random_user_name_clicked"]:
-        default_user_name = get_random_example("user_name")
-        st.session_state["user_name_input"] = default_user_name
-        st.session_state["random_user_name_clicked"] = False
-    
-    user_name = st.text_input(
-        "Your name",
-        value=default_user_name,
-        placeholder="Alex / Mei / Hiro / Luna",
-        key="user_name_input"
-    )
+        user_name = st.text_input(
+            "Your name",
+            placeholder="Alex / Mei / Hiro / Luna",
+            key="user_name_input"
+        )
     
-    # Random button below input
-    if st.button("🎲 Random", key="random_user_name"):
-        st.session_state["random_user_name_clicked"] = True
-        st.rerun()
+        # Random button below input
+        st.form_submit_button("🎲 Random", key="random_user_name", on_click=fill_random_example, args=("user_name_input", "user_name"))
     
-    if user_name.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Nice name!</span> It suits you perfectly.</div>', unsafe_allow_html=True)
+        if user_name.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Nice name!</span> It suits you perfectly.</div>', unsafe_allow_html=True)
 
-    # User Role/Identity
-    st.markdown("### 🎭 Your Role / Identity")
-    st.markdown("💡 **What's your role in relation to the character?**")
-    st.markdown("*Examples: The chosen one, their long-lost friend, a time-traveling guest, the last hope*")
-    
-    # Get random user role if button was clicked
-    if "random_user_role_clicked" not in st.session_state:
-        st.session_state["random_user_role_clicked"] = False
-    
-    # Set default value based on random click or existing session state
-    default_user_role = st.session_state.get("user_role_input", "")
-    if st.session_state["random_user_role_clicked"]:
-        default_user_role = get_random_example("user_role")
-        st.session_state["user_role_input"] = default_user_role
-        st.session_state["random_user_role_clicked"] = False
+        # User Role/Identity
+        st.markdown("### 🎭 Your Role / Identity")
+        st.markdown("💡 **What's your role in relation to the character?**")
+        st.markdown("*Examples: The chosen one, their long-lost friend, a time-traveling guest, the last hope*")
     
-    user_role = st.text_input(
-        "Your role or identity",
-        value=default_user_role,
-        placeholder="The chosen one / Their long-lost friend / A time-traveling guest",
-        key="user_role_input"
-    )
+        user_role = st.text_input(
+            "Your role or identity",
+            placeholder="The chosen one / Their long-lost friend / A time-traveling guest",
+            key="user_role_input"
+        )
     
-    # Random button below input
-    if st.button("🎲 Random", key="random_user_role"):
-        st.session_state["random_user_role_clicked"] = True
-        st.rerun()
+        # Random button below input
+        st.form_submit_button("🎲 Random", key="random_user_role", on_click=fill_random_example, args=("user_role_input", "user_role"))
     
-    if user_role.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That role sounds exciting!</span> It adds so much depth to the story.</div>', unsafe_allow_html=True)
+        if user_role.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">That role sounds exciting!</span> It adds so much depth to the story.</div>', unsafe_allow_html=True)
 
-    # User Personality Traits
-    st.markdown("### 💫 Your Key Personality Traits or Behavior")
-    st.markdown("💡 **How do you behave? What's your personality like?**")
-    st.markdown("*Examples: Curious but shy, assertive and logical, flirty and playful, protective and caring*")
+        # User Personality Traits
+        st.markdown("### 💫 Your Key Personality Traits or Behavior")
+        st.markdown("💡 **How do you behave? What's your personality like?**")
+        st.markdown("*Examples: Curious but shy, assertive and logical, flirty and playful, protective and caring*")
     
-    # Get random user traits if button was clicked
-    if "random_user_traits_clicked" not in st.session_state:
-        st.session_state["random_user_traits_clicked"] = False
-    
-    # Set default value based on random click or existing session state
-    default_user_traits = st.session_state.get("user_traits_input", "")
-    if st.session_state["random_user_traits_clicked"]:
-        default_user_traits = get_random_example("user_traits")
-        st.session_state["user_traits_input"] = default_user_traits
-        st.session_state["random_user_traits_clicked"] = False
-    
-    user_traits = st.text_area(
-        "Your personality traits or behavior",
-        value=default_user_traits,
-        placeholder="Curious but shy, always asking questions / Assertive and logical, takes charge in difficult situations",
-        height=80,
-        key="user_traits_input"
-    )
+        user_traits = st.text_area(
+            "Your personality traits or behavior",
+            placeholder="Curious but shy, always asking questions / Assertive and logical, takes charge in difficult situations",
+            height=80,
+            key="user_traits_input"
+        )
     
-    # Random button below input
-    if st.button("🎲 Random", key="random_user_traits"):
-        st.session_state["random_user_traits_clicked"] = True
-        st.rerun()
+        # Random button below input
+        st.form_submit_button("🎲 Random", key="random_user_traits", on_click=fill_random_example, args=("user_traits_input", "user_traits"))
     
-    if user_traits.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Great personality!</span> The character will love getting to know you.</div>', unsafe_allow_html=True)
+        if user_traits.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Great personality!</span> The character will love getting to know you.</div>', unsafe_allow_html=True)
 
-    # User Details
-    st.markdown("### 📝 Anything Relevant the Character Should Know")
-    st.markdown("💡 **Share some personal details that make you unique!**")
-    st.markdown("*Examples: Born on a full moon, loves stargazing / Has a collection of antique books, favorite color is deep blue / Learned to cook from their grandmother, loves spicy food*")
-    
-    # Get random user details if button was clicked
-    if "random_user_details_clicked" not in st.session_state:
-        st.session_state["random_user_details_clicked"] = False
-    
-    # Set default value based on random click or existing session state
-    default_user_details = st.session_state.get("user_details_input", "")
-    if st.session_state["random_user_details_clicked"]:
-        default_user_details = get_random_example("user_details")
-        st.session_state["user_details_input"] = default_user_details
-        st.session_state["random_user_details_clicked"] = False
+        # User Details
+        st.markdown("### 📝 Anything Relevant the Character Should Know")
+        st.markdown("💡 **Share some personal details that make you unique!**")
+        st.markdown("*Examples: Born on a full moon, loves stargazing / Has a collection of antique books, favorite color is deep blue / Learned to cook from their grandmother, loves spicy food*")
     
-    user_details = st.text_area(
-        "Personal details or preferences",
-        value=default_user_details,
-        placeholder="Born on a full moon, loves stargazing / Has a collection of antique books, favorite color is deep blue",
-        height=80,
-        key="user_details_input"
-    )
+        user_details = st.text_area(
+            "Personal details or preferences",
+            placeholder="Born on a full moon, loves stargazing / Has a collection of antique books, favorite color is deep blue",
+            height=80,
+            key="user_details_input"
+        )
     
-    # Random button below input
-    if st.button("🎲 Random", key="random_user_details"):
-        st.session_state["random_user_details_clicked"] = True
-        st.rerun()
+        # Random button below input
+        st.form_submit_button("🎲 Random", key="random_user_details", on_click=fill_random_example, args=("user_details_input", "user_details"))
     
-    if user_details.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Those details are perfect!</span> They\'ll make conversations so much more personal.</div>', unsafe_allow_html=True)
+        if user_details.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Those details are perfect!</span> They\'ll make conversations so much more personal.</div>', unsafe_allow_html=True)
+
+        st.form_submit_button("✅ Save Your Information")
 
     # ===== STEP 5: FINAL TOUCHES =====
     st.markdown("---")
     st.markdown("## ✨ Step 5: Final Touches")
     st.info("Let's get ready for your first encounter.")
 
-    # Opening Lines
-    st.markdown("### 💬 Opening Line (Optional)")
-    st.markdown("💡 **What's the first thing they say when the story begins?**")
-    st.markdown("*Examples:*")
-    st.markdown("- *\"Took you long enough. Shall we begin?\"*")
-    st.markdown("- *\"You're late again, silly. I missed you.\"*")
-    st.markdown("- *\"I thought you'd never return...\"*")
-    st.markdown("**💡 Tip:** If you don't write anything here, I'll come up with something fun for you!")
+    with st.form("char_opening_line_form", border=False):
+        # Opening Lines
+        st.markdown("### 💬 Opening Line (Optional)")
+        st.markdown("💡 **What's the first thing they say when the story begins?**")
+        st.markdown("*Examples:*")
+        st.markdown("- *\"Took you long enough. Shall we begin?\"*")
+        st.markdown("- *\"You're late again, silly. I missed you.\"*")
+        st.markdown("- *\"I thought you'd never return...\"*")
+        st.markdown("**💡 Tip:** If you don't write anything here, I'll come up with something fun for you!")
     
-    # Handle AI generation before creating the widget
-    if st.button("🤖 AI Generate", key="ai_generate_opening"):
-        if char_name.strip() and char_role.strip() and char_traits.strip():
-            # Configure Gemini API for generating opening line
-            genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+        # Handle AI generation before creating the widget
+        if st.form_submit_button("🤖 AI Generate", key="ai_generate_opening"):
+            if char_name.strip() and char_role.strip() and char_traits.strip():
+                # Shared Gemini model for generating opening line
+                model = get_model(call_site="generate_opening_line")
             
-            opening_prompt = f"""
+                opening_prompt = f"""
 Generate an engaging opening line for a character based on their details.
 
 Character Name: {char_name}
@@ -867,28 +2303,29 @@ The opening line should:
 
 Generate only the opening line, nothing else.
 """
-            try:
-                response = model.generate_content(opening_prompt)
-                generated_opening = response.text.strip()
-                if generated_opening.startswith('"') and generated_opening.endswith('"'):
-                    generated_opening = generated_opening[1:-1]
-                st.session_state["opening_line_input"] = generated_opening
-                st.rerun()
-            except Exception as e:
-                st.error(f"Failed to generate opening line: {e}")
-        else:
-            st.warning("Please complete Steps 1 and 2 before generating opening line.")
+                try:
+                    generated_opening = cached_generate(model, opening_prompt).strip()
+                    if generated_opening.startswith('"') and generated_opening.endswith('"'):
+                        generated_opening = generated_opening[1:-1]
+                    st.session_state["opening_line_input"] = generated_opening
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to generate opening line: {e}")
+            else:
+                st.warning("Please complete Steps 1 and 2 before generating opening line.")
     
-    opening_line = st.text_area(
-        "What should they say to start the conversation?",
-        value=st.session_state.get("opening_line_input", ""),
-        placeholder="Took you long enough. Shall we begin?",
-        height=80,
-        key="opening_line_input"
-    )
+        opening_line = st.text_area(
+            "What should they say to start the conversation?",
+            value=st.session_state.get("opening_line_input", ""),
+            placeholder="Took you long enough. Shall we begin?",
+            height=80,
+            key="opening_line_input"
+        )
+
+        if opening_line.strip():
+            st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Oooh, such a strong intro!</span> They\'re totally in character.</div>', unsafe_allow_html=True)
 
-    if opening_line.strip():
-        st.markdown('<div class="feedback-animation">✅ <span class="emoji-sparkle">Oooh, such a strong intro!</span> They\'re totally in character.</div>', unsafe_allow_html=True)
+        st.form_submit_button("✅ Save Opening Line")
 
     # Character Image
     st.markdown("### 🖼️ Character Image (Optional)")
@@ -1016,6 +2453,8 @@ Generate only the opening line, nothing else.
         
         # Clear old memories before starting chat
         st.session_state["memories"] = []
+        for key in ("memory_store", "memory_jobs", "pending_memory_exchanges"):
+            st.session_state.pop(key, None)
         # Start the chat
         st.session_state["chat_started"] = True
         st.session_state["chat_history"] = []
@@ -1051,9 +2490,8 @@ Generate only the opening line, nothing else.
         
         # Generate opening line if user didn't provide one
         if not opening_line.strip():
-            # Configure Gemini API for generating opening line
-            genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+            # Shared Gemini model for generating opening line
+            model = get_model(call_site="chat_opening_line")
             
             opening_prompt = f"""
 Generate an engaging opening line for a character in a chat conversation.
@@ -1115,73 +2553,8 @@ Generate only the opening line, nothing else.
         if "memories" not in st.session_state:
             st.session_state["memories"] = []
         
-        # Create two columns: chat and memories sidebar
-        chat_col, memories_col = st.columns([3, 1])
-        
-        with chat_col:
-            # Character info display
-            char_name = st.session_state.get("char_name_input", "Luna")
-            char_image = st.session_state.get("char_image_upload")
-            
-            if char_image:
-                st.image(char_image, use_container_width=False, width=200, caption=f"{char_name}'s Avatar")
-            
-            # Chat history
-            for i, entry in enumerate(st.session_state["chat_history"]):
-                if entry['user']:
-                    st.markdown(f"**You:** {entry['user']}")
-                # Format character response
-                bot_reply = format_character_response(entry['bot'], char_name)
-                st.markdown(f"**{char_name}:** {bot_reply}")
-            
-            # Chat input
-            # Check if we need to clear the input field
-            if st.session_state.get("clear_chat_input", False):
-                st.session_state["char_chat_input"] = ""
-                st.session_state["clear_chat_input"] = False
-            
-            user_input = st.text_input("Your Message", key="char_chat_input")
-            if st.button("📩 Send"):
-                # Get current memories for context
-                memories_list = st.session_state.get("memories", [])
-                memories_text = ""
-                if memories_list:
-                    memories_text = "\n\nHere are shared memories between user and character:\n" + "\n".join([f"- {memory}" for memory in memories_list])
-                
-                model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
-                full_prompt = st.session_state["character_prompt"] + memories_text + "\n\n"
-                for entry in st.session_state["chat_history"]:
-                    if entry['user']:
-                        full_prompt += f"You: {entry['user']}\n{char_name}: {entry['bot']}\n"
-                    else:
-                        full_prompt += f"{char_name}: {entry['bot']}\n"
-                full_prompt += f"You: {user_input}\n{char_name}:"
-                
-                response = model.generate_content(full_prompt)
-                reply = response.text.strip()
-                # Format the reply before saving
-                formatted_reply = format_character_response(reply, char_name)
-                
-                # Extract memory from the response
-                new_memory = memory_extractor(user_input, formatted_reply, char_name)
-                if new_memory and new_memory not in st.session_state["memories"]:
-                    st.session_state["memories"].append(new_memory)
-                
-                st.session_state["chat_history"].append({
-                    "user": user_input,
-                    "bot": formatted_reply
-                })
-                
-                # Set flag to clear input field on next render
-                st.session_state["clear_chat_input"] = True
-                st.rerun()
-
-            # Back to character creation
-            if st.button("🔄 Create New Character"):
-                st.session_state["chat_started"] = False
-                st.rerun()
-        
-        with memories_col:
+        def render_memories_column():
+            """Memory cards with delete buttons"""
             # Memories Sidebar
             st.markdown("""
             <div class="memories-sidebar">
@@ -1191,7 +2564,7 @@ Generate only the opening line, nothing else.
                 </p>
             </div>
             """, unsafe_allow_html=True)
-            
+
             if st.session_state["memories"]:
                 for i, memory in enumerate(st.session_state["memories"]):
                     # Create a styled memory card
@@ -1200,19 +2573,19 @@ Generate only the opening line, nothing else.
                         <p class="memory-text">{memory}</p>
                     </div>
                     """, unsafe_allow_html=True)
-                    
+
                     # Delete button for each memory
                     col1, col2 = st.columns([4, 1])
                     with col2:
                         if st.button(f"🗑️", key=f"delete_memory_{i}", help="Delete this memory"):
                             st.session_state["memories"].pop(i)
-                            st.rerun()
-                
+                            rerun_fragment()
+
                 st.markdown("---")
                 # Clear all memories button
                 if st.button("🗑️ Clear All Memories", key="clear_all_memories", use_container_width=True):
                     st.session_state["memories"] = []
-                    st.rerun()
+                    rerun_fragment()
             else:
                 st.markdown("""
                 <div class="empty-memories">
@@ -1220,6 +2593,118 @@ Generate only the opening line, nothing else.
                     Start chatting to create special moments! ✨
                 </div>
                 """, unsafe_allow_html=True)
+
+        @st.fragment
+        def render_memories_sidebar():
+            """Memories column; deleting memories reruns only this column"""
+            render_memories_column()
+
+        @st.fragment(run_every=MEMORY_POLL_SECONDS)
+        def poll_memories_sidebar():
+            """Memories column while background extractions run: merges their results as they finish"""
+            harvest_memory_jobs()
+            if not st.session_state.get("memory_jobs"):
+                # All merged; a full rerun shows the plain column, which stops the polling
+                st.rerun()
+            render_memories_column()
+
+        @st.fragment
+        def render_chat_area():
+            """Chat and memories columns; sending a message reruns only this area"""
+            # Pick up memories from background extractions that have finished since the last rerun
+            harvest_memory_jobs()
+            
+            # Create two columns: chat and memories sidebar
+            chat_col, memories_col = st.columns([3, 1])
+            
+            with chat_col:
+                # Character info display
+                char_name = st.session_state.get("char_name_input", "Luna")
+                char_image = st.session_state.get("char_image_upload")
+            
+                if char_image:
+                    st.image(char_image, use_container_width=False, width=200, caption=f"{char_name}'s Avatar")
+            
+                # Chat history
+                for i, entry in enumerate(st.session_state["chat_history"]):
+                    if entry['user']:
+                        st.markdown(f"**You:** {entry['user']}")
+                    # Format character response
+                    bot_reply = format_character_response(entry['bot'], char_name)
+                    st.markdown(f"**{char_name}:** {bot_reply}")
+            
+                # Streamed replies render here, directly below the history
+                reply_placeholder = st.empty()
+            
+                # Chat input
+                # Check if we need to clear the input field
+                if st.session_state.get("clear_chat_input", False):
+                    st.session_state["char_chat_input"] = ""
+                    st.session_state["clear_chat_input"] = False
+            
+                user_input = st.text_input("Your Message", key="char_chat_input")
+                if st.button("📩 Send"):
+                    model = get_model(call_site="chat_reply")
+                    # Only the memories relevant to this message (and the last reply) go into the prompt
+                    last_reply = st.session_state["chat_history"][-1]["bot"] if st.session_state["chat_history"] else ""
+                    relevant_memories = get_memory_store().search(
+                        f"{user_input} {last_reply}",
+                        st.session_state.get("memories", []),
+                    )
+                    # Character prompt, relevant memories and a bounded window of recent exchanges
+                    full_prompt = build_chat_prompt(
+                        st.session_state["character_prompt"],
+                        relevant_memories,
+                        st.session_state["chat_history"],
+                        user_input,
+                        char_name,
+                    )
+                
+                    try:
+                        if STREAM_RESPONSES:
+                            reply = stream_generate(
+                                model,
+                                full_prompt,
+                                lambda text: reply_placeholder.markdown(f"**You:** {user_input}\n\n**{char_name}:** {format_character_response(text, char_name)}"),
+                            ).strip()
+                        else:
+                            response = model.generate_content(full_prompt)
+                            reply = response.text.strip()
+                    except Exception as e:
+                        # Deadline, retries or the circuit breaker gave up; keep the message so the user can resend
+                        reply = None
+                        reply_placeholder.error(f"{char_name} couldn't reply right now. Please try sending again. ({e})")
+                
+                    if reply is not None:
+                        # Format the reply before saving
+                        formatted_reply = format_character_response(reply, char_name)
+                    
+                        # Extract memories in the background; the memories column polls until the results are merged
+                        queue_memory_extraction(user_input, formatted_reply, char_name)
+                    
+                        st.session_state["chat_history"].append({
+                            "user": user_input,
+                            "bot": formatted_reply
+                        })
+                    
+                        # Set flag to clear input field on next render
+                        st.session_state["clear_chat_input"] = True
+                        rerun_fragment()
+
+                # Back to character creation
+                if st.button("🔄 Create New Character"):
+                    # Keep the memories of exchanges still waiting for a full extraction batch
+                    flush_memory_extraction(char_name)
+                    st.session_state["chat_started"] = False
+                    st.rerun()
+
+            with memories_col:
+                if st.session_state.get("memory_jobs"):
+                    poll_memories_sidebar()
+                else:
+                    render_memories_sidebar()
+
+        render_chat_area()
     
     st.stop()
 
@@ -1227,6 +2712,7 @@ Generate only the opening line, nothing else.
 if st.session_state["app_mode"] == "roleplay":
     st.set_page_config(page_title="Create Your DreamForge World", layout="wide")
     st.title("🌍 Create Your DreamForge World")
+    render_llm_metrics_panel()
     st.markdown("""
 Welcome to the magical world of DreamForge creation! Let's build something amazing together, step by step. ✨
 """)
@@ -1248,7 +2734,11 @@ Welcome to the magical world of DreamForge creation! Let's build something amazi
             # Add exploration log and progress to the clear list
             "exploration_log", "exploration_progress", "journey_summary", "show_journey_summary",
             # Add goal action log to clear list
-            "goal_action_log"
+            "goal_action_log",
+            # Per-turn choice cache and prompt builder
+            "choices_cache", "refresh_choices", "prompt_builder",
+            # Rendered story cards, history paging and the play/creation view switch
+            "story_card_cache", "story_history_turns", "show_creation"
         ]
         # Clear character-specific keys (up to 5 characters)
         for i in range(5):
@@ -1261,15 +2751,14 @@ Welcome to the magical world of DreamForge creation! Let's build something amazi
                 del st.session_state[key]
         st.rerun()
 
-    # --- Gemini API Setup (from secrets) ---
-    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-    model_type = "gemini-2.5-flash-lite-preview-06-17"
-    model = genai.GenerativeModel(model_type)
+    response_cache_toggle()
+
+    # --- Gemini API Setup (shared model registry) ---
+    # Call sites take their own handle from get_model(call_site=...) so metrics are kept per site
 
     # --- Helper: Generate Suggestions ---
-    def generate_field(prompt):
-        response = model.generate_content(prompt)
-        return response.text.strip()
+    def generate_field(prompt, bypass=None, call_site="generate_field"):
+        return cached_generate(get_model(call_site=call_site), prompt, bypass).strip()
 
     def extract_genres(genre_match):
         if genre_match and genre_match.group(1):
@@ -1279,45 +2768,151 @@ Welcome to the magical world of DreamForge creation! Let's build something amazi
     def strip_stars(s):
         return s.strip().strip('*').strip()
 
-    def summarize_discovery(story_line, user_input=None):
-        """
-        Summarize a story line or user input into a rich discovery log entry (2–3 sentences) that captures:
-        1. What happened in the scene.
-        2. How it affected the player character.
-        3. How other characters responded or evolved.
-
-        The summary should read like a meaningful journal record rather than a simple list of discovered objects or places.
-        """
-        if not story_line and not user_input:
-            return "A new discovery was made."
+    # --- Helper: Supporting Characters ---
+    CHARACTER_TRAIT_SIMILARITY_THRESHOLD = 0.8  # traits this similar to a sibling's count as a duplicate
 
-        # Prepare the prompt for the LLM
-        prompt = f"""
-        You are updating an exploratory adventure journal. Write a discovery log entry of **2–3 complete sentences** in past tense that:
-        • Recaps what happened in the scene.
-        • Describes how the event affected the player character.
-        • Notes how the other character(s) reacted, changed, or evolved.
+    def build_character_prompt(world_context, user_name, user_traits, character_idea, existing_chars_text):
+        """Prompt for one supporting character, with or without a character idea"""
+        idea_line = f"\nCharacter Idea: {character_idea}\n" if character_idea else ""
+        idea_rule = f"- Incorporates the character idea: {character_idea}\n" if character_idea else ""
+        return f"""Create a new character for the following world:
 
-        Do not use ellipses and do not truncate the sentences.
+{world_context}
 
-        Event context: "{story_line}"
+Player Character: {user_name} ({user_traits})
+{idea_line}
+Existing Characters:
+{existing_chars_text}
+
+Create a character that:
+{idea_rule}- Is clearly different from the player character and any existing characters
+- Would naturally exist in this world
+- Has an interesting personality and abilities
+- Could interact meaningfully with the player character
+- Fits the genre and tone of the world
+
+Respond in this format:
+Name: <A standard first name and optional last name only, no titles or descriptions>
+Role: <Character Role>
+Traits: <Personality traits and special abilities>
+Voice Style: <How do they speak?>
+Relationship: <How do they relate to the player character? Are they friends, rivals, mentors, etc.?>"""
+
+    def parse_character_fields(result):
+        """Name, role, traits, voice and relationship parsed from a generated character"""
+        fields = {}
+        for field, pattern in (
+            ("name", r'Name\s*[:：\-]\s*(.*)'),
+            ("role", r'Role\s*[:：\-]\s*(.*)'),
+            ("traits", r'Traits?\s*[:：\-]\s*(.*)'),
+            ("voice", r'Voice Style\s*[:：\-]\s*(.*)'),
+            ("relationship", r'Relationship\s*[:：\-]\s*(.*)'),
+        ):
+            match = re.search(pattern, result)
+            fields[field] = match.group(1).strip() if match else ""
+        return fields
+
+    def character_summary_line(fields):
+        """One "Existing Characters" line for a generated character"""
+        char_info = f"- {fields['name']} ({fields['role']}): {fields['traits']}"
+        if fields["voice"] and fields["voice"] != "Default":
+            char_info += f" | Voice: {fields['voice']}"
+        if fields["relationship"] and fields["relationship"].strip():
+            char_info += f" | Relationship: {fields['relationship']}"
+        return char_info
+
+    def store_character(i, result, fields):
+        """Write a generated character into the stored fields and its form inputs"""
+        st.session_state[f"char_{i}"] = result
+        st.session_state[f"name_{i}"] = fields["name"]
+        st.session_state[f"role_{i}"] = fields["role"]
+        st.session_state[f"trait_{i}"] = fields["traits"]
+        st.session_state[f"voice_style_{i}"] = fields["voice"]
+        st.session_state[f"relationship_{i}"] = fields["relationship"]
+        
+        # Also update the input field values
+        st.session_state[f"name_input_{i}"] = fields["name"]
+        st.session_state[f"role_input_{i}"] = fields["role"]
+        st.session_state[f"trait_input_{i}"] = fields["traits"]
+        st.session_state[f"voice_input_{i}"] = fields["voice"]
+        st.session_state[f"relationship_input_{i}"] = fields["relationship"]
+        
+        # Increment generation counter to force form refresh
+        st.session_state[f"gen_count_{i}"] = st.session_state.get(f"gen_count_{i}", 0) + 1
+
+    def find_character_clashes(characters, player_name):
+        """Indices of characters that reuse the player's or an earlier sibling's name or role, or copy a sibling's traits"""
+        def first_name(name):
+            words = strip_stars(name).lower().split()
+            return words[0] if words else ""
+        
+        taken_names = {first_name(player_name)}
+        taken_roles = set()
+        kept = []
+        clashes = []
+        trait_vectors = hashing_embedder([c["traits"] if c else "" for c in characters])
+        for i, fields in enumerate(characters):
+            if fields is None:
+                continue
+            name = first_name(fields["name"])
+            role = fields["role"].strip().lower()
+            clash = not name or name in taken_names or (role and role in taken_roles)
+            if not clash and fields["traits"]:
+                clash = any(float(trait_vectors[i] @ trait_vectors[j]) >= CHARACTER_TRAIT_SIMILARITY_THRESHOLD for j in kept)
+            if clash:
+                clashes.append(i)
+            else:
+                kept.append(i)
+                taken_names.add(name)
+                if role:
+                    taken_roles.add(role)
+        return clashes
+
+    def summarize_discovery(story_line, user_input=None, story_brief=None):
+        """
+        Summarize a story line or user input into a rich discovery log entry (2–3 sentences) that captures:
+        1. What happened in the scene.
+        2. How it affected the player character.
+        3. How other characters responded or evolved.
+
+        The summary should read like a meaningful journal record rather than a simple list of discovered objects or places.
+        """
+        if not story_line and not user_input:
+            return "A new discovery was made."
+
+        # Prepare the prompt for the LLM
+        prompt = f"""
+        You are updating an exploratory adventure journal. Write a discovery log entry of **2–3 complete sentences** in past tense that:
+        • Recaps what happened in the scene.
+        • Describes how the event affected the player character.
+        • Notes how the other character(s) reacted, changed, or evolved.
+
+        Do not use ellipses and do not truncate the sentences.
+
+        World: "{story_brief or 'Unknown'}"
+
+        Event context: "{story_line}"
 
         Player's action: "{user_input}"
 
         Respond with ONLY the discovery log text – no list markers, no additional commentary.
         """
         try:
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+            model = get_model(call_site="summarize_discovery")
             response = model.generate_content(prompt)
             summary = response.text.strip().replace('"', '')
             return summary if summary else "A new discovery was made."
         except Exception:
             # Fallback to a simpler summary if LLM fails
-            line = str(story_line).strip()
-            line = re.sub(r'"[^"]+"', '', line)
-            line = re.sub(r'\([^)]*\)', '', line)
-            line = re.sub(r'^[A-Za-z0-9_\- ]+:?', '', line).strip()
-            return line if line else "A new discovery was made."
+            return fallback_discovery_summary(story_line)
+
+    def fallback_discovery_summary(story_line):
+        """Build a discovery log entry locally when the LLM is unavailable"""
+        line = str(story_line).strip()
+        line = re.sub(r'"[^"]+"', '', line)
+        line = re.sub(r'\([^)]*\)', '', line)
+        line = re.sub(r'^[A-Za-z0-9_\- ]+:?', '', line).strip()
+        return line if line else "A new discovery was made."
 
     def generate_journey_summary(discovery_log, character_names=None, world_title=None):
         """
@@ -1339,7 +2934,7 @@ Welcome to the magical world of DreamForge creation! Let's build something amazi
         Write the epilogue now.
         """
         try:
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+            model = get_model(call_site="generate_journey_summary")
             response = model.generate_content(prompt)
             summary = response.text.strip()
             
@@ -1352,11 +2947,12 @@ Welcome to the magical world of DreamForge creation! Let's build something amazi
             summary += "\n".join([f"- {entry.strip()}" for entry in discovery_log])
             return summary
 
-    def update_exploration_log(discovery_text, user_input=None):
+    def update_exploration_log(discovery_text, user_input=None, summary=None):
         """Add a summarized discovery to the exploration log"""
         if "exploration_log" not in st.session_state:
             st.session_state["exploration_log"] = []
-        summary = summarize_discovery(discovery_text, user_input)
+        if summary is None:
+            summary = summarize_discovery(discovery_text, user_input)
         if summary not in st.session_state["exploration_log"]:
             st.session_state["exploration_log"].append(summary)
     
@@ -1372,12 +2968,10 @@ Welcome to the magical world of DreamForge creation! Let's build something amazi
         
         return progress
 
-    def update_goal_progress_ai(goal, success, action_log):
-        """Use LLM to evaluate progress percentage based on goal, success, and action log."""
+    def estimate_goal_progress(goal, success, action_log, previous_progress=0):
+        """Ask the LLM for a progress percentage without touching session state (safe in worker threads)."""
         if not goal or not action_log:
-            st.session_state["goal_progress"] = 0
             return 0
-        genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
         prompt = f"""
 You are an expert interactive fiction game master. Given the main goal, the success condition, and a chronological list of the player's recent actions, estimate the player's progress toward achieving the goal as a percentage (0-100). Consider how much of the goal has been accomplished, how close the player is to the success condition, and any major setbacks or breakthroughs.
 
@@ -1390,24 +2984,22 @@ Recent Actions:
             prompt += f"{i}. {action}\n"
         prompt += "\nRespond ONLY with a single integer percentage (0-100)."
         try:
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+            model = get_model(call_site="estimate_goal_progress")
             response = model.generate_content(prompt)
             percent_str = response.text.strip().split("%", 1)[0]
             percent = int(''.join(filter(str.isdigit, percent_str)))
             percent = max(0, min(100, percent))
-            st.session_state["goal_progress"] = percent
             return percent
         except Exception:
             # Fallback: keep previous or 0
-            return st.session_state.get("goal_progress", 0)
+            return previous_progress
 
-    def generate_action_summary(turn_text, user_input):
+    def generate_action_summary(turn_text, user_input, story_brief=None):
         """Generate a narrative summary (1-2 sentences) of key events, goal progress, and character impacts."""
         if not turn_text:
             return "The story continued."
 
         # Generate narrative summary via LLM
-        genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
         prompt = f"""
 Summarize the following interactive fiction turn in 1-2 concise sentences, focusing on:
 - The key event that occurred
@@ -1415,6 +3007,9 @@ Summarize the following interactive fiction turn in 1-2 concise sentences, focus
 - How the player's character was impacted
 - How other characters responded or evolved
 
+World:
+{story_brief or 'Unknown'}
+
 Turn text:
 {turn_text}
 
@@ -1424,20 +3019,104 @@ Player action:
 Provide only the summary text.
 """
         try:
-            model = genai.GenerativeModel("gemini-2.5-flash-lite-preview-06-17")
+            model = get_model(call_site="generate_action_summary")
             response = model.generate_content(prompt)
             summary = response.text.strip()
             if summary.startswith('"') and summary.endswith('"'):
                 summary = summary[1:-1]
             return summary
         except Exception:
-            # Fallback simple summary
-            if user_input:
-                return f"You {user_input}" if len(user_input) < 80 else f"You {user_input[:80]}..."
-            return turn_text[:80] if turn_text else "Story continued."
+            return fallback_action_summary(turn_text, user_input)
+
+    def summarize_story_so_far(previous_summary, aged_out_turns, story_brief=None):
+        """Fold turns that left the prompt window into the rolling story summary. Returns None on failure."""
+        prompt = f"""
+Update the running summary of an interactive fiction story. Merge the earlier summary and the new turns into one concise recap (at most 150 words, past tense), focusing on:
+- The key events and discoveries so far
+- Progress toward the main goal
+- How the player's character was impacted
+- How other characters responded or evolved, and any open promises, secrets or conflicts
+
+World:
+{story_brief or 'Unknown'}
+
+Earlier summary:
+{previous_summary or 'None yet'}
+
+New turns:
+{aged_out_turns}
+
+Provide only the updated summary text.
+"""
+        try:
+            model = get_model(call_site="summarize_story_so_far")
+            response = model.generate_content(prompt)
+            summary = response.text.strip()
+            if summary.startswith('"') and summary.endswith('"'):
+                summary = summary[1:-1]
+            return summary or None
+        except Exception:
+            # Leave the turns unfolded; the token budget still bounds the prompt
+            return None
+
+    def fallback_action_summary(turn_text, user_input):
+        """Build a simple action summary locally when the LLM is unavailable"""
+        if user_input:
+            return f"You {user_input}" if len(user_input) < 80 else f"You {user_input[:80]}..."
+        return turn_text[:80] if turn_text else "Story continued."
+
+    def get_prompt_builder():
+        """Return the session's PromptBuilder, rebuilt when world_json changes and synced with the story so far"""
+        world_json = st.session_state.get("world_json", {})
+        prompt_builder = st.session_state.get("prompt_builder")
+        if prompt_builder is None or not prompt_builder.matches(world_json):
+            prompt_builder = PromptBuilder(world_json)
+            st.session_state["prompt_builder"] = prompt_builder
+        prompt_builder.sync(st.session_state.get("game_state", []), st.session_state.get("user_inputs", []))
+        return prompt_builder
+
+    def combined_turn_instructions(world_json, player_name):
+        """Response format for a combined turn: the story turn plus choices and bookkeeping as JSON"""
+        gameplay_mode = world_json.get('gameplayMode', '')
+        instructions = f"""
+Respond with one JSON object with these fields:
+- "{COMBINED_TURN_FIELD}": the next story turn in proper visual novel script format, following all the rules above
+- "choices": 3 distinct next actions for {player_name}, 1-2 sentences each (one dialogue, one action, one investigation/exploration)
+- "action_summary": 1-2 concise sentences on this turn's key event and how it affected {player_name} and the other characters
+"""
+        if gameplay_mode == "🌍 Explore the World":
+            instructions += """- "discovery": a 2-3 sentence past-tense journal entry of what was discovered this turn, how it affected the player character and how the others reacted ("" if nothing new was found)
+- Make at least 2 of the choices exploration-focused (investigate, examine, move to new areas)
+"""
+        elif gameplay_mode == "🎯 Achieve a Goal":
+            instructions += """- "goal_progress": the player's progress toward the main goal after this turn, as an integer percentage (0-100)
+"""
+        return instructions
+
+    def generate_combined_turn(prompt, user_input, color, stream_placeholder=None):
+        """One narrator call returning the parsed combined turn, or None so the caller falls back to the classic turn"""
+        model = get_model(generation_config=COMBINED_TURN_CONFIG, call_site="combined_turn")
+        try:
+            if stream_placeholder is not None:
+                def show_partial_turn(text):
+                    turn_text = partial_turn_text(text)
+                    if turn_text:
+                        stream_placeholder.markdown(story_block_html(turn_text, user_input, color, cached=False), unsafe_allow_html=True)
+                response_text = stream_generate(model, prompt, show_partial_turn)
+            else:
+                response_text = model.generate_content(prompt).text
+        except Exception:
+            return None
+        return parse_combined_turn(response_text)
+
+    def handle_send(user_input=None, stream_placeholder=None):
+        """Generate the next story turn for the player's input.
 
-    def handle_send():
-        user_input = st.session_state.get("reply_input", "")
+        With a stream_placeholder the turn is streamed into it while it is generated;
+        otherwise this runs as the Send button callback and reads the reply box.
+        """
+        if user_input is None:
+            user_input = st.session_state.get("reply_input", "")
         if user_input.strip():
             # Get the template context
             world_json = st.session_state.get("world_json", {})
@@ -1448,78 +3127,14 @@ Provide only the summary text.
             point_of_view = world_json.get('pointOfView', 'Third person')
             narration_style = world_json.get('narrationStyle', 'Balanced')
             
-            # Build the full context including template and conversation history
-            template_context = f"""
-STORY TEMPLATE:
-Title: {world_json.get('title', 'Unknown')}
-Setting: {world_json.get('setting', 'Unknown')}
-Genre: {world_json.get('genre', 'Fantasy')}
-Keywords: {world_json.get('keywords', '')}
-
-Story Style:
-- Tone: {story_tone}
-- Pacing: {pacing}
-- Point of View: {point_of_view}
-- Narration Style: {narration_style}
-
-Characters:
-"""
-            # Add all characters from template with detailed descriptions
-            for char in world_json.get('characters', []):
-                char_name = char.get('name', 'Unknown')
-                char_role = char.get('role', '')
-                char_description = char.get('description', '')
-                char_voice = char.get('voice_style', '')
-                char_relationship = char.get('relationship', '')
-                template_context += f"- {char_name} ({char_role}): {char_description}"
-                if char_voice:
-                    template_context += f" | Voice: {char_voice}"
-                if char_relationship:
-                    template_context += f" | Relationship: {char_relationship}"
-                template_context += "\n"
-            
-            # Add opening scene if available
-            if world_json.get('openingScene'):
-                template_context += f"\nOpening Scene: {world_json.get('openingScene')}\n"
-            
-            # Add gameplay mode context
+            # Template prefix and formatted history come from the session's prompt builder
+            prompt_builder = get_prompt_builder()
+            template_context = prompt_builder.narrator_context(
+                st.session_state.get("exploration_log"),
+                st.session_state.get("goal_progress"),
+            )
+            conversation_history = prompt_builder.conversation_history()
             gameplay_mode = world_json.get('gameplayMode', '')
-            if gameplay_mode:
-                template_context += f"\nGameplay Mode: {gameplay_mode}\n"
-                if gameplay_mode == "🌍 Explore the World":
-                    mode_details = world_json.get('modeDetails', {})
-                    exploration_locations = mode_details.get('exploration_locations', '')
-                    exploration_chapters = mode_details.get('exploration_chapters', '')
-                    if exploration_locations:
-                        template_context += f"Exploration Targets: {exploration_locations}\n"
-                    if exploration_chapters:
-                        template_context += f"Exploration Chapters: {exploration_chapters}\n"
-                    
-                    # Add exploration log context
-                    if "exploration_log" in st.session_state and st.session_state["exploration_log"]:
-                        template_context += f"\nExploration Log:\n"
-                        for i, discovery in enumerate(st.session_state["exploration_log"][-5:], 1):  # Last 5 discoveries
-                            template_context += f"{i}. {discovery}\n"
-                
-                elif gameplay_mode == "🎯 Achieve a Goal":
-                    mode_details = world_json.get('modeDetails', {})
-                    main_goal = mode_details.get('main_goal', '')
-                    success_condition = mode_details.get('success_condition', '')
-                    if main_goal:
-                        template_context += f"Main Goal: {main_goal}\n"
-                    if success_condition:
-                        template_context += f"Success Condition: {success_condition}\n"
-                    
-                    # Add goal progress context
-                    if "goal_progress" in st.session_state:
-                        template_context += f"Goal Progress: {st.session_state['goal_progress']}%\n"
-            
-            # Build conversation history with better formatting
-            conversation_history = ""
-            for i, (turn, user_input_hist) in enumerate(zip(st.session_state["game_state"], st.session_state["user_inputs"])):
-                if user_input_hist.strip():
-                    conversation_history += f"Player: {user_input_hist}\n"
-                conversation_history += f"Story: {turn}\n\n"
             
             introduction_instruction = ""
             # Ensure all characters are introduced within the first 3 turns
@@ -1541,13 +3156,14 @@ Characters:
             player_name = st.session_state.get("user_name", "the player")
             
             # Enhanced prompt for better consistency and formatting
-            reply_prompt = f"""
-You are an interactive fiction narrator for a visual novel. Maintain consistent character voices and story coherence.
-
-{template_context}
-
-CONVERSATION HISTORY:
-{conversation_history}
+            # Sections are collected and joined once so the history is copied a single time
+            reply_prompt_parts = [
+                "\nYou are an interactive fiction narrator for a visual novel. Maintain consistent character voices and story coherence.\n\n",
+                template_context,
+                "\n\nCONVERSATION HISTORY:\n",
+                conversation_history,
+            ]
+            reply_prompt_parts.append(f"""
 
 The player character is {player_name}.
 The player's input (action or dialogue) is: '{user_input}'.
@@ -1572,11 +3188,11 @@ CONTENT GUIDELINES:
 - Use the specified pacing: {pacing}
 - Write from the specified point of view: {point_of_view}
 - Apply the narration style: {narration_style}
-"""
+""")
             
             # Add exploration-specific instructions for faster pacing
             if gameplay_mode == "🌍 Explore the World":
-                reply_prompt += f"""
+                reply_prompt_parts.append(f"""
 EXPLORATION MODE INSTRUCTIONS:
 - Keep responses concise and fast-paced (2-3 sentences maximum for narration)
 - Focus on immediate discoveries and new locations
@@ -1587,29 +3203,43 @@ EXPLORATION MODE INSTRUCTIONS:
 - Prioritize action and discovery over lengthy character interactions
 - If the player is exploring, immediately reveal what they find
 - Keep character dialogue brief and focused on exploration
-"""
+""")
             elif gameplay_mode == "🎯 Achieve a Goal":
-                reply_prompt += f"""
+                reply_prompt_parts.append(f"""
 GOAL ACHIEVEMENT MODE INSTRUCTIONS:
 - Focus on progress toward the main goal: {world_json.get('modeDetails', {}).get('main_goal', 'Unknown Goal')}
 - Each response should advance the player toward their objective
 - Include meaningful progress or setbacks related to the goal
 - Keep character interactions relevant to the mission
-"""
+""")
             
-            reply_prompt += f"""
+            reply_prompt_parts.append(f"""
 
 MEMORY REQUIREMENTS:
 - Remember the complete story template and all character details
 - Maintain consistency with all previous interactions
 - Keep track of character relationships and story progression
 - Ensure character expressions and moods match their personalities
+""")
+            reply_prompt = "".join(reply_prompt_parts) + "\nGenerate the next story turn in proper visual novel script format:\n"
 
-Generate the next story turn in proper visual novel script format:
-"""
-            
+            model = get_model(call_site="handle_send")
+            new_color = pick_story_color()
             try:
-                new_turn = model.generate_content(reply_prompt).text.strip()
+                combined_turn = None
+                if COMBINED_TURNS:
+                    combined_prompt = "".join(reply_prompt_parts) + combined_turn_instructions(world_json, player_name)
+                    combined_turn = generate_combined_turn(combined_prompt, user_input, new_color, stream_placeholder)
+                if combined_turn:
+                    new_turn = combined_turn[COMBINED_TURN_FIELD].strip()
+                elif stream_placeholder is not None:
+                    new_turn = stream_generate(
+                        model,
+                        reply_prompt,
+                        lambda text: stream_placeholder.markdown(story_block_html(text, user_input, new_color, cached=False), unsafe_allow_html=True),
+                    ).strip()
+                else:
+                    new_turn = model.generate_content(reply_prompt).text.strip()
                 
                 # Clean up the response to ensure proper formatting
                 cleaned_turn = clean_story_response(new_turn)
@@ -1619,93 +3249,113 @@ Generate the next story turn in proper visual novel script format:
 
                 # Update gameplay mode tracking
                 gameplay_mode = world_json.get('gameplayMode', '')
+                discovery_request = None
                 if gameplay_mode == "🌍 Explore the World":
                     # Enhanced exploration log detection - more frequent logging
-                    exploration_keywords = [
-                        'discovery', 'found', 'discovered', 'uncovered', 'revealed', 'spotted', 'noticed', 'saw',
-                        'entered', 'approached', 'reached', 'arrived at', 'came across', 'stumbled upon',
-                        'explored', 'investigated', 'examined', 'looked at', 'studied', 'observed',
-                        'opened', 'unlocked', 'accessed', 'gained entry to', 'stepped into',
-                        'found a', 'discovered a', 'came to', 'walked into', 'moved toward',
-                        'new area', 'new location', 'new place', 'new room', 'new chamber',
-                        'hidden', 'secret', 'mysterious', 'ancient', 'forgotten', 'abandoned'
-                    ]
-                    
-                    # Check if the response contains exploration-related content
-                    cleaned_turn_lower = cleaned_turn.lower()
-                    has_exploration = any(keyword in cleaned_turn_lower for keyword in exploration_keywords)
-                    
-                    # Also check user input for exploration actions
-                    user_input_lower = user_input.lower()
-                    user_exploration_keywords = [
-                        'explore', 'look', 'examine', 'investigate', 'search', 'find', 'discover',
-                        'go to', 'walk to', 'move to', 'approach', 'enter', 'open', 'check',
-                        'what is', 'what\'s', 'where', 'how', 'why', 'tell me about'
-                    ]
-                    user_exploring = any(keyword in user_input_lower for keyword in user_exploration_keywords)
+                    # Check the response and the user input for exploration-related content
+                    has_exploration, best_line = find_exploration_line(cleaned_turn)
+                    user_exploring = USER_EXPLORATION_PATTERN.search(user_input) is not None
                     
                     # Log if either the response or user input suggests exploration
                     if has_exploration or user_exploring:
                         # Create a more descriptive log entry
-                        if has_exploration:
-                            # Extract the most relevant part of the response
-                            lines = cleaned_turn.split('\n')
-                            for line in lines:
-                                line_lower = line.lower()
-                                if any(keyword in line_lower for keyword in exploration_keywords):
-                                    # Clean up the line for logging
-                                    clean_line = line.replace('**What do you do?**', '').strip()
-                                    if clean_line and len(clean_line) > 10:
-                                        update_exploration_log(clean_line, user_input)
-                                        break
-                            else:
-                                # Fallback if no specific line found
-                                clean_turn = cleaned_turn.replace('**What do you do?**', '').strip()
-                                update_exploration_log(f"Explored: {clean_turn[:80]}{'...' if len(clean_turn) > 80 else ''}")
+                        if has_exploration and best_line:
+                            # The line with the most exploration keywords
+                            discovery_request = (best_line, user_input)
+                        elif has_exploration:
+                            # Fallback if no specific line found
+                            clean_turn = cleaned_turn.replace('**What do you do?**', '').strip()
+                            discovery_request = (f"Explored: {clean_turn[:80]}{'...' if len(clean_turn) > 80 else ''}", None)
                         else:
                             # User was exploring but response didn't contain exploration keywords
-                            update_exploration_log(f"Explored: {user_input[:50]}{'...' if len(user_input) > 50 else ''}")
+                            discovery_request = (f"Explored: {user_input[:50]}{'...' if len(user_input) > 50 else ''}", None)
                         # Exploration progress tracking removed – open-ended exploration
 
+                # Run the post-turn LLM calls concurrently; next turn's choices are prefetched alongside them.
+                # Fields a combined turn already answered are skipped.
+                game_state_snapshot = list(st.session_state["game_state"])
+                prompt_builder = get_prompt_builder()
+                combined_turn = combined_turn or {}
+                turn_choices = combined_choices(combined_turn)
+                discovery_summary = combined_text(combined_turn, "discovery")
+                post_turn_tasks = {}
+                if turn_choices is None:
+                    post_turn_tasks["choices"] = (generate_choices, (world_json, build_choice_prompt(world_json, prompt_builder, player_name)), None)
+                if discovery_request and not discovery_summary:
+                    post_turn_tasks["discovery"] = (summarize_discovery, discovery_request + (prompt_builder.world_brief,), fallback_discovery_summary(discovery_request[0]))
+                # Fold turns that aged out of the prompt window into the rolling summary
+                history_fold = prompt_builder.fold_request()
+                if history_fold:
+                    post_turn_tasks["story_summary"] = (summarize_story_so_far, (history_fold[0], history_fold[1], prompt_builder.world_brief), None)
                 # Always update goal progress and log in goal mode (not elif!)
+                goal_progress = combined_goal_progress(combined_turn)
+                action_summary = combined_text(combined_turn, "action_summary")
+                if gameplay_mode == "🎯 Achieve a Goal":
+                    previous_progress = st.session_state.get("goal_progress", 0)
+                    action_log = list(st.session_state.get('goal_action_log', []))
+                    if goal_progress is None:
+                        post_turn_tasks["goal_progress"] = (estimate_goal_progress, (st.session_state.get('goal_main', ''), st.session_state.get('goal_success', ''), action_log, previous_progress), previous_progress)
+                    if not action_summary:
+                        post_turn_tasks["action_summary"] = (generate_action_summary, (cleaned_turn, user_input, prompt_builder.world_brief), fallback_action_summary(cleaned_turn, user_input))
+                post_turn_results = run_llm_tasks(post_turn_tasks)
+
+                if discovery_request:
+                    update_exploration_log(discovery_request[0], discovery_request[1], summary=post_turn_results.get("discovery", discovery_summary))
                 if gameplay_mode == "🎯 Achieve a Goal":
-                    update_goal_progress_ai(st.session_state.get('goal_main', ''), st.session_state.get('goal_success', ''), st.session_state.get('goal_action_log', []))
-                    current_action_summary = generate_action_summary(cleaned_turn, user_input)
+                    st.session_state["goal_progress"] = post_turn_results.get("goal_progress", goal_progress)
                     if "goal_action_log" not in st.session_state:
                         st.session_state["goal_action_log"] = []
-                    st.session_state["goal_action_log"].append(current_action_summary)
+                    st.session_state["goal_action_log"].append(post_turn_results.get("action_summary", action_summary))
+                turn_choices = post_turn_results.get("choices", turn_choices)
+                if turn_choices:
+                    store_turn_choices(game_state_snapshot, turn_choices)
+                if post_turn_results.get("story_summary"):
+                    prompt_builder.apply_fold(post_turn_results["story_summary"], history_fold[2])
 
                 # Clear the input box for the next turn
                 st.session_state["reply_input"] = ""
 
-                existing_colors = st.session_state.get("story_colors", [])
-                available_colors = [
-                    c
-                    for c in ["#fce4ec", "#e3f2fd", "#e8f5e9", "#fff8e1", "#ede7f6"]
-                    if c != existing_colors[-1]
-                ]
-                new_color = random.choice(available_colors)
                 st.session_state["story_colors"].append(new_color)
-                st.rerun() # Ensure UI refreshes to show progress
+                if stream_placeholder is not None:
+                    rerun_fragment() # Ensure the play area refreshes to show progress
             except Exception as e:
-                st.error(f"Error generating story response: {e}")
+                # Kept in session state so the error is still shown after the rerun below
+                st.session_state["story_error"] = f"Error generating story response: {e}"
                 # Fallback response
                 fallback_response = f'The story continues...\n**What do you do?**'
                 st.session_state["game_state"].append(fallback_response)
                 st.session_state["user_inputs"].append(user_input.strip())
                 st.session_state["reply_input"] = ""
                 
-                existing_colors = st.session_state.get("story_colors", [])
-                available_colors = [
-                    c
-                    for c in ["#fce4ec", "#e3f2fd", "#e8f5e9", "#fff8e1", "#ede7f6"]
-                    if c != existing_colors[-1]
-                ]
-                new_color = random.choice(available_colors)
                 st.session_state["story_colors"].append(new_color)
-                st.rerun() # Ensure UI refreshes to show progress
+                if stream_placeholder is not None:
+                    rerun_fragment() # Ensure the play area refreshes to show progress
             # st.rerun is implicit with on_click callback
 
+    def pick_story_color():
+        """Pick a background color for the next story block that differs from the last one"""
+        existing_colors = st.session_state.get("story_colors", [])
+        available_colors = [
+            c
+            for c in ["#fce4ec", "#e3f2fd", "#e8f5e9", "#fff8e1", "#ede7f6"]
+            if not existing_colors or c != existing_colors[-1]
+        ]
+        return random.choice(available_colors)
+
+    def submit_reply():
+        """Send button callback: with streaming on, queue the reply so the turn streams into the story area"""
+        if STREAM_RESPONSES:
+            st.session_state["pending_reply"] = st.session_state.get("reply_input", "")
+            st.session_state["reply_input"] = ""
+        else:
+            handle_send()
+
+    def process_pending_reply():
+        """Stream a queued turn directly below the story so far"""
+        pending_reply = st.session_state.pop("pending_reply", None)
+        if pending_reply:
+            handle_send(pending_reply, st.empty())
+
     def clean_story_response(response_text):
         """Clean and format the story response to ensure consistency"""
         if not response_text:
@@ -1724,168 +3374,103 @@ Generate the next story turn in proper visual novel script format:
             if line.startswith('**') and line.endswith('**'):
                 # Keep bold text as is
                 cleaned_lines.append(line)
-            elif '"' in line:
-                # Check if it's already in script format with expression: CharacterName (expression) "dialogue"
-                if re.match(r'^[a-zA-Z\s]+\([^)]*\)\s*["\']', line):
-                    # Already in correct format, keep as is
-                    cleaned_lines.append(line)
-                # Check if it's in basic script format: CharacterName "dialogue"
-                elif re.match(r'^[a-zA-Z\s]+["\']', line):
-                    # Convert to new format: CharacterName (expression) "dialogue"
-                    match = re.match(r'^([^"]+)\s*"([^"]+)"', line)
-                    if match:
-                        speaker = match.group(1).strip()
-                        dialogue = match.group(2)
-                        if speaker.lower() == 'narrator':
-                            # Narrator without quotes
-                            cleaned_lines.append(f'{dialogue}')
-                        else:
-                            # Character with expression
-                            cleaned_lines.append(f'{speaker} (calmly) "{dialogue}"')
-                    else:
-                        cleaned_lines.append(line)
-                else:
-                    # Try to convert to script format
-                    match = re.match(r'^([^:]+):\s*["\'](.+)["\']', line)
-                    if match:
-                        speaker = match.group(1).strip()
-                        dialogue = match.group(2)
-                        if speaker.lower() == 'narrator':
-                            cleaned_lines.append(f'{dialogue}')
-                        else:
-                            cleaned_lines.append(f'{speaker} (calmly) "{dialogue}"')
-                    else:
-                        # Assume it's narration
-                        cleaned_lines.append(f'{line}')
-            else:
+                continue
+            if '"' not in line:
                 # Assume it's narration
-                cleaned_lines.append(f'{line}')
+                cleaned_lines.append(line)
+                continue
+            
+            # Already in script format with expression: CharacterName (expression) "dialogue"
+            if SCRIPT_LINE_WITH_EXPRESSION.match(line):
+                cleaned_lines.append(line)
+                continue
+            # Basic script format (CharacterName "dialogue") or colon format (CharacterName: "dialogue")
+            match = SPEAKER_LINE.match(line) if SCRIPT_LINE.match(line) else COLON_DIALOGUE_LINE.match(line)
+            if not match:
+                # Unrecognised quoting: keep as narration
+                cleaned_lines.append(line)
+                continue
+            speaker = match.group(1).strip()
+            dialogue = match.group(2)
+            if speaker.lower() == 'narrator':
+                # Narrator without quotes
+                cleaned_lines.append(dialogue)
+            else:
+                # Convert to new format: CharacterName (expression) "dialogue"
+                cleaned_lines.append(f'{speaker} (calmly) "{dialogue}"')
         
         # Ensure it ends with "What do you do?"
-        if not any('What do you do?' in line for line in cleaned_lines):
-            cleaned_lines.append('**What do you do?**')
+        if not any(STORY_PROMPT in line for line in cleaned_lines):
+            cleaned_lines.append(f'**{STORY_PROMPT}**')
         
         return '\n'.join(cleaned_lines)
 
-    def format_story_block(block_text):
+    def format_story_block(block_text, cached=True):
         """Format story block for consistent display"""
         if not block_text:
             return '<p style="margin:4px 0; color:#666;">Story continues...</p>'
-        
-        formatted_lines = []
-        lines = block_text.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Handle "What do you do?" prompt
-            if 'What do you do?' in line:
-                formatted_lines.append('<p style="margin:8px 0; font-weight:bold; color:#2c3e50;">**What do you do?**</p>')
-                continue
-            
-            # Remove 'narrator' prefix for narration lines and display cleanly
-            if line.startswith('narrator '):
-                content = line[9:]  # Remove 'narrator '
-                formatted_lines.append(f'<p style="margin:4px 0; color:#555;">{content}</p>')
-                continue
-            
-            # Character dialogue with expressions: bold everything before the first quote
-            if '"' in line:
-                # Try to extract speaker with expression: CharacterName (expression) "dialogue"
-                match = re.match(r'^([^(]+\([^)]*\))\s*"([^"]+)"', line)
-                if match:
-                    speaker_expr = match.group(1).strip()
-                    dialogue = match.group(2)
-                    formatted_lines.append(f'<p style="margin:4px 0;"><b style="color:#2c3e50;">{speaker_expr}:</b> "{dialogue}"</p>')
-                    continue
-                
-                # Try to extract speaker without expression: CharacterName "dialogue"
-                match = re.match(r'^([^"]+)\s*"([^"]+)"', line)
-                if match:
-                    speaker = match.group(1).strip()
-                    dialogue = match.group(2)
-                    # Only bold if it looks like a character name (not just random text)
-                    if not speaker.lower() in ['narrator', 'story', 'scene'] and len(speaker.strip()) > 0:
-                        formatted_lines.append(f'<p style="margin:4px 0;"><b style="color:#2c3e50;">{speaker}:</b> "{dialogue}"</p>')
-                    else:
-                        formatted_lines.append(f'<p style="margin:4px 0; color:#555;">{speaker}: "{dialogue}"</p>')
-                    continue
-            
-            # Handle other formats (fallback)
-            if line.startswith('**') and line.endswith('**'):
-                # Bold text
-                content = line[2:-2]
-                formatted_lines.append(f'<p style="margin:4px 0; font-weight:bold; color:#2c3e50;">{content}</p>')
-            else:
-                # Plain narration (no narrator prefix)
-                formatted_lines.append(f'<p style="margin:4px 0; color:#555;">{line}</p>')
-        
-        return ''.join(formatted_lines)
+        if not cached:
+            # Text still streaming in is shown once; caching it would only evict finished blocks
+            return render_story_lines(parse_story_block(block_text))
+        return get_story_block_cache().lookup(block_text).html
 
     def handle_choice_click(choice_text):
         st.session_state.reply_input = choice_text
-        handle_send()
-
-    def generate_choices():
-        """Generate 3 choice options for the player"""
-        if "game_state" in st.session_state and st.session_state["game_state"]:
-            # Get the template context
-            world_json = st.session_state.get("world_json", {})
-            
-            # Get advanced settings from the JSON template
-            story_tone = world_json.get('storyTone', 'Balanced')
-            pacing = world_json.get('pacing', 'Balanced')
-            point_of_view = world_json.get('pointOfView', 'Third person')
-            narration_style = world_json.get('narrationStyle', 'Balanced')
-            
-            # Build template context
-            template_context = f"""
-STORY TEMPLATE:
-Title: {world_json.get('title', 'Unknown')}
-Setting: {world_json.get('setting', 'Unknown')}
-Genre: {world_json.get('genre', 'Fantasy')}
-Keywords: {world_json.get('keywords', '')}
-
-Story Style:
-- Tone: {story_tone}
-- Pacing: {pacing}
-- Point of View: {point_of_view}
-- Narration Style: {narration_style}
-
-Characters:
-"""
-            # Add all characters from template
-            for char in world_json.get('characters', []):
-                char_name = char.get('name', 'Unknown')
-                char_role = char.get('role', '')
-                char_description = char.get('description', '')
-                char_voice = char.get('voice_style', '')
-                char_relationship = char.get('relationship', '')
-                template_context += f"- {char_name} ({char_role}): {char_description}"
-                if char_voice:
-                    template_context += f" | Voice: {char_voice}"
-                if char_relationship:
-                    template_context += f" | Relationship: {char_relationship}"
-                template_context += "\n"
-            
-            # Build conversation history
-            conversation_history = ""
-            for i, (turn, user_input_hist) in enumerate(zip(st.session_state["game_state"], st.session_state["user_inputs"])):
-                if user_input_hist.strip():
-                    conversation_history += f"Player: {user_input_hist}\n"
-                conversation_history += f"Story: {turn}\n\n"
-            
-            player_name = st.session_state.get("user_name", "the player")
-            
-            choice_prompt = f"""
-Based on the current story situation, generate 3 different action choices for {player_name}.
-
-{template_context}
+        submit_reply()
+
+    def story_block_html(block, user_input, color, cached=True):
+        """Render one story block (with the player's reply above it) as a colored card"""
+        user_reply_html = f'<p style="margin-bottom:8px; padding:4px; background-color:#f0f0f0; border-radius:4px;"><b>You:</b> {user_input}</p>' if user_input.strip() else ""
+
+        # Enhanced formatting for better readability
+        formatted_block = format_story_block(block, cached)
+
+        return f'<div style="background-color:{color}; padding:15px; border-radius:10px; margin-bottom:15px; box-shadow:0 2px 4px rgba(0,0,0,0.1)">{user_reply_html}{formatted_block}</div>'
+
+    def story_card_html(i, block, user_input, color):
+        """story_block_html for turn i, reused across reruns while the turn's content and color are unchanged"""
+        card_cache = st.session_state.setdefault("story_card_cache", {})
+        content_key = (hash(block), hash(user_input), color)
+        cached = card_cache.get(i)
+        if cached is None or cached[0] != content_key:
+            cached = (content_key, story_block_html(block, user_input, color))
+            card_cache[i] = cached
+        return cached[1]
+
+    def show_earlier_turns():
+        visible_turns = st.session_state.get("story_history_turns", STORY_HISTORY_PAGE_SIZE)
+        st.session_state["story_history_turns"] = visible_turns + STORY_HISTORY_PAGE_SIZE
+
+    def render_story_history():
+        """Render the latest turns as one HTML fragment; earlier turns stay hidden behind "Load earlier turns" """
+        game_state = st.session_state["game_state"]
+        user_inputs = st.session_state["user_inputs"]
+        story_colors = st.session_state.get("story_colors") or ["#e3f2fd"]
+        turn_count = min(len(game_state), len(user_inputs))
+        first_visible = max(0, turn_count - st.session_state.get("story_history_turns", STORY_HISTORY_PAGE_SIZE))
+        if first_visible:
+            st.button(f"⬆️ Load earlier turns ({first_visible} hidden)", key="load_earlier_turns", on_click=show_earlier_turns)
+        st.markdown(
+            "".join(
+                story_card_html(i, game_state[i], user_inputs[i], story_colors[i % len(story_colors)])
+                for i in range(first_visible, turn_count)
+            ),
+            unsafe_allow_html=True,
+        )
 
-CONVERSATION HISTORY:
-{conversation_history}
+    def build_choice_prompt(world_json, prompt_builder, player_name):
+        """Build the choice prompt from the session's prompt builder (call on the script thread)"""
+        # Get advanced settings from the JSON template
+        story_tone = world_json.get('storyTone', 'Balanced')
+        pacing = world_json.get('pacing', 'Balanced')
+        
+        choice_prompt_parts = [
+            f"\nBased on the current story situation, generate 3 different action choices for {player_name}.\n\n",
+            prompt_builder.choice_context(),
+            "\n\nCONVERSATION HISTORY:\n",
+            prompt_builder.conversation_history(),
+        ]
+        choice_prompt_parts.append(f"""
 
 Generate 3 distinct choices that would make sense for the player character in this situation. 
 Each choice should be:
@@ -1896,12 +3481,12 @@ Each choice should be:
 - Consistent with the story template and setting
 - Match the story tone: {story_tone}
 - Consider the pacing: {pacing}
-"""
-            
-            # Add exploration-specific choice instructions
-            gameplay_mode = world_json.get('gameplayMode', '')
-            if gameplay_mode == "🌍 Explore the World":
-                choice_prompt += f"""
+""")
+        
+        # Add exploration-specific choice instructions
+        gameplay_mode = world_json.get('gameplayMode', '')
+        if gameplay_mode == "🌍 Explore the World":
+            choice_prompt_parts.append(f"""
 EXPLORATION MODE CHOICE GUIDELINES:
 - Prioritize exploration and discovery choices
 - Include at least 2 exploration-focused options (investigate, examine, move to new areas)
@@ -1915,16 +3500,16 @@ CHOICE TYPES FOR EXPLORATION:
 1. Exploration/Investigation choice (examine, investigate, move to new area)
 2. Quick dialogue choice (ask about location, get directions, learn about area)
 3. Action choice (interact with objects, open doors, climb, etc.)
-"""
-            else:
-                choice_prompt += f"""
+""")
+        else:
+            choice_prompt_parts.append(f"""
 CHOICE TYPES:
 1. Dialogue choice (speaking to someone)
 2. Action choice (doing something physical)
 3. Investigation/Exploration choice (examining surroundings or moving)
-"""
-            
-            choice_prompt += f"""
+""")
+        
+        choice_prompt_parts.append(f"""
 
 Format as:
 1. [First choice]
@@ -1932,10 +3517,23 @@ Format as:
 3. [Third choice]
 
 Generate only the 3 choices, nothing else.
-"""
-            
+""")
+        return "".join(choice_prompt_parts)
+
+    def generate_choices(world_json=None, choice_prompt=None):
+        """Generate 3 choice options for the player.
+
+        The prompt defaults to one built from the current session; pass a prebuilt
+        choice_prompt when calling from a worker thread.
+        """
+        if world_json is None:
+            world_json = st.session_state.get("world_json", {})
+        gameplay_mode = world_json.get('gameplayMode', '')
+        if choice_prompt is None and st.session_state.get("game_state"):
+            choice_prompt = build_choice_prompt(world_json, get_prompt_builder(), st.session_state.get("user_name", "the player"))
+        if choice_prompt:
             try:
-                response = model.generate_content(choice_prompt)
+                response = get_model(call_site="generate_choices").generate_content(choice_prompt)
                 choices_text = response.text.strip()
                 
                 # Parse the choices
@@ -1987,8 +3585,6 @@ Generate only the 3 choices, nothing else.
                     ]
         
         # Final fallback for when no game state exists
-        world_json = st.session_state.get("world_json", {})
-        gameplay_mode = world_json.get('gameplayMode', '')
         if gameplay_mode == "🌍 Explore the World":
             return [
                 "Examine the surroundings for anything interesting",
@@ -2002,6 +3598,236 @@ Generate only the 3 choices, nothing else.
                 "Continue exploring the surroundings"
             ]
 
+    def choices_turn_key(game_state):
+        # A turn is identified by its position and content so a restarted game never reuses stale choices
+        return (len(game_state), hash(game_state[-1]) if game_state else None)
+
+    def store_turn_choices(game_state, choices):
+        """Cache choices computed ahead of time (e.g. prefetched alongside post-turn bookkeeping)"""
+        choices_cache = st.session_state.setdefault("choices_cache", {})
+        choices_cache.clear()
+        choices_cache[choices_turn_key(game_state)] = choices
+
+    def get_turn_choices(force_refresh=False):
+        """Return the choices for the current story turn, generating them at most once per turn"""
+        turn_key = choices_turn_key(st.session_state.get("game_state", []))
+        choices_cache = st.session_state.setdefault("choices_cache", {})
+        if st.session_state.pop("refresh_choices", False):
+            force_refresh = True
+        if force_refresh or turn_key not in choices_cache:
+            # Only the current turn's choices are ever shown, so older entries are dropped
+            choices_cache.clear()
+            choices_cache[turn_key] = generate_choices()
+        return choices_cache[turn_key]
+
+    def request_new_choices():
+        st.session_state["refresh_choices"] = True
+
+    def render_game_turn(gameplay_mode, world_json):
+        """The story so far plus the player's turn controls: one choice evaluation and one Send per rerun"""
+        render_story_history()
+
+        story_error = st.session_state.pop("story_error", None)
+        if story_error:
+            st.error(story_error)
+
+        process_pending_reply()
+
+        # Game input (only appears when game is active)
+        if not st.session_state.get("show_journey_summary"):
+            st.markdown("### 🎮 Your Turn")
+
+            # Generate 3 choice options (cached per turn)
+            choices = get_turn_choices()
+
+            # Display choice buttons vertically with full description
+            st.markdown("**Choose an action or write your own:**")
+            st.button("🔄 New Choices", key="refresh_choices_btn", on_click=request_new_choices)
+            for idx, choice in enumerate(choices):
+                btn_label = f"Choice {idx+1}: {choice}"
+                if st.button(btn_label, key=f"choice_{idx+1}_{len(st.session_state['game_state'])}", on_click=handle_choice_click, args=(choice,)):
+                    pass
+
+            # Freeform input
+            st.markdown("**Or write your own action/dialogue:**")
+            st.text_input("Enter your next action or dialogue", key="reply_input")
+
+            # Always show Send button below input
+            st.button("Send", on_click=submit_reply)
+
+            # Show goal completion feedback below input if progress is 100%
+            if gameplay_mode == "🎯 Achieve a Goal":
+                progress = st.session_state.get("goal_progress", 0)
+                mode_details = world_json.get('modeDetails', {})
+                main_goal = mode_details.get('main_goal', 'Unknown Goal')
+                if progress >= 100:
+                    st.success("🏆 You achieved your goal!")
+                    st.markdown(f"**Goal:** {main_goal}")
+                    st.markdown(f"**Completed in:** {len(st.session_state.get('game_state', []))} turns")
+
+            # Create columns for End Journey button (for exploration mode)
+            if gameplay_mode == "🌍 Explore the World":
+                send_col, end_col = st.columns([1, 1])
+                with end_col:
+                    if st.button("🛑 End Journey", key="end_exploration_main"):
+                        with st.spinner("Writing the epilogue to your journey..."):
+                            world_title = world_json.get('title', None)
+                            summary = generate_journey_summary(st.session_state.get("exploration_log", []), None, world_title)
+                            st.session_state["journey_summary"] = summary
+                            st.session_state["show_journey_summary"] = True
+                            rerun_fragment()
+            # ... (rest of gameplay modes) ...
+
+        # After the story blocks, show the journey summary if available
+        if st.session_state.get("show_journey_summary"):
+            st.success("✨ Your exploration of DreamForge is complete! See your journey summary below.")
+            with st.container():
+                st.markdown("---")
+                st.markdown("### Your Journey's Epilogue")
+                st.markdown(st.session_state["journey_summary"])
+                if st.button("Back to Creation"):
+                    st.session_state["show_journey_summary"] = False
+                    st.session_state["show_creation"] = True
+                    st.rerun()
+
+    def render_gameplay_sidebar(gameplay_mode, world_json):
+        """Discovery log or goal progress next to the game"""
+        # Gameplay Mode Sidebar
+        if gameplay_mode == "🌍 Explore the World":
+            st.markdown("""
+            <div class="memories-sidebar">
+                <h3>🌍 Discovery Log</h3>
+                <p style="color: #6c757d; font-size: 14px; margin-bottom: 20px;">
+                    <em>Places and mysteries you've uncovered</em>
+                </p>
+            </div>
+            """, unsafe_allow_html=True)
+
+            # Progress bar removed – exploration is open-ended
+            if "exploration_log" in st.session_state and st.session_state["exploration_log"]:
+                for i, discovery in enumerate(st.session_state["exploration_log"]):
+                    st.markdown(f"""
+                    <div class=\"memory-card\">
+                        <p class=\"memory-text\">{discovery}</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+            else:
+                st.markdown("""
+                <div class=\"empty-memories\">
+                    No discoveries yet.<br>
+                    Keep exploring to uncover secrets! 🗺️
+                </div>
+                """, unsafe_allow_html=True)
+
+        elif gameplay_mode == "🎯 Achieve a Goal":
+            st.markdown("""
+            <div class="memories-sidebar">
+                <h3>🎯 Goal Progress</h3>
+                <p style="color: #6c757d; font-size: 14px; margin-bottom: 20px;">
+                    <em>Track your mission progress</em>
+                </p>
+            </div>
+            """, unsafe_allow_html=True)
+
+            mode_details = world_json.get('modeDetails', {})
+            main_goal = mode_details.get('main_goal', 'Unknown Goal')
+            success_condition = mode_details.get('success_condition', '')
+
+            # Goal information card
+            st.markdown(f"""
+            <div class="memory-card">
+                <p class="memory-text"><strong>Goal:</strong> {main_goal}</p>
+            </div>
+            """, unsafe_allow_html=True)
+
+            if success_condition:
+                st.markdown(f"""
+                <div class="memory-card">
+                    <p class="memory-text"><strong>Success:</strong> {success_condition}</p>
+                </div>
+                """, unsafe_allow_html=True)
+
+            # Progress bar
+            progress = st.session_state.get("goal_progress", 0)
+            st.progress(progress / 100)
+            st.markdown(f"**Progress:** {progress}%")
+
+            # Recent Actions - show complete information
+            if "goal_action_log" in st.session_state and st.session_state["goal_action_log"]:
+                st.markdown("**Recent Actions:**")
+                for i, action_summary in enumerate(st.session_state["goal_action_log"], 1):
+                    if action_summary:
+                        st.markdown(f"""
+                        <div class="memory-card">
+                            <p class="memory-text"><strong>{i}.</strong> {action_summary}</p>
+                        </div>
+                        """, unsafe_allow_html=True)
+            else:
+                st.markdown("""
+                <div class="empty-memories">
+                    No actions yet.<br>
+                    Start playing to make progress! 🚀
+                </div>
+                """, unsafe_allow_html=True)
+
+    @st.fragment
+    def render_play_area():
+        """The Step 5 game; choices and Send rerun only this area"""
+        # Get gameplay mode for sidebar
+        world_json = st.session_state.get("world_json", {})
+        gameplay_mode = world_json.get('gameplayMode', '')
+
+        # Create columns for main game and sidebar
+        if gameplay_mode and gameplay_mode in ["🌍 Explore the World", "🎯 Achieve a Goal"]:
+            game_col, sidebar_col = st.columns([3, 1])
+            with game_col:
+                render_game_turn(gameplay_mode, world_json)
+            with sidebar_col:
+                render_gameplay_sidebar(gameplay_mode, world_json)
+        else:
+            # No sidebar layout for other modes
+            render_game_turn(gameplay_mode, world_json)
+
+    def pick_random_value(key, options):
+        """🎲 Random callback: fill the field in session state before the rerun draws it"""
+        st.session_state[key] = random.choice(options)
+
+    def keep_creation_inputs():
+        """Keep the creation steps' widget values while their widgets are not rendered"""
+        # Streamlit drops the state of widgets missing from a run; writing a value back makes it plain session state
+        creation_keys = [
+            "world_inspiration", "world_environment", "world_mood", "world_magic", "world_genre",
+            "world_title_display", "world_setting_display", "world_keywords_display",
+            "user_name_input", "user_traits_input", "num_characters_slider",
+            "gameplay_mode", "exploration_locations", "exploration_chapters", "goal_main", "goal_success",
+            "opening_scene_input", "story_tone", "pacing", "pov", "narration_style"
+        ]
+        # Character-specific keys (up to 5 characters)
+        for i in range(5):
+            creation_keys.extend([
+                f"idea_{i}", f"name_input_{i}", f"role_input_{i}", f"trait_input_{i}",
+                f"relationship_input_{i}", f"voice_input_{i}"
+            ])
+        for key in creation_keys:
+            if key in st.session_state:
+                st.session_state[key] = st.session_state[key]
+
+    # --- Play View ---
+    # While a game is running only the game is rendered: Steps 1-5 are skipped until the player
+    # goes back to them, so a rerun during play costs no more than the play area itself.
+    if "game_state" in st.session_state and not st.session_state.get("show_creation"):
+        keep_creation_inputs()
+        st.markdown("---")
+        st.subheader("🚀 Game In Progress")
+        if st.button("⬅️ Back to Creation", key="back_to_creation"):
+            st.session_state["show_creation"] = True
+            st.rerun()
+        render_play_area()
+
+        # Footer
+        st.caption("Built by Claire Wang for the DreamForge PM Take-Home Project ✨")
+        st.stop()
+
     # --- Step Overview ---
     st.markdown("---")
     st.markdown("### 📋 Creation Steps Overview")
@@ -2052,196 +3878,189 @@ Generate only the 3 choices, nothing else.
     st.markdown("---")
     st.markdown("## 🌍 Step 1: Your DreamForge World")
 
-    # --- World Inspiration ---
-    st.markdown("### 🌈 World Inspiration")
-    st.markdown("**What's a theme, object, or feeling that inspires your world? Anything works — just a spark!**")
+    with st.form("world_spark_form", border=False):
+        # --- World Inspiration ---
+        st.markdown("### 🌈 World Inspiration")
+        st.markdown("**What's a theme, object, or feeling that inspires your world? Anything works — just a spark!**")
 
-    # Add random button above input
-    if st.button("🎲 Random Inspiration", key="random_inspiration"):
+        # Add random button above input
         random_inspirations = [
             "zoo", "library", "sunset", "music", "dreams", "friendship", "ancient ruins", "lost city", "enchanted forest", "forgotten melody"
         ]
-        st.session_state["world_inspiration"] = random.choice(random_inspirations)
-        st.rerun()
+        st.form_submit_button("🎲 Random Inspiration", key="random_inspiration", on_click=pick_random_value, args=("world_inspiration", random_inspirations))
     
-    if "world_inspiration" not in st.session_state:
-        st.session_state["world_inspiration"] = ""
-    world_inspiration = st.text_input(
-        "Your inspiration spark",
-        value=st.session_state["world_inspiration"],
-        placeholder="zoo / library / sunset / music / dreams / friendship",
-        key="world_inspiration"
-    )
+        if "world_inspiration" not in st.session_state:
+            st.session_state["world_inspiration"] = ""
+        world_inspiration = st.text_input(
+            "Your inspiration spark",
+            value=st.session_state["world_inspiration"],
+            placeholder="zoo / library / sunset / music / dreams / friendship",
+            key="world_inspiration"
+        )
 
-    if world_inspiration.strip():
-        # Dynamic feedback based on input
-        inspiration_lower = world_inspiration.lower()
-        if any(word in inspiration_lower for word in ["zoo", "animal", "creature"]):
-            st.success("🦁 Ooooh, a zoo world! That sounds fascinating! Let's shape it into something magical together.")
-        elif any(word in inspiration_lower for word in ["library", "book", "story"]):
-            st.success("📚 A library world! That sounds fascinating! Let's shape it into something magical together.")
-        elif any(word in inspiration_lower for word in ["sunset", "sun", "light"]):
-            st.success("🌅 A sunset world! That sounds fascinating! Let's shape it into something magical together.")
-        elif any(word in inspiration_lower for word in ["music", "song", "melody"]):
-            st.success("🎵 A music world! That sounds fascinating! Let's shape it into something magical together.")
-        elif any(word in inspiration_lower for word in ["dream", "sleep", "night"]):
-            st.success("💭 A dream world! That sounds fascinating! Let's shape it into something magical together.")
-        else:
-            st.success("✨ Ooooh, that sounds fascinating! Let's shape it into something magical together.")
+        if world_inspiration.strip():
+            # Dynamic feedback based on input
+            inspiration_lower = world_inspiration.lower()
+            if any(word in inspiration_lower for word in ["zoo", "animal", "creature"]):
+                st.success("🦁 Ooooh, a zoo world! That sounds fascinating! Let's shape it into something magical together.")
+            elif any(word in inspiration_lower for word in ["library", "book", "story"]):
+                st.success("📚 A library world! That sounds fascinating! Let's shape it into something magical together.")
+            elif any(word in inspiration_lower for word in ["sunset", "sun", "light"]):
+                st.success("🌅 A sunset world! That sounds fascinating! Let's shape it into something magical together.")
+            elif any(word in inspiration_lower for word in ["music", "song", "melody"]):
+                st.success("🎵 A music world! That sounds fascinating! Let's shape it into something magical together.")
+            elif any(word in inspiration_lower for word in ["dream", "sleep", "night"]):
+                st.success("💭 A dream world! That sounds fascinating! Let's shape it into something magical together.")
+            else:
+                st.success("✨ Ooooh, that sounds fascinating! Let's shape it into something magical together.")
 
-    # --- Environment / Setting ---
-    st.markdown("### 🌍 Environment / Setting")
-    st.markdown("**Where does your world take place? Think big: forest canopy, underwater palace, moonlit garden…**")
+        # --- Environment / Setting ---
+        st.markdown("### 🌍 Environment / Setting")
+        st.markdown("**Where does your world take place? Think big: forest canopy, underwater palace, moonlit garden…**")
 
-    # Add random button above input
-    if st.button("🎲 Random Environment", key="random_environment"):
+        # Add random button above input
         random_envs = [
             "a floating island in the sky", "underwater palace", "forest canopy", "moonlit garden", "crystal caves", "ancient ruins", "desert oasis", "city of clouds", "volcanic fortress"
         ]
-        st.session_state["world_environment"] = random.choice(random_envs)
-        st.rerun()
+        st.form_submit_button("🎲 Random Environment", key="random_environment", on_click=pick_random_value, args=("world_environment", random_envs))
     
-    if "world_environment" not in st.session_state:
-        st.session_state["world_environment"] = ""
-    world_environment = st.text_input(
-        "Your world's environment",
-        value=st.session_state["world_environment"],
-        placeholder="a floating island in the sky / underwater palace / forest canopy / moonlit garden",
-        key="world_environment"
-    )
+        if "world_environment" not in st.session_state:
+            st.session_state["world_environment"] = ""
+        world_environment = st.text_input(
+            "Your world's environment",
+            value=st.session_state["world_environment"],
+            placeholder="a floating island in the sky / underwater palace / forest canopy / moonlit garden",
+            key="world_environment"
+        )
 
-    if world_environment.strip():
-        # Dynamic feedback based on input
-        environment_lower = world_environment.lower()
-        if any(word in environment_lower for word in ["floating", "sky", "air", "cloud"]):
-            st.success("☁️ I can already picture it! A floating world is full of wonder and potential.")
-        elif any(word in environment_lower for word in ["underwater", "ocean", "sea", "water"]):
-            st.success("🌊 I can already picture it! An underwater world is full of wonder and potential.")
-        elif any(word in environment_lower for word in ["forest", "tree", "nature"]):
-            st.success("🌳 I can already picture it! A forest world is full of wonder and potential.")
-        elif any(word in environment_lower for word in ["garden", "flower", "plant"]):
-            st.success("🌸 I can already picture it! A garden world is full of wonder and potential.")
-        else:
-            st.success("🏞️ I can already picture it! That setting is full of wonder and potential.")
+        if world_environment.strip():
+            # Dynamic feedback based on input
+            environment_lower = world_environment.lower()
+            if any(word in environment_lower for word in ["floating", "sky", "air", "cloud"]):
+                st.success("☁️ I can already picture it! A floating world is full of wonder and potential.")
+            elif any(word in environment_lower for word in ["underwater", "ocean", "sea", "water"]):
+                st.success("🌊 I can already picture it! An underwater world is full of wonder and potential.")
+            elif any(word in environment_lower for word in ["forest", "tree", "nature"]):
+                st.success("🌳 I can already picture it! A forest world is full of wonder and potential.")
+            elif any(word in environment_lower for word in ["garden", "flower", "plant"]):
+                st.success("🌸 I can already picture it! A garden world is full of wonder and potential.")
+            else:
+                st.success("🏞️ I can already picture it! That setting is full of wonder and potential.")
 
-    # --- Mood / Vibe ---
-    st.markdown("### 🎭 Mood / Vibe")
-    st.markdown("**What kind of mood does your world have? Cozy? Mysterious? Epic? Peaceful?**")
+        # --- Mood / Vibe ---
+        st.markdown("### 🎭 Mood / Vibe")
+        st.markdown("**What kind of mood does your world have? Cozy? Mysterious? Epic? Peaceful?**")
 
-    # Add random button above input
-    if st.button("🎲 Random Mood", key="random_mood"):
+        # Add random button above input
         random_moods = [
             "serene and dreamlike", "cozy and warm", "mysterious and dark", "epic and adventurous", "whimsical and playful", "melancholic and nostalgic", "tense and suspenseful", "romantic and hopeful"
         ]
-        st.session_state["world_mood"] = random.choice(random_moods)
-        st.rerun()
+        st.form_submit_button("🎲 Random Mood", key="random_mood", on_click=pick_random_value, args=("world_mood", random_moods))
     
-    if "world_mood" not in st.session_state:
-        st.session_state["world_mood"] = ""
-    world_mood = st.text_input(
-        "Your world's mood",
-        value=st.session_state["world_mood"],
-        placeholder="serene and dreamlike / cozy and warm / mysterious and dark / epic and adventurous",
-        key="world_mood"
-    )
+        if "world_mood" not in st.session_state:
+            st.session_state["world_mood"] = ""
+        world_mood = st.text_input(
+            "Your world's mood",
+            value=st.session_state["world_mood"],
+            placeholder="serene and dreamlike / cozy and warm / mysterious and dark / epic and adventurous",
+            key="world_mood"
+        )
 
-    if world_mood.strip():
-        # Dynamic feedback based on input
-        mood_lower = world_mood.lower()
-        if any(word in mood_lower for word in ["serene", "peaceful", "calm", "tranquil"]):
-            st.success("🧘 Such a beautiful mood! This world is going to feel unforgettable.")
-        elif any(word in mood_lower for word in ["cozy", "warm", "comfortable", "homey"]):
-            st.success("🏠 Such a beautiful mood! This world is going to feel unforgettable.")
-        elif any(word in mood_lower for word in ["mysterious", "dark", "enigmatic", "secret"]):
-            st.success("🔮 Such a beautiful mood! This world is going to feel unforgettable.")
-        elif any(word in mood_lower for word in ["epic", "adventurous", "heroic", "grand"]):
-            st.success("⚔️ Such a beautiful mood! This world is going to feel unforgettable.")
-        else:
-            st.success("💫 Such a beautiful mood! This world is going to feel unforgettable.")
+        if world_mood.strip():
+            # Dynamic feedback based on input
+            mood_lower = world_mood.lower()
+            if any(word in mood_lower for word in ["serene", "peaceful", "calm", "tranquil"]):
+                st.success("🧘 Such a beautiful mood! This world is going to feel unforgettable.")
+            elif any(word in mood_lower for word in ["cozy", "warm", "comfortable", "homey"]):
+                st.success("🏠 Such a beautiful mood! This world is going to feel unforgettable.")
+            elif any(word in mood_lower for word in ["mysterious", "dark", "enigmatic", "secret"]):
+                st.success("🔮 Such a beautiful mood! This world is going to feel unforgettable.")
+            elif any(word in mood_lower for word in ["epic", "adventurous", "heroic", "grand"]):
+                st.success("⚔️ Such a beautiful mood! This world is going to feel unforgettable.")
+            else:
+                st.success("💫 Such a beautiful mood! This world is going to feel unforgettable.")
 
-    # --- Magical Rule or Twist ---
-    st.markdown("### 🧬 Magical Rule or Twist")
-    st.markdown("**Is there something unique or magical about this world? Something that bends reality?**")
+        # --- Magical Rule or Twist ---
+        st.markdown("### 🧬 Magical Rule or Twist")
+        st.markdown("**Is there something unique or magical about this world? Something that bends reality?**")
 
-    # Add random button above input
-    if st.button("🎲 Random Magic", key="random_magic"):
+        # Add random button above input
         random_magics = [
             "time flows backward at sunset", "gravity works sideways", "memories become physical objects", "everyone can talk to animals", "dreams shape the landscape", "music controls the weather", "secrets are visible as glowing runes", "people swap bodies at midnight"
         ]
-        st.session_state["world_magic"] = random.choice(random_magics)
-        st.rerun()
+        st.form_submit_button("🎲 Random Magic", key="random_magic", on_click=pick_random_value, args=("world_magic", random_magics))
     
-    if "world_magic" not in st.session_state:
-        st.session_state["world_magic"] = ""
-    world_magic = st.text_input(
-        "Your world's magical twist",
-        value=st.session_state["world_magic"],
-        placeholder="time flows backward at sunset / gravity works sideways / memories become physical objects",
-        key="world_magic"
-    )
-
-    if world_magic.strip():
-        # Dynamic feedback based on input
-        magic_lower = world_magic.lower()
-        if any(word in magic_lower for word in ["time", "clock", "hour", "minute"]):
-            st.success("⏰ Whoa… that's such a cool twist! Your world just got even more unique.")
-        elif any(word in magic_lower for word in ["gravity", "float", "fall", "weight"]):
-            st.success("🌌 Whoa… that's such a cool twist! Your world just got even more unique.")
-        elif any(word in magic_lower for word in ["memory", "remember", "forget", "mind"]):
-            st.success("🧠 Whoa… that's such a cool twist! Your world just got even more unique.")
-        else:
-            st.success("🌀 Whoa… that's such a cool twist! Your world just got even more unique.")
-
-    # --- Genre Tags ---
-    st.markdown("### 🎬 Optional Genre Tags")
-    st.markdown("**Want to pick a genre to help shape the story? (You can mix two!)**")
-    genre_options = [
-        "Fantasy 🧝‍♀️", "Sci-Fi 🚀", "Romance 💘", "Slice of Life 🍰",
-        "Mystery 🔍", "Horror 👻", "Comedy 😂", "Action ⚔️", "Historical 🏯"
-    ]
-    if 'world_genre' not in st.session_state:
-        st.session_state['world_genre'] = []
-    selected_genres = st.multiselect(
-        "Your DreamForge's Genre(s)",
-        genre_options,
-        default=st.session_state['world_genre'],
-        key="world_genre"
-    )
-    if selected_genres:
-        # Dynamic feedback based on genre selection
-        genre_names = [g.split(' ', 1)[0] for g in selected_genres]
-        if "Slice of Life" in genre_names:
-            st.success("📚 Great choice! Your DreamForge will have a warm, reflective vibe with that genre.")
-        elif "Fantasy" in genre_names:
-            st.success("🧙‍♀️ Great choice! Your DreamForge will have a magical, wondrous vibe with that genre.")
-        elif "Sci-Fi" in genre_names:
-            st.success("🚀 Great choice! Your DreamForge will have a futuristic, innovative vibe with that genre.")
-        elif "Romance" in genre_names:
-            st.success("💕 Great choice! Your DreamForge will have a heartfelt, emotional vibe with that genre.")
-        else:
-            st.success("🌟 Great choice! Your DreamForge will have an amazing vibe with that genre.")
+        if "world_magic" not in st.session_state:
+            st.session_state["world_magic"] = ""
+        world_magic = st.text_input(
+            "Your world's magical twist",
+            value=st.session_state["world_magic"],
+            placeholder="time flows backward at sunset / gravity works sideways / memories become physical objects",
+            key="world_magic"
+        )
 
-    # --- AI Generate World Details Button ---
-    st.markdown("---")
-    if st.button("🤖 AI: Generate Your World Details", key="ai_generate_world_details", type="primary"):
-        # Get all the guided creation information
-        world_inspiration = st.session_state.get("world_inspiration", "")
-        world_environment = st.session_state.get("world_environment", "")
-        world_mood = st.session_state.get("world_mood", "")
-        world_magic = st.session_state.get("world_magic", "")
-        world_genres = st.session_state.get("world_genre", [])
-        
-        # Safety check for genres
-        if not isinstance(world_genres, list):
-            world_genres = []
-        
-        if not (world_inspiration.strip() or world_environment.strip() or world_mood.strip() or world_magic.strip()):
-            st.warning("Please fill in at least one of the guided creation fields above before generating world details.")
-        else:
-            # Build a comprehensive prompt with all available world information
-            genre_str = ', '.join([g.split(' ', 1)[0] for g in world_genres if g]) if world_genres else 'Fantasy'
+        if world_magic.strip():
+            # Dynamic feedback based on input
+            magic_lower = world_magic.lower()
+            if any(word in magic_lower for word in ["time", "clock", "hour", "minute"]):
+                st.success("⏰ Whoa… that's such a cool twist! Your world just got even more unique.")
+            elif any(word in magic_lower for word in ["gravity", "float", "fall", "weight"]):
+                st.success("🌌 Whoa… that's such a cool twist! Your world just got even more unique.")
+            elif any(word in magic_lower for word in ["memory", "remember", "forget", "mind"]):
+                st.success("🧠 Whoa… that's such a cool twist! Your world just got even more unique.")
+            else:
+                st.success("🌀 Whoa… that's such a cool twist! Your world just got even more unique.")
+
+        # --- Genre Tags ---
+        st.markdown("### 🎬 Optional Genre Tags")
+        st.markdown("**Want to pick a genre to help shape the story? (You can mix two!)**")
+        genre_options = [
+            "Fantasy 🧝‍♀️", "Sci-Fi 🚀", "Romance 💘", "Slice of Life 🍰",
+            "Mystery 🔍", "Horror 👻", "Comedy 😂", "Action ⚔️", "Historical 🏯"
+        ]
+        if 'world_genre' not in st.session_state:
+            st.session_state['world_genre'] = []
+        selected_genres = st.multiselect(
+            "Your DreamForge's Genre(s)",
+            genre_options,
+            default=st.session_state['world_genre'],
+            key="world_genre"
+        )
+        if selected_genres:
+            # Dynamic feedback based on genre selection
+            genre_names = [g.split(' ', 1)[0] for g in selected_genres]
+            if "Slice of Life" in genre_names:
+                st.success("📚 Great choice! Your DreamForge will have a warm, reflective vibe with that genre.")
+            elif "Fantasy" in genre_names:
+                st.success("🧙‍♀️ Great choice! Your DreamForge will have a magical, wondrous vibe with that genre.")
+            elif "Sci-Fi" in genre_names:
+                st.success("🚀 Great choice! Your DreamForge will have a futuristic, innovative vibe with that genre.")
+            elif "Romance" in genre_names:
+                st.success("💕 Great choice! Your DreamForge will have a heartfelt, emotional vibe with that genre.")
+            else:
+                st.success("🌟 Great choice! Your DreamForge will have an amazing vibe with that genre.")
+
+        # --- AI Generate World Details Button ---
+        st.markdown("---")
+        if st.form_submit_button("🤖 AI: Generate Your World Details", key="ai_generate_world_details", type="primary"):
+            # Get all the guided creation information
+            world_inspiration = st.session_state.get("world_inspiration", "")
+            world_environment = st.session_state.get("world_environment", "")
+            world_mood = st.session_state.get("world_mood", "")
+            world_magic = st.session_state.get("world_magic", "")
+            world_genres = st.session_state.get("world_genre", [])
+        
+            # Safety check for genres
+            if not isinstance(world_genres, list):
+                world_genres = []
+        
+            if not (world_inspiration.strip() or world_environment.strip() or world_mood.strip() or world_magic.strip()):
+                st.warning("Please fill in at least one of the guided creation fields above before generating world details.")
+            else:
+                # Build a comprehensive prompt with all available world information
+                genre_str = ', '.join([g.split(' ', 1)[0] for g in world_genres if g]) if world_genres else 'Fantasy'
             
-            prompt = f"""Generate world details for a DreamForge world based on the following information:
+                prompt = f"""Generate world details for a DreamForge world based on the following information:
 
 Inspiration: {world_inspiration}
 Environment: {world_environment}
@@ -2266,82 +4085,87 @@ Title: <world title>
 Setting: <detailed setting description>
 Keywords: <comma-separated keywords>"""
             
-            try:
-                response = model.generate_content(prompt)
-                generated_world = response.text.strip()
+                try:
+                    generated_world = cached_generate(get_model(call_site="generate_world_details"), prompt).strip()
                 
-                # Parse the response
-                title_match = re.search(r'Title\s*[:：\-]\s*(.*)', generated_world)
-                setting_match = re.search(r'Setting\s*[:：\-]\s*(.*)', generated_world)
-                keywords_match = re.search(r'Keywords\s*[:：\-]\s*(.*)', generated_world)
+                    # Parse the response
+                    title_match = re.search(r'Title\s*[:：\-]\s*(.*)', generated_world)
+                    setting_match = re.search(r'Setting\s*[:：\-]\s*(.*)', generated_world)
+                    keywords_match = re.search(r'Keywords\s*[:：\-]\s*(.*)', generated_world)
                 
-                if title_match:
-                    st.session_state['world_title'] = title_match.group(1).strip()
-                if setting_match:
-                    st.session_state['world_setting'] = setting_match.group(1).strip()
-                if keywords_match:
-                    st.session_state['world_keywords_input'] = keywords_match.group(1).strip()
+                    if title_match:
+                        st.session_state['world_title'] = title_match.group(1).strip()
+                    if setting_match:
+                        st.session_state['world_setting'] = setting_match.group(1).strip()
+                    if keywords_match:
+                        st.session_state['world_keywords_input'] = keywords_match.group(1).strip()
                 
-                st.success("🌟 World details generated successfully!")
-                st.rerun()
-            except Exception as e:
-                st.error(f"Failed to generate world details: {e}")
+                    st.success("🌟 World details generated successfully!")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to generate world details: {e}")
 
-    # --- DreamForge World Details (ALWAYS VISIBLE) ---
-    st.markdown("---")
-    st.markdown("### 🌟 Your DreamForge World Details")
-    st.markdown("**Review and edit your world details below, or use the guided creation above:**")
-    if 'world_title' not in st.session_state:
-        st.session_state['world_title'] = ''
-    world_title = st.text_input(
-        "DreamForge Title",
-        value=st.session_state['world_title'],
-        key="world_title_display"
-    )
-    if 'world_setting' not in st.session_state:
-        st.session_state['world_setting'] = ''
-    world_setting = st.text_area(
-        "Describe the World Setting",
-        value=st.session_state['world_setting'],
-        key="world_setting_display"
-    )
-    if 'world_keywords_input' not in st.session_state:
-        st.session_state['world_keywords_input'] = ''
-    world_keywords = st.text_input(
-        "Keywords",
-        value=st.session_state['world_keywords_input'],
-        key="world_keywords_display"
-    )
-    if world_title.strip() or world_setting.strip():
-        st.markdown('<div class="feedback-animation">🌟 <span class="emoji-sparkle">Your world is taking shape!</span> Ready to move to the next step!</div>', unsafe_allow_html=True)
+        st.form_submit_button("✅ Save World Ideas")
+
+    with st.form("world_details_form", border=False):
+        # --- DreamForge World Details (ALWAYS VISIBLE) ---
+        st.markdown("---")
+        st.markdown("### 🌟 Your DreamForge World Details")
+        st.markdown("**Review and edit your world details below, or use the guided creation above:**")
+        if 'world_title' not in st.session_state:
+            st.session_state['world_title'] = ''
+        world_title = st.text_input(
+            "DreamForge Title",
+            value=st.session_state['world_title'],
+            key="world_title_display"
+        )
+        if 'world_setting' not in st.session_state:
+            st.session_state['world_setting'] = ''
+        world_setting = st.text_area(
+            "Describe the World Setting",
+            value=st.session_state['world_setting'],
+            key="world_setting_display"
+        )
+        if 'world_keywords_input' not in st.session_state:
+            st.session_state['world_keywords_input'] = ''
+        world_keywords = st.text_input(
+            "Keywords",
+            value=st.session_state['world_keywords_input'],
+            key="world_keywords_display"
+        )
+        if world_title.strip() or world_setting.strip():
+            st.markdown('<div class="feedback-animation">🌟 <span class="emoji-sparkle">Your world is taking shape!</span> Ready to move to the next step!</div>', unsafe_allow_html=True)
+
+        st.form_submit_button("✅ Save World Details")
 
     # ===== STEP 2: CREATE YOUR CHARACTER (YOU IN THE WORLD) =====
     st.markdown("## 👤 Step 2: Create Your Character")
     st.markdown('<div id="step-2"></div>', unsafe_allow_html=True)
     st.info("Now let's meet you! You'll be the heart of this world, so tell us about yourself.")
 
-    # --- AI Character Generation Button ---
-    if st.button("✨ AI: Generate My Character", key="ai_generate_player_char", type="primary"):
-        # Get complete world information from Step 1
-        world_title = st.session_state.get('world_title', '')
-        world_setting = st.session_state.get('world_setting', '')
-        world_keywords = st.session_state.get('world_keywords_input', '')
-        world_genres = st.session_state.get('world_genre', [])
+    with st.form("player_character_form", border=False):
+        # --- AI Character Generation Button ---
+        if st.form_submit_button("✨ AI: Generate My Character", key="ai_generate_player_char", type="primary"):
+            # Get complete world information from Step 1
+            world_title = st.session_state.get('world_title', '')
+            world_setting = st.session_state.get('world_setting', '')
+            world_keywords = st.session_state.get('world_keywords_input', '')
+            world_genres = st.session_state.get('world_genre', [])
         
-        # Safety check for genres
-        if not isinstance(world_genres, list):
-            world_genres = []
+            # Safety check for genres
+            if not isinstance(world_genres, list):
+                world_genres = []
         
-        if not (world_title and world_setting):
-            st.warning("Please complete Step 1 (DreamForge World) before generating your character.")
-        else:
-            # Build a comprehensive prompt with all available world information
-            genre_str = ', '.join([g.split(' ', 1)[0] for g in world_genres if g]) if world_genres else 'Fantasy'
-            world_context = f"Title: {world_title}\nSetting: {world_setting}"
-            if world_keywords:
-                world_context += f"\nKeywords: {world_keywords}"
+            if not (world_title and world_setting):
+                st.warning("Please complete Step 1 (DreamForge World) before generating your character.")
+            else:
+                # Build a comprehensive prompt with all available world information
+                genre_str = ', '.join([g.split(' ', 1)[0] for g in world_genres if g]) if world_genres else 'Fantasy'
+                world_context = f"Title: {world_title}\nSetting: {world_setting}"
+                if world_keywords:
+                    world_context += f"\nKeywords: {world_keywords}"
             
-            prompt = f"""Generate a player character for the following DreamForge world.
+                prompt = f"""Generate a player character for the following DreamForge world.
 
 {world_context}
 
@@ -2351,53 +4175,61 @@ Respond with:
 - Name (a human name)
 - Traits (1-2 sentences about personality, quirks, or magical powers)"""
             
-            suggestion = generate_field(prompt)
-            # Parse the response
-            name = re.search(r'[Nn]ame\s*[:：\-]\s*(.*)', suggestion)
-            traits = re.search(r'[Tt]raits?\s*[:：\-]\s*(.*)', suggestion)
-            # Fallback: try to split lines if not matched
-            if not name or not traits:
-                lines = [l.strip() for l in suggestion.split('\n') if l.strip()]
-                if len(lines) >= 2:
-                    if not name:
-                        name = re.match(r'^(.*)$', lines[0])
-                    if not traits:
-                        traits = re.match(r'^(.*)$', lines[1])
-            valid = False
-            if name and traits:
-                clean_name = strip_stars(name.group(1))
-                clean_traits = strip_stars(traits.group(1))
-                if clean_name and clean_traits and not clean_name.lower().startswith("let's craft"):
-                    st.session_state['user_name_input'] = clean_name
-                    st.session_state['user_traits_input'] = clean_traits
-                    valid = True
-            if not valid:
-                st.error("AI could not generate a valid character. Please check your world info in Step 1 and try again.")
-            else:
-                st.rerun()
+                try:
+                    suggestion = generate_field(prompt, call_site="generate_player_character")
+                except Exception as e:
+                    # Deadline, retries or the circuit breaker gave up; keep the current character
+                    st.error(f"Failed to generate your character: {e}")
+                    suggestion = None
+                if suggestion is not None:
+                    # Parse the response
+                    name = re.search(r'[Nn]ame\s*[:：\-]\s*(.*)', suggestion)
+                    traits = re.search(r'[Tt]raits?\s*[:：\-]\s*(.*)', suggestion)
+                    # Fallback: try to split lines if not matched
+                    if not name or not traits:
+                        lines = [l.strip() for l in suggestion.split('\n') if l.strip()]
+                        if len(lines) >= 2:
+                            if not name:
+                                name = re.match(r'^(.*)$', lines[0])
+                            if not traits:
+                                traits = re.match(r'^(.*)$', lines[1])
+                    valid = False
+                    if name and traits:
+                        clean_name = strip_stars(name.group(1))
+                        clean_traits = strip_stars(traits.group(1))
+                        if clean_name and clean_traits and not clean_name.lower().startswith("let's craft"):
+                            st.session_state['user_name_input'] = clean_name
+                            st.session_state['user_traits_input'] = clean_traits
+                            valid = True
+                    if not valid:
+                        st.error("AI could not generate a valid character. Please check your world info in Step 1 and try again.")
+                    else:
+                        st.rerun()
 
-    # --- Character Name ---
-    if 'user_name_input' not in st.session_state:
-        st.session_state['user_name_input'] = ''
+        # --- Character Name ---
+        if 'user_name_input' not in st.session_state:
+            st.session_state['user_name_input'] = ''
     
-    user_name = st.text_input(
-        "Your Character's Name",
-        value=st.session_state['user_name_input'],
-        key="user_name_input"
-    )
+        user_name = st.text_input(
+            "Your Character's Name",
+            value=st.session_state['user_name_input'],
+            key="user_name_input"
+        )
 
-    # --- Character Traits ---
-    if 'user_traits_input' not in st.session_state:
-        st.session_state['user_traits_input'] = ''
+        # --- Character Traits ---
+        if 'user_traits_input' not in st.session_state:
+            st.session_state['user_traits_input'] = ''
     
-    user_traits = st.text_area(
-        "Your Character's Traits",
-        value=st.session_state['user_traits_input'],
-        key="user_traits_input"
-    )
+        user_traits = st.text_area(
+            "Your Character's Traits",
+            value=st.session_state['user_traits_input'],
+            key="user_traits_input"
+        )
     
-    if user_traits.strip():
-        st.success("🌟 Perfect! You're going to be the heart of this world.")
+        if user_traits.strip():
+            st.success("🌟 Perfect! You're going to be the heart of this world.")
+
+        st.form_submit_button("✅ Save My Character")
 
     st.markdown("---")
 
@@ -2439,128 +4271,44 @@ Respond with:
             if world_keywords:
                 world_context += f"\nKeywords: {world_keywords}"
             
-            # Generate each character individually based on their idea
+            # Generate every character concurrently; each prompt names its siblings' ideas so they
+            # start out distinct, and a repair pass below regenerates any that still clash
+            bypass = st.session_state.get("bypass_response_cache", False)
+            ideas = [st.session_state.get(f"idea_{i}", "").strip() for i in range(num_characters)]
+            generation_tasks = {}
             for i in range(num_characters):
-                # Get the character idea for this specific character
-                character_idea = st.session_state.get(f"idea_{i}", "").strip()
-                
-                # Build existing characters list (excluding current character)
-                other_chars = []
-                for j in range(num_characters):
-                    if j != i:  # Skip the current character being generated
-                        char_name = st.session_state.get(f"name_{j}", "")
-                        char_role = st.session_state.get(f"role_{j}", "")
-                        char_traits = st.session_state.get(f"trait_{j}", "")
-                        char_voice = st.session_state.get(f"voice_style_{j}", "")
-                        char_relationship = st.session_state.get(f"relationship_{j}", "")
-                        if char_name and char_traits:  # Only include characters that have been generated
-                            char_info = f"- {char_name} ({char_role}): {char_traits}"
-                            if char_voice and char_voice != "Default":
-                                char_info += f" | Voice: {char_voice}"
-                            if char_relationship and char_relationship.strip():
-                                char_info += f" | Relationship: {char_relationship}"
-                            other_chars.append(char_info)
-                
-                existing_chars_text = "\n".join(other_chars) if other_chars else "None"
-                
-                # Create prompt based on whether character idea exists
-                if character_idea:
-                    prompt = f"""Create a new character for the following world:
-
-{world_context}
-
-Player Character: {user_name} ({user_traits})
-
-Character Idea: {character_idea}
-
-Existing Characters:
-{existing_chars_text}
-
-Create a character that:
-- Incorporates the character idea: {character_idea}
-- Is clearly different from the player character and any existing characters
-- Would naturally exist in this world
-- Has an interesting personality and abilities
-- Could interact meaningfully with the player character
-- Fits the genre and tone of the world
-
-Respond in this format:
-Name: <A standard first name and optional last name only, no titles or descriptions>
-Role: <Character Role>
-Traits: <Personality traits and special abilities>
-Voice Style: <How do they speak?>
-Relationship: <How do they relate to the player character? Are they friends, rivals, mentors, etc.?>"""
-                else:
-                    prompt = f"""Create a new character for the following world:
-
-{world_context}
-
-Player Character: {user_name} ({user_traits})
-
-Existing Characters:
-{existing_chars_text}
-
-Create a character that:
-- Is clearly different from the player character and any existing characters
-- Would naturally exist in this world
-- Has an interesting personality and abilities
-- Could interact meaningfully with the player character
-- Fits the genre and tone of the world
-
-Respond in this format:
-Name: <A standard first name and optional last name only, no titles or descriptions>
-Role: <Character Role>
-Traits: <Personality traits and special abilities>
-Voice Style: <How do they speak?>
-Relationship: <How do they relate to the player character? Are they friends, rivals, mentors, etc.?>"""
-                
-                try:
-                    result = generate_field(prompt)
-                    # Parse the result
-                    parsed_name, parsed_role, parsed_traits, parsed_voice, parsed_relationship = "", "", "", "", ""
-                    try:
-                        # Use regex for robust parsing
-                        name_match = re.search(r'Name\s*[:：\-]\s*(.*)', result)
-                        role_match = re.search(r'Role\s*[:：\-]\s*(.*)', result)
-                        traits_match = re.search(r'Traits?\s*[:：\-]\s*(.*)', result)
-                        voice_match = re.search(r'Voice Style\s*[:：\-]\s*(.*)', result)
-                        relationship_match = re.search(r'Relationship\s*[:：\-]\s*(.*)', result)
-                        if name_match:
-                            parsed_name = name_match.group(1).strip()
-                        if role_match:
-                            parsed_role = role_match.group(1).strip()
-                        if traits_match:
-                            parsed_traits = traits_match.group(1).strip()
-                        if voice_match:
-                            parsed_voice = voice_match.group(1).strip()
-                        if relationship_match:
-                            parsed_relationship = relationship_match.group(1).strip()
-                    except Exception:
-                        pass
-                    
-                    # Store parsed fields in session state
-                    st.session_state[f"char_{i}"] = result
-                    st.session_state[f"name_{i}"] = parsed_name
-                    st.session_state[f"role_{i}"] = parsed_role
-                    st.session_state[f"trait_{i}"] = parsed_traits
-                    st.session_state[f"voice_style_{i}"] = parsed_voice
-                    st.session_state[f"relationship_{i}"] = parsed_relationship
-                    
-                    # Also update the input field values
-                    st.session_state[f"name_input_{i}"] = parsed_name
-                    st.session_state[f"role_input_{i}"] = parsed_role
-                    st.session_state[f"trait_input_{i}"] = parsed_traits
-                    st.session_state[f"voice_input_{i}"] = parsed_voice
-                    st.session_state[f"relationship_input_{i}"] = parsed_relationship
-                    
-                    # Increment generation counter to force form refresh
-                    current_gen_count = st.session_state.get(f"gen_count_{i}", 0)
-                    st.session_state[f"gen_count_{i}"] = current_gen_count + 1
-                    
-                    # Show success message
-                    st.success(f"✅ Character {i+1} generated successfully! The form below has been updated.")
-                except Exception as e:
-                    st.error(f"Failed to generate character {i+1}: {e}")
+                # Every sibling is listed by number, so no two prompts are identical (identical prompts
+                # would share one cached or coalesced response)
+                sibling_ideas = [
+                    f"- Character {j+1}: {ideas[j] or 'being created at the same time, make yours different'}"
+                    for j in range(num_characters) if j != i
+                ]
+                existing_chars_text = "\n".join(sibling_ideas) if sibling_ideas else "None"
+                prompt = build_character_prompt(world_context, user_name, user_traits, ideas[i], existing_chars_text)
+                generation_tasks[i] = (generate_field, (prompt, bypass, "generate_all_characters"), None)
+            results = run_llm_tasks(generation_tasks)
+            characters = [parse_character_fields(results[i]) if results[i] else None for i in range(num_characters)]
+            
+            # Dedupe/repair pass: regenerate clashing characters against the final cast
+            clashes = find_character_clashes(characters, user_name)
+            if clashes:
+                repair_tasks = {}
+                for i in clashes:
+                    others = [character_summary_line(characters[j]) for j in range(num_characters) if j != i and characters[j] and j not in clashes]
+                    others += [f"- Character {j+1}: being recreated at the same time, make yours different" for j in clashes if j != i]
+                    existing_chars_text = "\n".join(others) if others else "None"
+                    prompt = build_character_prompt(world_context, user_name, user_traits, ideas[i], existing_chars_text)
+                    repair_tasks[i] = (generate_field, (prompt, True, "repair_characters"), None)
+                repaired = run_llm_tasks(repair_tasks)
+                for i in clashes:
+                    if repaired[i]:
+                        results[i] = repaired[i]
+                        characters[i] = parse_character_fields(repaired[i])
+            
+            failed = []
+            for i in range(num_characters):
+                if characters[i] is None:
+                    failed.append(f"Character {i+1}")
                     # Set empty values if generation fails
                     st.session_state[f"char_{i}"] = ""
                     st.session_state[f"name_{i}"] = ""
@@ -2568,172 +4316,124 @@ Relationship: <How do they relate to the player character? Are they friends, riv
                     st.session_state[f"trait_{i}"] = ""
                     st.session_state[f"voice_style_{i}"] = ""
                     st.session_state[f"relationship_{i}"] = ""
+                else:
+                    store_character(i, results[i], characters[i])
             
-            st.success(f"✅ All {num_characters} characters generated successfully!")
+            # Kept in session state so the outcome is still shown after the rerun
+            if failed:
+                st.session_state["generate_characters_result"] = ("error", f"Failed to generate {len(failed)} of {num_characters} characters ({', '.join(failed)}). Try again or fill them in below.")
+            else:
+                st.session_state["generate_characters_result"] = ("success", f"✅ All {num_characters} characters generated successfully!")
             st.rerun()
 
+    generate_characters_result = st.session_state.pop("generate_characters_result", None)
+    if generate_characters_result:
+        level, message = generate_characters_result
+        (st.error if level == "error" else st.success)(message)
+
     # Character Forms
     characters = []
     for i in range(num_characters):
         st.markdown(f"### Character {i+1}")
         
-        # Character Idea
-        if f"idea_{i}" not in st.session_state:
-            st.session_state[f"idea_{i}"] = ""
-        idea = st.text_input(
-            f"Character Idea {i+1}",
-            placeholder="Knight with amnesia who might be evil / Librarian who hides a secret / Rival time mage",
-            key=f"idea_{i}"
-        )
+        with st.form(f"character_form_{i}", border=False):
+            # Character Idea
+            if f"idea_{i}" not in st.session_state:
+                st.session_state[f"idea_{i}"] = ""
+            idea = st.text_input(
+                f"Character Idea {i+1}",
+                placeholder="Knight with amnesia who might be evil / Librarian who hides a secret / Rival time mage",
+                key=f"idea_{i}"
+            )
         
-        # Generate Individual Character Button
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            if st.button(f"🧠 AI: Generate Character {i+1}", key=f"gen_{i}"):
-                if not idea.strip():
-                    st.warning(f"Please enter a character idea for Character {i+1} before generating.")
-                else:
-                    with st.spinner(f"Generating Character {i+1}..."):
-                        # Get complete world and user information
-                        world_genres = st.session_state.get("world_genre", [])
-                        # Safety check for genres
-                        if not isinstance(world_genres, list):
-                            world_genres = []
-                        genre_str = ', '.join([g.split(' ', 1)[0] for g in world_genres if g]) if world_genres else 'Fantasy'
-                        world_context = f"World: {world_setting}\nTitle: {world_title}\nGenre: {genre_str}"
-                        if world_keywords:
-                            world_context += f"\nKeywords: {world_keywords}"
+            # Generate Individual Character Button
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                if st.form_submit_button(f"🧠 AI: Generate Character {i+1}", key=f"gen_{i}"):
+                    if not idea.strip():
+                        st.warning(f"Please enter a character idea for Character {i+1} before generating.")
+                    else:
+                        with st.spinner(f"Generating Character {i+1}..."):
+                            # Get complete world and user information
+                            world_genres = st.session_state.get("world_genre", [])
+                            # Safety check for genres
+                            if not isinstance(world_genres, list):
+                                world_genres = []
+                            genre_str = ', '.join([g.split(' ', 1)[0] for g in world_genres if g]) if world_genres else 'Fantasy'
+                            world_context = f"World: {world_setting}\nTitle: {world_title}\nGenre: {genre_str}"
+                            if world_keywords:
+                                world_context += f"\nKeywords: {world_keywords}"
                         
-                        other_chars = []
-                        for j in range(num_characters):
-                            if j != i:  # Skip the current character being generated
-                                char_name = st.session_state.get(f"name_{j}", "")
-                                char_role = st.session_state.get(f"role_{j}", "")
-                                char_traits = st.session_state.get(f"trait_{j}", "")
-                                char_voice = st.session_state.get(f"voice_style_{j}", "")
-                                char_relationship = st.session_state.get(f"relationship_{j}", "")
-                                if char_name and char_traits:  # Only include characters that have been generated
-                                    char_info = f"- {char_name} ({char_role}): {char_traits}"
-                                    if char_voice and char_voice != "Default":
-                                        char_info += f" | Voice: {char_voice}"
-                                    if char_relationship and char_relationship.strip():
-                                        char_info += f" | Relationship: {char_relationship}"
-                                    other_chars.append(char_info)
+                            other_chars = []
+                            for j in range(num_characters):
+                                if j != i:  # Skip the current character being generated
+                                    char_name = st.session_state.get(f"name_{j}", "")
+                                    char_role = st.session_state.get(f"role_{j}", "")
+                                    char_traits = st.session_state.get(f"trait_{j}", "")
+                                    char_voice = st.session_state.get(f"voice_style_{j}", "")
+                                    char_relationship = st.session_state.get(f"relationship_{j}", "")
+                                    if char_name and char_traits:  # Only include characters that have been generated
+                                        char_info = f"- {char_name} ({char_role}): {char_traits}"
+                                        if char_voice and char_voice != "Default":
+                                            char_info += f" | Voice: {char_voice}"
+                                        if char_relationship and char_relationship.strip():
+                                            char_info += f" | Relationship: {char_relationship}"
+                                        other_chars.append(char_info)
                 
-                        existing_chars_text = "\n".join(other_chars) if other_chars else "None"
+                            existing_chars_text = "\n".join(other_chars) if other_chars else "None"
                         
-                        prompt = f"""Create a new character for the following world:
-
-{world_context}
-
-Player Character: {user_name} ({user_traits})
-
-Character Idea: {idea}
-
-Existing Characters:
-{existing_chars_text}
-
-Create a character that:
-- Incorporates the character idea: {idea}
-- Is clearly different from the player character and any existing characters
-- Would naturally exist in this world
-- Has an interesting personality and abilities
-- Could interact meaningfully with the player character
-- Fits the genre and tone of the world
-
-Respond in this format:
-Name: <A standard first name and optional last name only, no titles or descriptions>
-Role: <Character Role>
-Traits: <Personality traits and special abilities>
-Voice Style: <How do they speak?>
-Relationship: <How do they relate to the player character? Are they friends, rivals, mentors, etc.?>"""
+                            prompt = build_character_prompt(world_context, user_name, user_traits, idea, existing_chars_text)
                         
-                        try:
-                            result = generate_field(prompt)
-                            # Parse the result
-                            parsed_name, parsed_role, parsed_traits, parsed_voice, parsed_relationship = "", "", "", "", ""
                             try:
-                                # Use regex for robust parsing
-                                name_match = re.search(r'Name\s*[:：\-]\s*(.*)', result)
-                                role_match = re.search(r'Role\s*[:：\-]\s*(.*)', result)
-                                traits_match = re.search(r'Traits?\s*[:：\-]\s*(.*)', result)
-                                voice_match = re.search(r'Voice Style\s*[:：\-]\s*(.*)', result)
-                                relationship_match = re.search(r'Relationship\s*[:：\-]\s*(.*)', result)
-                                if name_match:
-                                    parsed_name = name_match.group(1).strip()
-                                if role_match:
-                                    parsed_role = role_match.group(1).strip()
-                                if traits_match:
-                                    parsed_traits = traits_match.group(1).strip()
-                                if voice_match:
-                                    parsed_voice = voice_match.group(1).strip()
-                                if relationship_match:
-                                    parsed_relationship = relationship_match.group(1).strip()
-                            except Exception:
-                                pass
+                                result = generate_field(prompt, call_site="generate_character")
+                                # Only update this specific character's data
+                                store_character(i, result, parse_character_fields(result))
                             
-                            # Only update this specific character's data
-                            st.session_state[f"char_{i}"] = result
-                            st.session_state[f"name_{i}"] = parsed_name
-                            st.session_state[f"role_{i}"] = parsed_role
-                            st.session_state[f"trait_{i}"] = parsed_traits
-                            st.session_state[f"voice_style_{i}"] = parsed_voice
-                            st.session_state[f"relationship_{i}"] = parsed_relationship
-                            
-                            # Also update the input field values
-                            st.session_state[f"name_input_{i}"] = parsed_name
-                            st.session_state[f"role_input_{i}"] = parsed_role
-                            st.session_state[f"trait_input_{i}"] = parsed_traits
-                            st.session_state[f"voice_input_{i}"] = parsed_voice
-                            st.session_state[f"relationship_input_{i}"] = parsed_relationship
-                            
-                            # Increment generation counter to force form refresh
-                            current_gen_count = st.session_state.get(f"gen_count_{i}", 0)
-                            st.session_state[f"gen_count_{i}"] = current_gen_count + 1
-                            
-                            # Show success message
-                            st.success(f"✅ Character {i+1} generated successfully! The form below has been updated.")
-                        except Exception as e:
-                            st.error(f"Failed to generate character {i+1}: {e}")
-        
-        # Parse generated character
-        default_text = st.session_state.get(f"char_{i}", "")
-        parsed_name = st.session_state.get(f"name_{i}", "")
-        parsed_role = st.session_state.get(f"role_{i}", "")
-        parsed_traits = st.session_state.get(f"trait_{i}", "")
-        parsed_voice = st.session_state.get(f"voice_style_{i}", "")
-        parsed_relationship = st.session_state.get(f"relationship_{i}", "")
-
-        # Character Details
-        # Use a unique key that changes when character is generated to force refresh
-        generation_key = st.session_state.get(f"gen_count_{i}", 0)
-        
-        # Get the current values from session state, with fallback to stored values
-        current_name = st.session_state.get(f"name_input_{i}", st.session_state.get(f"name_{i}", parsed_name))
-        current_role = st.session_state.get(f"role_input_{i}", st.session_state.get(f"role_{i}", parsed_role))
-        current_traits = st.session_state.get(f"trait_input_{i}", st.session_state.get(f"trait_{i}", parsed_traits))
-        current_voice = st.session_state.get(f"voice_input_{i}", st.session_state.get(f"voice_style_{i}", parsed_voice))
-        current_relationship = st.session_state.get(f"relationship_input_{i}", st.session_state.get(f"relationship_{i}", parsed_relationship))
-        
-        name = st.text_input(f"Name {i+1}", key=f"name_input_{i}", value=current_name)
-        role = st.text_input(f"Role {i+1}", key=f"role_input_{i}", value=current_role, placeholder="Librarian who hides a secret / Rival time mage")
-        trait = st.text_area(f"Key Traits {i+1}", key=f"trait_input_{i}", value=current_traits, height=100, placeholder="Describe their personality, abilities, and backstory...")
-        relationship = st.text_area(
-            f"Relationship with {user_name}",
-            value=current_relationship,
-            key=f"relationship_input_{i}",
-            placeholder="Close childhood friend who always looks out for you / Mysterious rival who challenges your beliefs / Wise mentor who guides your journey",
-            height=80
-        )
+                                # Show success message
+                                st.success(f"✅ Character {i+1} generated successfully! The form below has been updated.")
+                            except Exception as e:
+                                st.error(f"Failed to generate character {i+1}: {e}")
         
-        # Optional Add-ons
-        with st.expander(f"🌟 Optional Add-ons for Character {i+1}", expanded=False):
-            voice_style = st.text_input(
-                f"Voice Style",
-                value=current_voice,
-                key=f"voice_input_{i}"
+            # Parse generated character
+            default_text = st.session_state.get(f"char_{i}", "")
+            parsed_name = st.session_state.get(f"name_{i}", "")
+            parsed_role = st.session_state.get(f"role_{i}", "")
+            parsed_traits = st.session_state.get(f"trait_{i}", "")
+            parsed_voice = st.session_state.get(f"voice_style_{i}", "")
+            parsed_relationship = st.session_state.get(f"relationship_{i}", "")
+
+            # Character Details
+            # Use a unique key that changes when character is generated to force refresh
+            generation_key = st.session_state.get(f"gen_count_{i}", 0)
+        
+            # Get the current values from session state, with fallback to stored values
+            current_name = st.session_state.get(f"name_input_{i}", st.session_state.get(f"name_{i}", parsed_name))
+            current_role = st.session_state.get(f"role_input_{i}", st.session_state.get(f"role_{i}", parsed_role))
+            current_traits = st.session_state.get(f"trait_input_{i}", st.session_state.get(f"trait_{i}", parsed_traits))
+            current_voice = st.session_state.get(f"voice_input_{i}", st.session_state.get(f"voice_style_{i}", parsed_voice))
+            current_relationship = st.session_state.get(f"relationship_input_{i}", st.session_state.get(f"relationship_{i}", parsed_relationship))
+        
+            name = st.text_input(f"Name {i+1}", key=f"name_input_{i}", value=current_name)
+            role = st.text_input(f"Role {i+1}", key=f"role_input_{i}", value=current_role, placeholder="Librarian who hides a secret / Rival time mage")
+            trait = st.text_area(f"Key Traits {i+1}", key=f"trait_input_{i}", value=current_traits, height=100, placeholder="Describe their personality, abilities, and backstory...")
+            relationship = st.text_area(
+                f"Relationship with {user_name}",
+                value=current_relationship,
+                key=f"relationship_input_{i}",
+                placeholder="Close childhood friend who always looks out for you / Mysterious rival who challenges your beliefs / Wise mentor who guides your journey",
+                height=80
             )
         
+            # Optional Add-ons
+            with st.expander(f"🌟 Optional Add-ons for Character {i+1}", expanded=False):
+                voice_style = st.text_input(
+                    f"Voice Style",
+                    value=current_voice,
+                    key=f"voice_input_{i}"
+                )
+
+            st.form_submit_button(f"✅ Save Character {i+1}")
+
         # Sync the form values back to session state for persistence
         st.session_state[f"name_{i}"] = name
         st.session_state[f"role_{i}"] = role
@@ -2831,8 +4531,7 @@ Locations: <comma-separated list of 3-5 exploration targets>
 Chapters: <comma-separated list of 3-5 chapter names or discoveries>
 """
                 try:
-                    response = model.generate_content(prompt)
-                    generated_content = response.text.strip()
+                    generated_content = cached_generate(get_model(call_site="generate_exploration_plan"), prompt).strip()
                     
                     # Parse the response
                     locations_match = re.search(r'Locations\s*[:：\-]\s*(.*)', generated_content)
@@ -2932,8 +4631,7 @@ Goal: <main goal description>
 Success: <success condition description>
 """
                 try:
-                    response = model.generate_content(prompt)
-                    generated_content = response.text.strip()
+                    generated_content = cached_generate(get_model(call_site="generate_goal_mission"), prompt).strip()
                     
                     # Parse the response
                     goal_match = re.search(r'Goal\s*[:：\-]\s*(.*)', generated_content)
@@ -3032,8 +4730,7 @@ Create a vivid opening scene that:
 Generate only the opening scene description, nothing else.
 """
                 try:
-                    response = model.generate_content(prompt)
-                    generated_opening = response.text.strip()
+                    generated_opening = cached_generate(get_model(call_site="generate_opening_scene"), prompt).strip()
                     if generated_opening.startswith('"') and generated_opening.endswith('"'):
                         generated_opening = generated_opening[1:-1]
                     st.session_state["opening_scene_input"] = generated_opening
@@ -3133,54 +4830,58 @@ Gameplay Mode: {selected_mode}
             prompt += "\nIMPORTANT: Include the COMPLETE relationship text for each character in the JSON, not just a summary. Preserve all the relationship details exactly as provided."
             prompt += "\nRespond with raw JSON only. Do NOT include a 'choices' field in the JSON. The player character should NOT have a voice_style or relationship field. Include all the advanced settings fields in the JSON output."
 
-            response = model.generate_content(prompt)
-            output = response.text.strip()
-
-            if output.startswith("```json"):
-                output = output.replace("```json", "").strip()
-            if output.endswith("```"):
-                output = output[:-3].strip()
-
+            template_model = get_model(generation_config=STORY_TEMPLATE_CONFIG, call_site="generate_template")
             try:
-                world_json = json.loads(output)
-                # Remove 'choices' if present
-                if 'choices' in world_json:
-                    del world_json['choices']
-                # Remove 'voice_style' and 'relationship' from player (assume first character is player)
-                if 'characters' in world_json and len(world_json['characters']) > 0:
-                    if 'voice_style' in world_json['characters'][0]:
-                        del world_json['characters'][0]['voice_style']
-                    if 'relationship' in world_json['characters'][0]:
-                        del world_json['characters'][0]['relationship']
+                output = cached_generate(template_model, prompt, validate=is_json_object).strip()
+                if not is_json_object(output):
+                    # Beyond local repair (and so not cached); try once more with a fresh response
+                    output = cached_generate(template_model, prompt, bypass=True, validate=is_json_object).strip()
+            except Exception as e:
+                # Deadline, retries or the circuit breaker gave up; keep the current template
+                st.error(f"Failed to generate template: {e}")
+                output = None
+
+            if output is not None:
+                try:
+                    world_json = load_json_object(output)
+                    # Remove 'choices' if present
+                    if 'choices' in world_json:
+                        del world_json['choices']
+                    # Remove 'voice_style' and 'relationship' from player (assume first character is player)
+                    if 'characters' in world_json and len(world_json['characters']) > 0:
+                        if 'voice_style' in world_json['characters'][0]:
+                            del world_json['characters'][0]['voice_style']
+                        if 'relationship' in world_json['characters'][0]:
+                            del world_json['characters'][0]['relationship']
                 
-                # Store gameplay mode information
-                world_json['gameplayMode'] = selected_mode
-                if selected_mode == "🌍 Explore the World":
-                    world_json['modeDetails'] = {
-                        'exploration_locations': st.session_state.get('exploration_locations', ''),
-                        'exploration_chapters': st.session_state.get('exploration_chapters', '')
-                    }
-                elif selected_mode == "🎯 Achieve a Goal":
-                    world_json['modeDetails'] = {
-                        'main_goal': st.session_state.get('goal_main', ''),
-                        'success_condition': st.session_state.get('goal_success', '')
-                    }
+                    # Store gameplay mode information
+                    world_json['gameplayMode'] = selected_mode
+                    if selected_mode == "🌍 Explore the World":
+                        world_json['modeDetails'] = {
+                            'exploration_locations': st.session_state.get('exploration_locations', ''),
+                            'exploration_chapters': st.session_state.get('exploration_chapters', '')
+                        }
+                    elif selected_mode == "🎯 Achieve a Goal":
+                        world_json['modeDetails'] = {
+                            'main_goal': st.session_state.get('goal_main', ''),
+                            'success_condition': st.session_state.get('goal_success', '')
+                        }
                 
-                st.session_state["world_json"] = world_json
-                st.success("🎉 DreamForge story template generated successfully!")
-                st.json(world_json)
-                # Reset exploration log when template is regenerated
-                if "exploration_log" in st.session_state:
-                    del st.session_state["exploration_log"]
-                if "exploration_progress" in st.session_state:
-                    del st.session_state["exploration_progress"]
-                if "journey_summary" in st.session_state:
-                    del st.session_state["journey_summary"]
-                if "show_journey_summary" in st.session_state:
-                    del st.session_state["show_journey_summary"]
-            except json.JSONDecodeError:
-                st.error("Failed to parse JSON. Please try again.")
-                st.code(output)
+                    st.session_state["world_json"] = world_json
+                    st.success("🎉 DreamForge story template generated successfully!")
+                    st.json(world_json)
+                    # Reset exploration log when template is regenerated
+                    if "exploration_log" in st.session_state:
+                        del st.session_state["exploration_log"]
+                    if "exploration_progress" in st.session_state:
+                        del st.session_state["exploration_progress"]
+                    if "journey_summary" in st.session_state:
+                        del st.session_state["journey_summary"]
+                    if "show_journey_summary" in st.session_state:
+                        del st.session_state["show_journey_summary"]
+                except ValueError:
+                    st.error("Failed to parse JSON. Please try again.")
+                    st.code(output)
 
     st.markdown("---")
 
@@ -3259,18 +4960,32 @@ JSON:
 
 Write the opening scene below in proper visual novel script format:
 """
+            opening_color = random.choice(["#fce4ec", "#e3f2fd", "#e8f5e9", "#fff8e1", "#ede7f6"])
+            model = get_model(call_site="opening_turn")
             try:
-                first_turn = model.generate_content(story_prompt).text.strip()
+                if STREAM_RESPONSES:
+                    opening_placeholder = st.empty()
+                    first_turn = stream_generate(
+                        model,
+                        story_prompt,
+                        lambda text: opening_placeholder.markdown(story_block_html(text, "", opening_color, cached=False), unsafe_allow_html=True),
+                    ).strip()
+                else:
+                    first_turn = model.generate_content(story_prompt).text.strip()
 
                 if first_turn.startswith("{") or first_turn.startswith('"title"'):
+                    if STREAM_RESPONSES:
+                        opening_placeholder.empty()
                     st.error("Model returned raw JSON instead of story text. Please retry.")
                 else:
                     # Clean up the initial story response
                     cleaned_first_turn = clean_story_response(first_turn)
                     
                     st.session_state["game_state"] = [cleaned_first_turn]
-                    st.session_state["story_colors"] = [random.choice(["#fce4ec", "#e3f2fd", "#e8f5e9", "#fff8e1", "#ede7f6"])]
+                    st.session_state["story_colors"] = [opening_color]
                     st.session_state["user_inputs"] = [""]
+                    st.session_state.pop("story_history_turns", None)
+                    st.session_state.pop("show_creation", None)
                     # Reset exploration log for new game
                     if "exploration_log" in st.session_state:
                         del st.session_state["exploration_log"]
@@ -3286,6 +5001,9 @@ Write the opening scene below in proper visual novel script format:
                     # Reset goal_action_log for new game
                     if "goal_action_log" in st.session_state:
                         del st.session_state["goal_action_log"]
+                    # Reset cached choices for new game
+                    if "choices_cache" in st.session_state:
+                        del st.session_state["choices_cache"]
                     st.rerun()
             except Exception as e:
                 st.error(f"Error starting the game: {e}")
@@ -3294,236 +5012,18 @@ Write the opening scene below in proper visual novel script format:
                 st.session_state["game_state"] = [fallback_opening]
                 st.session_state["story_colors"] = [random.choice(["#fce4ec", "#e3f2fd", "#e8f5e9", "#fff8e1", "#ede7f6"])]
                 st.session_state["user_inputs"] = [""]
+                st.session_state.pop("story_history_turns", None)
+                st.session_state.pop("show_creation", None)
                 st.rerun()
 
     # --- Game UI (only appears after game starts) ---
+    # The game itself renders in the play view above; from the creation steps it can be resumed
     if "game_state" in st.session_state:
         st.markdown("---")
         st.subheader("🚀 Game In Progress")
-
-        # Get gameplay mode for sidebar
-        world_json = st.session_state.get("world_json", {})
-        gameplay_mode = world_json.get('gameplayMode', '')
-
-        # Create columns for main game and sidebar
-        if gameplay_mode and gameplay_mode in ["🌍 Explore the World", "🎯 Achieve a Goal"]:
-            game_col, sidebar_col = st.columns([3, 1])
-            
-            with game_col:
-                for i, (block, user_input) in enumerate(zip(st.session_state["game_state"], st.session_state["user_inputs"])):
-                    color = st.session_state.get("story_colors", ["#e3f2fd"])[i % len(st.session_state["story_colors"])]
-                    user_reply_html = f'<p style="margin-bottom:8px; padding:4px; background-color:#f0f0f0; border-radius:4px;"><b>You:</b> {user_input}</p>' if user_input.strip() else ""
-
-                    # Enhanced formatting for better readability
-                    formatted_block = format_story_block(block)
-
-                    st.markdown(
-                        f'<div style="background-color:{color}; padding:15px; border-radius:10px; margin-bottom:15px; box-shadow:0 2px 4px rgba(0,0,0,0.1)">{user_reply_html}{formatted_block}</div>',
-                        unsafe_allow_html=True,
-                    )
-
-                # Game input (only appears when game is active)
-                if not st.session_state.get("show_journey_summary"):
-                    st.markdown("### 🎮 Your Turn")
-                    
-                    # Generate 3 choice options
-                    choices = generate_choices()
-                    
-                    # Display choice buttons vertically with full description
-                    st.markdown("**Choose an action or write your own:**")
-                    for idx, choice in enumerate(choices):
-                        btn_label = f"Choice {idx+1}: {choice}"
-                        if st.button(btn_label, key=f"choice_{idx+1}_{len(st.session_state['game_state'])}", on_click=handle_choice_click, args=(choice,)):
-                            pass
-                    
-                    # Freeform input
-                    st.markdown("**Or write your own action/dialogue:**")
-                    st.text_input("Enter your next action or dialogue", key="reply_input")
-                    
-                    # Always show Send button below input
-                    st.button("Send", on_click=handle_send)
-
-                    # Show goal completion feedback below input if progress is 100%
-                    if gameplay_mode == "🎯 Achieve a Goal":
-                        progress = st.session_state.get("goal_progress", 0)
-                        mode_details = world_json.get('modeDetails', {})
-                        main_goal = mode_details.get('main_goal', 'Unknown Goal')
-                        if progress >= 100:
-                            st.success("🏆 You achieved your goal!")
-                            st.markdown(f"**Goal:** {main_goal}")
-                            st.markdown(f"**Completed in:** {len(st.session_state.get('game_state', []))} turns")
-
-                    # Create columns for End Journey button (for exploration mode)
-                    if gameplay_mode == "🌍 Explore the World":
-                        send_col, end_col = st.columns([1, 1])
-                        with end_col:
-                            if st.button("🛑 End Journey", key="end_exploration_main"):
-                                with st.spinner("Writing the epilogue to your journey..."):
-                                    world_title = world_json.get('title', None)
-                                    summary = generate_journey_summary(st.session_state.get("exploration_log", []), None, world_title)
-                                    st.session_state["journey_summary"] = summary
-                                    st.session_state["show_journey_summary"] = True
-                                    st.rerun()
-                    # ... (rest of gameplay modes) ...
-
-                # After the story blocks, show the journey summary if available
-                if st.session_state.get("show_journey_summary"):
-                    st.success("✨ Your exploration of DreamForge is complete! See your journey summary below.")
-                    with st.container():
-                        st.markdown("---")
-                        st.markdown("### Your Journey's Epilogue")
-                        st.markdown(st.session_state["journey_summary"])
-                        if st.button("Back to Creation"):
-                            st.session_state["show_journey_summary"] = False
-                            st.rerun()
-            
-            with sidebar_col:
-                # Gameplay Mode Sidebar
-                if gameplay_mode == "🌍 Explore the World":
-                    st.markdown("""
-                    <div class="memories-sidebar">
-                        <h3>🌍 Discovery Log</h3>
-                        <p style="color: #6c757d; font-size: 14px; margin-bottom: 20px;">
-                            <em>Places and mysteries you've uncovered</em>
-                        </p>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Progress bar removed – exploration is open-ended
-                    if "exploration_log" in st.session_state and st.session_state["exploration_log"]:
-                        for i, discovery in enumerate(st.session_state["exploration_log"]):
-                            st.markdown(f"""
-                            <div class=\"memory-card\">
-                                <p class=\"memory-text\">{discovery}</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                    else:
-                        st.markdown("""
-                        <div class=\"empty-memories\">
-                            No discoveries yet.<br>
-                            Keep exploring to uncover secrets! 🗺️
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                elif gameplay_mode == "🎯 Achieve a Goal":
-                    st.markdown("""
-                    <div class="memories-sidebar">
-                        <h3>🎯 Goal Progress</h3>
-                        <p style="color: #6c757d; font-size: 14px; margin-bottom: 20px;">
-                            <em>Track your mission progress</em>
-                        </p>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    mode_details = world_json.get('modeDetails', {})
-                    main_goal = mode_details.get('main_goal', 'Unknown Goal')
-                    success_condition = mode_details.get('success_condition', '')
-                    
-                    # Goal information card
-                    st.markdown(f"""
-                    <div class="memory-card">
-                        <p class="memory-text"><strong>Goal:</strong> {main_goal}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    if success_condition:
-                        st.markdown(f"""
-                        <div class="memory-card">
-                            <p class="memory-text"><strong>Success:</strong> {success_condition}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    # Progress bar
-                    progress = st.session_state.get("goal_progress", 0)
-                    st.progress(progress / 100)
-                    st.markdown(f"**Progress:** {progress}%")
-                    
-                    # Recent Actions - show complete information
-                    if "goal_action_log" in st.session_state and st.session_state["goal_action_log"]:
-                        st.markdown("**Recent Actions:**")
-                        for i, action_summary in enumerate(st.session_state["goal_action_log"], 1):
-                            if action_summary:
-                                st.markdown(f"""
-                                <div class="memory-card">
-                                    <p class="memory-text"><strong>{i}.</strong> {action_summary}</p>
-                                </div>
-                                """, unsafe_allow_html=True)
-                    else:
-                        st.markdown("""
-                        <div class="empty-memories">
-                            No actions yet.<br>
-                            Start playing to make progress! 🚀
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-        else:
-            # No sidebar layout for other modes
-            for i, (block, user_input) in enumerate(zip(st.session_state["game_state"], st.session_state["user_inputs"])):
-                color = st.session_state.get("story_colors", ["#e3f2fd"])[i % len(st.session_state["story_colors"])]
-                user_reply_html = f'<p style="margin-bottom:8px; padding:4px; background-color:#f0f0f0; border-radius:4px;"><b>You:</b> {user_input}</p>' if user_input.strip() else ""
-
-                # Enhanced formatting for better readability
-                formatted_block = format_story_block(block)
-
-                st.markdown(
-                    f'<div style="background-color:{color}; padding:15px; border-radius:10px; margin-bottom:15px; box-shadow:0 2px 4px rgba(0,0,0,0.1)">{user_reply_html}{formatted_block}</div>',
-                    unsafe_allow_html=True,
-                )
-
-            # Game input (only appears when game is active)
-            st.markdown("### 🎮 Your Turn")
-            
-            # Generate 3 choice options
-            choices = generate_choices()
-            
-            # Display choice buttons vertically with full description
-            st.markdown("**Choose an action or write your own:**")
-            for idx, choice in enumerate(choices):
-                btn_label = f"Choice {idx+1}: {choice}"
-                if st.button(btn_label, key=f"choice_{idx+1}_{len(st.session_state['game_state'])}", on_click=handle_choice_click, args=(choice,)):
-                    pass
-            
-            # Freeform input
-            st.markdown("**Or write your own action/dialogue:**")
-            st.text_input("Enter your next action or dialogue", key="reply_input")
-            
-            # Always show Send button below input
-            st.button("Send", on_click=handle_send)
-
-            # Show goal completion feedback below input if progress is 100%
-            if gameplay_mode == "🎯 Achieve a Goal":
-                progress = st.session_state.get("goal_progress", 0)
-                mode_details = world_json.get('modeDetails', {})
-                main_goal = mode_details.get('main_goal', 'Unknown Goal')
-                if progress >= 100:
-                    st.success("🏆 You achieved your goal!")
-                    st.markdown(f"**Goal:** {main_goal}")
-                    st.markdown(f"**Completed in:** {len(st.session_state.get('game_state', []))} turns")
-
-            # Create columns for End Journey button (for exploration mode)
-            if gameplay_mode == "🌍 Explore the World":
-                send_col, end_col = st.columns([1, 1])
-                with end_col:
-                    if st.button("🛑 End Journey", key="end_exploration_fallback"):
-                        st.success("✨ Your exploration of DreamForge is complete! Here's what you uncovered:")
-                        if "exploration_log" in st.session_state and st.session_state["exploration_log"]:
-                            for i, discovery in enumerate(st.session_state["exploration_log"]):
-                                st.markdown(f"• {discovery}")
-            elif gameplay_mode == "🎯 Achieve a Goal":
-                # Goal information display under the input
-                mode_details = world_json.get('modeDetails', {})
-                main_goal = mode_details.get('main_goal', 'Unknown Goal')
-                success_condition = mode_details.get('success_condition', '')
-                
-                st.markdown("---")
-                st.markdown("### 🎯 Your Mission")
-                st.info(f"**Goal:** {main_goal}")
-                if success_condition:
-                    st.info(f"**Success:** {success_condition}")
-                
-                st.button("Send", on_click=handle_send)
-            else:
-                st.button("Send", on_click=handle_send)
+        if st.button("▶️ Resume Game", key="resume_game"):
+            st.session_state["show_creation"] = False
+            st.rerun()
 
     # Footer
     st.caption("Built by Claire Wang for the DreamForge PM Take-Home Project ✨")
@@ -0,0 +1,51 @@
+"""Unit tests for parsing and streaming combined narrator turns.
+
+Usage:
+    python -m pytest -q
+"""
+import json
+
+import sekai_creation_agent_app as app
+
+
+def combined_response(**fields):
+    """A combined turn serialized the way Gemini's JSON mode orders it: properties sorted by name"""
+    result = {
+        app.COMBINED_TURN_FIELD: 'Mira (smiles) "Welcome back."\n**What do you do?**',
+        "choices": ["Greet Mira", "Look around", "Ask about the key"],
+        "action_summary": "You returned to the harbor.",
+        "discovery": "",
+        "goal_progress": 40,
+    }
+    result.update(fields)
+    return json.dumps(result, sort_keys=True)
+
+
+def test_story_turn_sorts_before_the_bookkeeping_fields():
+    assert sorted(app.COMBINED_TURN_SCHEMA["properties"])[0] == app.COMBINED_TURN_FIELD
+
+
+def test_partial_turn_is_shown_while_the_response_streams():
+    response = combined_response()
+    turn = json.loads(response)[app.COMBINED_TURN_FIELD]
+    # The turn is readable as soon as its first characters arrive, before any other field
+    assert app.partial_turn_text(response[:len(app.COMBINED_TURN_FIELD) + 15]) == "Mira (smi"
+    cut = response.index('"action_summary"')
+    assert app.partial_turn_text(response[:cut]) == turn
+    assert app.partial_turn_text('{"choices": ["Greet') is None
+
+
+def test_parse_accepts_a_complete_turn():
+    result = app.parse_combined_turn(combined_response())
+    assert app.combined_choices(result) == ["Greet Mira", "Look around", "Ask about the key"]
+    assert app.combined_goal_progress(result) == 40
+    assert app.combined_text(result, "discovery") is None
+
+
+def test_invalid_fields_are_left_to_the_fallback_calls():
+    result = app.parse_combined_turn(combined_response(choices=["Greet Mira", " "], goal_progress="lots"))
+    assert app.combined_choices(result) is None
+    assert app.combined_goal_progress(result) is None
+    assert app.combined_goal_progress({"goal_progress": 140}) == 100
+    assert app.parse_combined_turn(combined_response(**{app.COMBINED_TURN_FIELD: "  "})) is None
+    assert app.parse_combined_turn("The story continues...") is None
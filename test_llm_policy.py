@@ -0,0 +1,153 @@
+"""Unit tests for the process-wide LLM call policy: circuit breaker and rate limiter.
+
+Usage:
+    python -m pytest -q
+"""
+import threading
+import time
+
+import sekai_creation_agent_app as app
+
+
+def make_breaker(cooldown_seconds=60):
+    return app.CircuitBreaker(window=10, min_calls=4, failure_rate=0.5, cooldown_seconds=cooldown_seconds)
+
+
+def test_breaker_stays_closed_until_enough_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.allow()
+
+
+def test_breaker_opens_at_the_failure_rate():
+    breaker = make_breaker()
+    for success in (True, True, False, False):
+        breaker.record(success)
+    assert not breaker.allow()
+
+
+def test_breaker_half_opens_after_the_cooldown():
+    breaker = make_breaker(cooldown_seconds=0.05)
+    for _ in range(4):
+        breaker.record(False)
+    assert not breaker.allow()
+    time.sleep(0.06)
+    # Exactly one trial call goes through
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.allow()
+
+
+def test_breaker_reopens_when_the_trial_fails():
+    breaker = make_breaker(cooldown_seconds=0.05)
+    for _ in range(4):
+        breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert not breaker.allow()
+
+
+def test_limiter_allows_calls_within_the_request_budget():
+    limiter = app.RateLimiter(requests_per_minute=2, tokens_per_minute=0)
+    assert limiter.acquire(100, app.PRIORITY_INTERACTIVE, timeout=0.05)
+    assert limiter.acquire(100, app.PRIORITY_INTERACTIVE, timeout=0.05)
+    assert not limiter.acquire(100, app.PRIORITY_INTERACTIVE, timeout=0.05)
+
+
+def test_limiter_enforces_the_token_budget():
+    limiter = app.RateLimiter(requests_per_minute=0, tokens_per_minute=100)
+    assert limiter.acquire(80, app.PRIORITY_NORMAL, timeout=0.05)
+    assert not limiter.acquire(30, app.PRIORITY_NORMAL, timeout=0.05)
+
+
+def test_limiter_lets_an_oversized_prompt_through_on_a_full_bucket():
+    limiter = app.RateLimiter(requests_per_minute=0, tokens_per_minute=100)
+    assert limiter.acquire(500, app.PRIORITY_NORMAL, timeout=0.05)
+
+
+def test_limiter_serves_higher_priority_callers_first():
+    # One request every 0.1s, with the bucket already empty
+    limiter = app.RateLimiter(requests_per_minute=600, tokens_per_minute=0)
+    limiter._requests = 0
+    served = []
+
+    def call(name, priority):
+        if limiter.acquire(1, priority, timeout=2):
+            served.append(name)
+
+    background = threading.Thread(target=call, args=("background", app.PRIORITY_BACKGROUND))
+    interactive = threading.Thread(target=call, args=("interactive", app.PRIORITY_INTERACTIVE))
+    background.start()
+    time.sleep(0.02)
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert served == ["interactive", "background"]
+
+
+class RecordingBreaker:
+    """Breaker that always allows calls and remembers each recorded outcome"""
+
+    def __init__(self):
+        self.outcomes = []
+
+    def allow(self):
+        return True
+
+    def record(self, success):
+        self.outcomes.append(success)
+
+
+class FailingModel:
+    """Model whose every call raises the given error"""
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def call_with_breaker(monkeypatch, error):
+    breaker = RecordingBreaker()
+    monkeypatch.setattr(app, "get_circuit_breaker", lambda backend: breaker)
+    monkeypatch.setattr(app, "get_rate_limiter", lambda requests, tokens: None)
+    monkeypatch.setattr(app, "backoff_delay", lambda attempt: 0)
+    model = FailingModel(error)
+    try:
+        app.InstrumentedModel(model, "unspecified").generate_content("prompt", stream=True)
+    except type(error):
+        pass
+    return model.calls, breaker.outcomes
+
+
+def test_retried_call_records_one_breaker_failure(monkeypatch):
+    calls, outcomes = call_with_breaker(monkeypatch, ConnectionError("provider down"))
+    assert calls == app.DEFAULT_CALL_POLICY.retries + 1
+    assert outcomes == [False]
+
+
+def test_bad_request_does_not_count_against_the_provider(monkeypatch):
+    calls, outcomes = call_with_breaker(monkeypatch, ValueError("prompt blocked"))
+    assert calls == 1
+    assert outcomes == [True]
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 21))
+    assert app.percentile(values, 50) == 10
+    assert app.percentile(values, 95) == 19
+    assert app.percentile([7], 95) == 7
+
+
+def test_metrics_summary_reports_nearest_rank_percentiles():
+    metrics = app.LLMMetrics("")
+    for latency_ms in range(1, 21):
+        metrics.record({"call_site": "chat_reply", "outcome": "ok", "prompt_tokens": 10, "response_tokens": 5, "latency_ms": latency_ms})
+    row = metrics.summary()[0]
+    assert (row["p50 ms"], row["p95 ms"]) == (10, 19)
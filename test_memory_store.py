@@ -0,0 +1,93 @@
+"""Unit tests for the character-chat MemoryStore.
+
+Usage:
+    python -m pytest -q
+"""
+import numpy as np
+
+import sekai_creation_agent_app as app
+
+TOPICS = ["star", "sea", "tea", "map"]
+
+
+def topic_embedder(calls=None):
+    """Embedder mapping each text to the unit vector of its first word's topic, recording every batch"""
+    def embed(texts):
+        if calls is not None:
+            calls.append(list(texts))
+        vectors = np.zeros((len(texts), len(TOPICS) + 1), dtype=np.float32)
+        for row, text in enumerate(texts):
+            word = text.split()[0].lower()
+            vectors[row, TOPICS.index(word) if word in TOPICS else len(TOPICS)] = 1.0
+        return vectors
+    return embed
+
+
+def test_search_returns_everything_when_there_are_few_memories():
+    store = app.MemoryStore(topic_embedder())
+    memories = ["star gazing on the roof", "sea breeze at dawn"]
+    assert store.search("star maps", memories, k=5) == memories
+
+
+def test_search_returns_the_most_relevant_memories_in_list_order():
+    store = app.MemoryStore(topic_embedder())
+    memories = [
+        "sea shells on the beach",
+        "star named after you",
+        "tea in the garden",
+        "star shower last night",
+        "map of the old town",
+        "sea storm we survived",
+    ]
+    assert store.search("sea voyage plans", memories, k=2) == [memories[0], memories[5]]
+
+
+def test_duplicates_are_detected_by_text_and_by_similarity():
+    store = app.MemoryStore(topic_embedder())
+    memories = ["star named after you", "tea in the garden"]
+    assert not store.is_duplicate("sea breeze at dawn", [])
+    assert store.is_duplicate("tea in the garden", memories)
+    assert store.is_duplicate("star we both wished on", memories)
+    assert not store.is_duplicate("map of the old town", memories)
+
+
+def test_add_appends_only_new_memories():
+    store = app.MemoryStore(topic_embedder())
+    memories = ["star named after you"]
+    assert store.add("sea breeze at dawn", memories)
+    assert not store.add("star we both wished on", memories)
+    assert not store.add("", memories)
+    assert memories == ["star named after you", "sea breeze at dawn"]
+
+
+def test_each_text_is_embedded_once():
+    calls = []
+    store = app.MemoryStore(topic_embedder(calls))
+    memories = [f"{topic} memory {i}" for i, topic in enumerate(TOPICS * 2)]
+    store.search("star question", memories, k=2)
+    store.search("star question", memories, k=2)
+    store.search("sea question", memories, k=2)
+    assert calls == [memories + ["star question"], ["sea question"]]
+
+
+def test_queries_survive_pruning():
+    # Every query caches a vector; once the cache outgrows the memory list, a change to
+    # the list prunes it, and the query being answered must still be scored
+    store = app.MemoryStore(topic_embedder())
+    memories = [f"{topic} memory {i}" for i, topic in enumerate(TOPICS * 2)]
+    for i in range(100):
+        if i % 10 == 0:
+            memories.append(f"map memory {i}")
+        assert len(store.search(f"star question {i}", memories, k=2)) == 2
+        assert store.is_duplicate(f"tea thought {i}", memories)
+    assert len(store._vectors) <= 2 * len(memories) + 32 + 2
+
+
+def test_failing_embedder_falls_back_to_hashing():
+    def broken_embedder(texts):
+        raise ConnectionError("embedding service unavailable")
+
+    store = app.MemoryStore(broken_embedder)
+    memories = [f"We watched meteor shower number {i}" for i in range(8)]
+    assert len(store.search("meteor shower", memories, k=3)) == 3
+    assert store.embedder is app.hashing_embedder
@@ -0,0 +1,77 @@
+"""Unit tests for the roleplay PromptBuilder history window and rolling summary fold.
+
+Usage:
+    python -m pytest -q
+"""
+import sekai_creation_agent_app as app
+
+WORLD_JSON = {
+    "title": "The Lantern Isles",
+    "setting": "A chain of floating islands lit by living lanterns.",
+    "characters": [{"name": "Mira", "role": "Guide", "description": "Wise and patient"}],
+    "gameplayMode": "🎯 Achieve a Goal",
+    "modeDetails": {"main_goal": "Find the lost lantern key", "success_condition": "The key is returned"},
+}
+
+
+def play(builder, turns):
+    """Sync the builder with a game of the given number of turns"""
+    game_state = [f"Turn {i} happens." for i in range(turns)]
+    user_inputs = [""] + [f"action {i}" for i in range(1, turns)]
+    builder.sync(game_state, user_inputs)
+    return game_state, user_inputs
+
+
+def test_sync_formats_each_turn_once_and_restarts_for_a_new_game():
+    builder = app.PromptBuilder(WORLD_JSON)
+    play(builder, 3)
+    assert builder.history[0] == "Story: Turn 0 happens.\n\n"
+    assert builder.history[2] == "Player: action 2\nStory: Turn 2 happens.\n\n"
+    builder.sync(["A new game begins."], [""])
+    assert builder.history == ["Story: A new game begins.\n\n"]
+
+
+def test_context_includes_template_and_goal_progress():
+    builder = app.PromptBuilder(WORLD_JSON)
+    context = builder.narrator_context(goal_progress=40)
+    assert "Title: The Lantern Isles" in context
+    assert "Main Goal: Find the lost lantern key" in context
+    assert context.endswith("Goal Progress: 40%\n")
+
+
+def test_turns_are_folded_in_batches_once_they_leave_the_window():
+    builder = app.PromptBuilder(WORLD_JSON, window_turns=4, token_budget=10_000, fold_batch=3)
+    play(builder, 6)
+    assert builder.fold_request() is None
+    play(builder, 7)
+    previous_summary, aged_out, upto = builder.fold_request()
+    assert previous_summary == ""
+    assert upto == 3
+    assert aged_out == "".join(builder.history[:3])
+
+    builder.apply_fold("Mira guided the player across three islands.", upto)
+    history = builder.conversation_history()
+    assert history.startswith("STORY SO FAR (summary of earlier turns):\nMira guided the player across three islands.")
+    assert "Turn 2 happens." not in history
+    assert "Turn 3 happens." in history
+    assert builder.fold_request() is None
+
+
+def test_turns_fold_early_when_the_token_budget_runs_out():
+    builder = app.PromptBuilder(WORLD_JSON, window_turns=8, token_budget=20, fold_batch=4)
+    play(builder, 4)
+    fold = builder.fold_request()
+    assert fold is not None
+    assert 0 < fold[2] < 4
+    # The newest turn always stays verbatim
+    assert "Turn 3 happens." in builder.conversation_history()
+
+
+def test_stale_fold_is_ignored_after_a_new_game():
+    builder = app.PromptBuilder(WORLD_JSON, window_turns=4, token_budget=10_000, fold_batch=3)
+    play(builder, 7)
+    _, _, upto = builder.fold_request()
+    builder.sync(["A new game begins."], [""])
+    builder.apply_fold("Summary of the old game.", upto)
+    assert builder.summary == ""
+    assert builder.conversation_history() == "Story: A new game begins.\n\n"
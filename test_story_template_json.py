@@ -0,0 +1,83 @@
+"""Unit tests for the story template JSON repair and the validated response cache.
+
+Usage:
+    python -m pytest -q
+"""
+import json
+
+import pytest
+
+import sekai_creation_agent_app as app
+
+
+def repaired(text):
+    return json.loads(app.repair_json(text), strict=False)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"title": "A", "setting": "B", "pacing"', {"title": "A", "setting": "B"}),
+    ('{"title": "A", "pacing":', {"title": "A"}),
+    ('{"title": "A", "pac', {"title": "A"}),
+    ('{"title": "A", "setting": "The isl', {"title": "A", "setting": "The isl"}),
+    ('{"title": "A", "characters": [{"name": "Mira"', {"title": "A", "characters": [{"name": "Mira"}]}),
+    ('{"title": "A", "modeDetails": {"main_goal"', {"title": "A", "modeDetails": {}}),
+])
+def test_truncated_output_keeps_every_complete_member(text, expected):
+    assert repaired(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": "b" "c": "d"}', {"a": "b", "c": "d"}),
+    ('{"a": "b"\n  "c": "d"}', {"a": "b", "c": "d"}),
+    ('{"a": {"b": 1} "c": [1, 2] "d": true "e": "f"}', {"a": {"b": 1}, "c": [1, 2], "d": True, "e": "f"}),
+    ('{"a": ["x" "y"] "b": "say \\"hi\\""}', {"a": ["x", "y"], "b": 'say "hi"'}),
+])
+def test_missing_commas_are_inserted(text, expected):
+    assert repaired(text) == expected
+
+
+def test_fences_curly_quotes_and_trailing_commas_are_cleaned_up():
+    text = '```json\n{“title”: “A”, "characters": [{"name": "Mira",},],}\n```'
+    assert app.load_json_object(text) == {"title": "A", "characters": [{"name": "Mira"}]}
+
+
+def test_non_objects_are_rejected():
+    assert not app.is_json_object("The story begins in a quiet village.")
+    assert not app.is_json_object('["not", "an", "object"]')
+
+
+class DictCache:
+    """In-memory stand-in for the on-disk response cache"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def key_for(self, model, prompt):
+        return prompt
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, text):
+        self.entries[key] = text
+
+
+class ScriptedModel:
+    """Model that returns the given responses in order"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def generate_content(self, prompt):
+        return type("Response", (), {"text": self.responses.pop(0)})()
+
+
+def test_only_responses_that_pass_validation_are_cached(monkeypatch):
+    cache = DictCache()
+    monkeypatch.setattr(app, "get_response_cache", lambda: cache)
+    model = ScriptedModel("Sorry, I can't help with that.", '{"title": "A"}')
+    assert app.cached_generate(model, "template", bypass=False, validate=app.is_json_object) == "Sorry, I can't help with that."
+    assert cache.entries == {}
+    assert app.cached_generate(model, "template", bypass=False, validate=app.is_json_object) == '{"title": "A"}'
+    assert app.cached_generate(model, "template", bypass=False, validate=app.is_json_object) == '{"title": "A"}'
+    assert cache.entries == {"template": '{"title": "A"}'}